@@ -4,7 +4,8 @@ from typing import List
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.core.audio import SoundLoader
-from kivy.properties import ObjectProperty, ConfigParserProperty, BooleanProperty, NumericProperty, ListProperty
+from kivy.properties import ObjectProperty, ConfigParserProperty, BooleanProperty, NumericProperty, ListProperty, \
+    StringProperty
 
 from rcp.components.appsettings import config
 from rcp.components.home.coordbar import CoordBar
@@ -14,6 +15,10 @@ from rcp.dispatchers.formats import FormatsDispatcher
 from rcp.main import log
 from rcp.network.models import NetworkInterface, Wireless
 from rcp.utils import communication, devices
+from rcp.utils.axis import AxisEngine
+from rcp.utils.link import LinkState
+from rcp.utils.poller import Poller, PollRateScheduler, POLL_INTERVAL
+from rcp.utils.settings_writer import settings_writer
 
 
 class MainApp(App):
@@ -35,12 +40,16 @@ class MainApp(App):
 
     blink = BooleanProperty(False)
     connected = BooleanProperty(False)
+    link_state = StringProperty(LinkState.PROBING.value)
     formats = ObjectProperty()
     abs_inc = ConfigParserProperty(
         defaultvalue="ABS", section="global", key="abs_inc", config=config, val_type=str
     )
     currentOffset = NumericProperty(0)
     tool = NumericProperty(0)
+    settings_save_delay = ConfigParserProperty(
+        defaultvalue=1.0, section="global", key="settings_save_delay", config=config, val_type=float
+    )
     serial_port = ConfigParserProperty(
         defaultvalue="/dev/serial0", section="device", key="serial_port", config=config, val_type=str
     )
@@ -50,6 +59,10 @@ class MainApp(App):
     serial_address = ConfigParserProperty(
         defaultvalue=17, section="device", key="address", config=config, val_type=int
     )
+    serial_transport = ConfigParserProperty(
+        defaultvalue=communication.TRANSPORT_MINIMALMODBUS, section="device", key="transport", config=config,
+        val_type=str
+    )
     device = ObjectProperty()
     home = ObjectProperty()
     update_tick = NumericProperty(0)
@@ -64,16 +77,27 @@ class MainApp(App):
     )
 
     task_update = None
+    update_interval = POLL_INTERVAL
 
     def __init__(self, **kv):
-        self.fast_data_values = dict()
+        self.fast_data_values = None
+        self.configuration_values = None
+        self.poller = None
+        self.snapshot_sequence = None
+        self.axis_engine = AxisEngine(devices.SCALES_COUNT)
         try:
             self.connection_manager = communication.ConnectionManager(
                 serial_device=self.serial_port,
                 baudrate=self.serial_baudrate,
-                address=self.serial_address
+                address=self.serial_address,
+                transport=self.serial_transport,
             )
             self.device = devices.Global(connection_manager=self.connection_manager, base_address=0)
+            self.fast_data_device = self.device['fastData']
+            self.fast_data_values = self.fast_data_device.snapshot
+            self.poller = Poller(
+                self.fast_data_device, on_connect=self.prepare_connection, scheduler=PollRateScheduler()
+            )
 
         except Exception as e:
             log.error(f"Communication cannot be started, will try again: {e.__str__()}")
@@ -84,6 +108,9 @@ class MainApp(App):
         self.sound = SoundLoader.load(sound_file)
 
     def beep(self, *args, **kv):
+        # The sound can't be loaded on machines without an audio device
+        if self.sound is None:
+            return
         self.sound.volume = self.formats.volume
         self.sound.play()
 
@@ -118,35 +145,87 @@ class MainApp(App):
             return None
         return filtered_scales[0]
 
+    def read_configuration(self):
+        """
+        Reads in a single pass the values the widgets need when the connection is established
+        """
+        paths = [f"scales[{i}].syncEnable" for i in range(devices.SCALES_COUNT)]
+        self.configuration_values = self.device.read_variables(paths, max_gap=16)
+        return self.configuration_values is not None
+
+    def prepare_connection(self):
+        """
+        Runs on the polling thread when the link is established, before the first snapshot is published
+        """
+        self.connection_manager.negotiate_block_size(limit=self.device.size)
+        return self.read_configuration()
+
+    def engage_polling(self, reason: str, engaged: bool = True):
+        """
+        Polls at the fast rate while the named operation runs, even when nothing moves
+        """
+        if self.poller is not None and self.poller.scheduler is not None:
+            self.poller.scheduler.engage(reason, engaged)
+
     def update(self, *args):
-        try:
-            self.fast_data_values = self.device['fastData'].refresh()
+        """
+        Picks up the latest snapshot published by the polling thread, the bus is never accessed from here
+        """
+        if self.poller is None:
+            return
 
+        try:
+            sequence = self.poller.read_into(self.fast_data_values, self.snapshot_sequence)
         except Exception as e:
-            log.error(f"No connection: {e.__str__()}")
-            self.task_update.timeout = 2.0
-            self.connection_manager.connected = False
-
-        # Handle state change connected -> disconnected
-        if not self.connection_manager.connected:
-            self.connected = self.connection_manager.connected
-            self.task_update.timeout = 2.0
-            self.update_tick = (self.update_tick + 1) % 100
+            log.error(f"Unable to read the latest snapshot: {e.__str__()}")
+            return
+
+        new_data = sequence != self.snapshot_sequence
+        self.snapshot_sequence = sequence
 
-        # Handle state change disconnected -> connected
-        if not self.connected and self.connection_manager.connected:
-            self.task_update.timeout = 1.0 / 20
-            self.connected = self.connection_manager.connected
+        # Widgets bound to connected or link_state see the snapshot already updated
+        self.link_state = self.poller.link.state.value
+        if self.connected != self.poller.connected:
+            self.connected = self.poller.connected
 
-        if self.connection_manager.connected:
+        if self.connected and new_data:
+            self.update_axes()
             self.update_tick = (self.update_tick + 1) % 100
 
-        self.connected = self.connection_manager.connected
+        self.follow_poll_rate()
+
+    def follow_poll_rate(self):
+        """
+        Updates the display as fast as the snapshots are published while anything moves, and at the
+        default rate otherwise so that the link state is still shown promptly
+        """
+        interval = min(POLL_INTERVAL, self.poller.current_interval)
+        if interval == self.update_interval or self.task_update is None:
+            return
+        self.update_interval = interval
+        self.task_update.cancel()
+        self.task_update = Clock.schedule_interval(self.update, interval)
+
+    def update_axes(self):
+        """
+        Converts the counters of all the scales in one pass, only the scales that changed are updated
+        """
+        engine = self.axis_engine
+        changed = engine.update(
+            self.fast_data_values.scaleCurrent.to_list(),
+            self.fast_data_values.scaleSpeed.to_list(),
+            now=self.fast_data_values.timestamp,
+        )
+        for i in changed:
+            scale = self.scales[i]
+            scale.speed = engine.speeds[i]
+            scale.position = engine.positions[i]
 
     def blinker(self, *args):
         self.blink = not self.blink
 
     def build(self):
+        settings_writer.delay = self.settings_save_delay
         self.formats = FormatsDispatcher(id_override="0")
         self.servo = ServoBar(
             id_override="0",
@@ -155,11 +234,16 @@ class MainApp(App):
             self.scales.append(CoordBar(inputIndex=i, device=self.device, id_override=f"{i}"))
 
         self.home = HomePage()
-        self.task_update = Clock.schedule_interval(self.update, 1.0 / 30)
+        if self.poller is not None:
+            self.poller.start()
+        self.task_update = Clock.schedule_interval(self.update, self.update_interval)
         Clock.schedule_interval(self.blinker, 1.0 / 4)
 
         self.beep()
         return self.home
 
     def on_stop(self):
+        if self.poller is not None:
+            self.poller.stop(timeout=1.0)
+        settings_writer.stop(timeout=1.0)
         self.home.exit_stack.close()
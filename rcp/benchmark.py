@@ -0,0 +1,228 @@
+"""
+Benchmarks of the data path, from the registers of the simulated firmware to the widgets:
+
+    python ./rcp/benchmark.py --output results.json
+    python ./rcp/benchmark.py --compare results.json --tolerance 0.2
+
+Results are written as JSON, when a baseline is specified the run fails if any benchmark is
+slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from rcp.utils import communication, devices
+from rcp.utils.poller import ACTIVE_INTERVAL
+from rcp.utils.simulator import Simulator, constant_speed
+
+# Rate of the UI updates of the application while the axes move
+UPDATE_INTERVAL = ACTIVE_INTERVAL
+
+
+def summarize(name: str, samples: List[float], unit: str, **extra) -> Dict:
+    ordered = sorted(samples)
+    if len(ordered) == 0:
+        # Every round failed, reported without statistics and left out of the comparisons
+        print(f"{name}: no samples, {extra.get('failures', 0)} failures", file=sys.stderr)
+        return {"name": name, "unit": unit, "stats": {"rounds": 0}, "extra": extra}
+    return {
+        "name": name,
+        "unit": unit,
+        "stats": {
+            "rounds": len(ordered),
+            "min": ordered[0],
+            "max": ordered[-1],
+            "mean": statistics.fmean(ordered),
+            "median": statistics.median(ordered),
+            "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+            "stddev": statistics.pstdev(ordered),
+        },
+        "extra": extra,
+    }
+
+
+def bench_poll_rate(transport: str, duration: float) -> Dict:
+    """
+    Polls the FastData registers back to back, measuring the time of every poll and the sustained poll rate
+    """
+    simulator = Simulator(motions=[constant_speed(1000)])
+    simulator.start()
+    try:
+        dm = communication.ConnectionManager(serial_device=simulator.port, transport=transport)
+        device = devices.Global(connection_manager=dm, base_address=0)
+        dm.negotiate_block_size(limit=device.size)
+        fast_data = device["fastData"]
+
+        samples = []
+        failures = 0
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            started = time.perf_counter()
+            if fast_data.update_snapshot() is None:
+                failures += 1
+                continue
+            samples.append((time.perf_counter() - started) * 1000)
+        dm.close()
+    finally:
+        simulator.close()
+
+    return summarize(
+        f"poll[{transport}]",
+        samples,
+        "ms",
+        polls_per_second=len(samples) / duration,
+        failures=failures,
+    )
+
+
+def start_app(simulator: Simulator):
+    from rcp.components import appsettings
+    # The app writes its configuration whenever one of its settings changes, the run gets its own
+    # file so the configuration of the machine is never touched
+    appsettings.config_path = os.path.join(tempfile.mkdtemp(prefix="rcp-benchmark-"), "config.ini")
+    config = appsettings.config
+    config.filename = appsettings.config_path
+    if not config.has_section("device"):
+        config.adddefaultsection("device")
+    config.set("device", "serial_port", simulator.port)
+
+    from rcp.app import MainApp
+    app = MainApp()
+    app.build()
+
+    # Wait for the link to go live and the first snapshot to be published
+    deadline = time.monotonic() + 5
+    while not app.connected and time.monotonic() < deadline:
+        time.sleep(UPDATE_INTERVAL)
+        app.update()
+    if not app.connected:
+        raise Exception("Unable to connect to the simulator")
+    return app
+
+
+def bench_position_latency(app, simulator: Simulator, rounds: int) -> Dict:
+    """
+    Moves scale 0 to a new position and measures the time until its formatted position changes,
+    with the polling thread running and the UI updated at the rate of the application clock.
+    """
+    scale = app.scales[0]
+    samples = []
+    target = 0
+    for _ in range(rounds):
+        # A random phase, so that the changes don't line up with the polls or the UI updates
+        time.sleep(random.uniform(0, UPDATE_INTERVAL))
+        previous = scale.formattedPosition
+        target += 1000
+        changed = time.perf_counter()
+        simulator.set_motion(0, lambda t, position=target: position)
+        next_update = changed
+        while scale.formattedPosition == previous:
+            if time.perf_counter() - changed > 1.0:
+                raise Exception("The position was not updated within 1s")
+            next_update += UPDATE_INTERVAL
+            time.sleep(max(0.0, next_update - time.perf_counter()))
+            app.update()
+        samples.append((time.perf_counter() - changed) * 1000)
+    return summarize("position_latency", samples, "ms")
+
+
+def bench_tick_cost(app, simulator: Simulator, rounds: int) -> Dict:
+    """
+    Measures the time of MainApp.update, the axis engine and the update_tick handlers for a new snapshot,
+    with all the scales moving
+    """
+    app.poller.stop(timeout=1.0)
+    for i in range(devices.SCALES_COUNT):
+        simulator.set_motion(i, constant_speed(1000 * (i + 1)))
+    wall = []
+    cpu = []
+    for _ in range(rounds):
+        app.poller.poll_once()
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        app.update()
+        cpu.append((time.process_time() - started_cpu) * 1000)
+        wall.append((time.perf_counter() - started_wall) * 1000)
+    return summarize("tick_cost", wall, "ms", cpu_mean_ms=statistics.fmean(cpu))
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """
+    Returns a description of every benchmark that regressed compared to the baseline
+    """
+    previous = {item["name"]: item for item in baseline["benchmarks"]}
+    regressions = []
+    for item in results["benchmarks"]:
+        reference = previous.get(item["name"], None)
+        if reference is None or "mean" not in item["stats"] or "mean" not in reference["stats"]:
+            continue
+        mean = item["stats"]["mean"]
+        reference_mean = reference["stats"]["mean"]
+        if mean > reference_mean * (1 + tolerance):
+            regressions.append(f"{item['name']}: {mean:.3f} {item['unit']}, baseline {reference_mean:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the data path against the firmware simulator")
+    parser.add_argument("--output", help="File where the JSON results are written, stdout if not specified")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown compared to the baseline")
+    parser.add_argument("--duration", type=float, default=2.0, help="Duration of the poll benchmarks in seconds")
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    # Kivy must not parse the command line, and the settings of the benchmark run must not end up in the user folder
+    os.environ["KIVY_NO_ARGS"] = "1"
+    os.environ["HOME"] = tempfile.mkdtemp(prefix="rcp-benchmark-")
+
+    benchmarks = [
+        bench_poll_rate(communication.TRANSPORT_MINIMALMODBUS, args.duration),
+        bench_poll_rate(communication.TRANSPORT_ASYNCIO, args.duration),
+    ]
+
+    simulator = Simulator()
+    simulator.start()
+    try:
+        app = start_app(simulator)
+        benchmarks.append(bench_position_latency(app, simulator, args.rounds))
+        benchmarks.append(bench_tick_cost(app, simulator, args.rounds * 10))
+    finally:
+        simulator.close()
+
+    results = {
+        "datetime": datetime.now(timezone.utc).isoformat(),
+        "machine_info": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "benchmarks": benchmarks,
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for item in regressions:
+            print(f"Regression in {item}", file=sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
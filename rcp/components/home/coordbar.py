@@ -1,21 +1,17 @@
 import os
-import time
-import collections
 
-from decimal import Decimal
 from fractions import Fraction
 
 from kivy.logger import Logger
 from kivy.factory import Factory
-from kivy.clock import Clock
 from kivy.lang import Builder
 from kivy.properties import NumericProperty, StringProperty, ObjectProperty, ListProperty, BooleanProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.app import App
 
 from rcp.dispatchers import SavingDispatcher
-from rcp.utils.ctype_calc import uint32_subtract_to_int32
-from rcp.utils.devices import SCALES_COUNT
+from rcp.utils import axis
+from rcp.utils.display import DisplayUpdates
 
 log = Logger.getChild(__name__)
 kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
@@ -50,8 +46,6 @@ class CoordBar(BoxLayout, SavingDispatcher):
         "syncEnable",
         "speed",
         "scaledPosition",
-        "encoderPrevious",
-        "encoderCurrent",
         "currentOffset",
         "formattedSpeed",
         "formattedPosition",
@@ -65,44 +59,55 @@ class CoordBar(BoxLayout, SavingDispatcher):
     def __init__(self, **kv):
         from rcp.app import MainApp
         self.app: MainApp = App.get_running_app()
+        self.display = DisplayUpdates(self)
         super().__init__(**kv)
 
-        self.speed_history = collections.deque(maxlen=5)
-        self.previous_axis_time: float = 0
-        self.previous_axis_pos: Decimal = Decimal(0)
-        self.app.bind(currentOffset=self.update_scaledPosition)
-        self.app.formats.bind(factor=self.update_scaledPosition)
+        self.app.bind(currentOffset=self.configure_axis)
+        self.app.formats.bind(factor=self.configure_axis)
+        self.app.formats.bind(current_format=self.configure_axis)
         self.app.formats.bind(factor=self.set_sync_ratio)
         self.app.bind(connected=self.init_connection)
-        self.app.bind(update_tick=self.update_tick)
         self.bind(position=self.update_scaledPosition)
         self.bind(speed=self.update_scaledPosition)
-        self.bind(ratioNum=self.update_scaledPosition)
-        self.bind(ratioDen=self.update_scaledPosition)
-        self.update_scaledPosition(self, None)
-        Clock.schedule_interval(self.speed_task, 1.0/25.0)
-
-        # Private variables that don't need dispatchers etc
-        self.encoderPrevious = 0
-        self.encoderCurrent = 0
+        self.bind(
+            ratioNum=self.configure_axis,
+            ratioDen=self.configure_axis,
+            spindleMode=self.configure_axis,
+            stepsPerRev=self.configure_axis,
+            stepsPerMM=self.configure_axis,
+            offsets=self.configure_axis,
+        )
+        self.configure_axis()
 
     def init_connection(self, *args, **kv):
         """
-        This method is called when the connection is established
+        This method is called when the connection is established, the configuration was already
+        read by the resync of the link before it went live
         """
-        self.syncEnable = self.device['scales'][self.inputIndex]['syncEnable']
+        values = self.app.configuration_values
+        path = f"scales[{self.inputIndex}].syncEnable"
+        if not self.app.connected or values is None or path not in values:
+            return
+        self.syncEnable = values[path]
         self.set_sync_ratio()
 
-    def update_tick(self, *args, **kv):
-        try:
-            if not self.app.connected:
-                return
-
-            self.encoderPrevious = self.encoderCurrent
-            self.encoderCurrent = self.app.fast_data_values['scaleCurrent'][self.inputIndex]
-            self.position += uint32_subtract_to_int32(self.encoderCurrent, self.encoderPrevious)
-        except Exception as e:
-            log.error(f"Unable to update scale: {e.__str__()}")
+    def configure_axis(self, *args, **kv):
+        """
+        Passes the settings of the scale to the axis engine of the application, which converts the
+        encoder counters of all the scales on every snapshot
+        """
+        self.app.axis_engine.configure(
+            self.inputIndex,
+            ratio_num=self.ratioNum,
+            ratio_den=self.ratioDen,
+            offset=self.offsets[self.app.currentOffset],
+            factor=self.app.formats.factor,
+            spindle_mode=self.spindleMode,
+            steps_per_rev=self.stepsPerRev,
+            steps_per_mm=self.stepsPerMM,
+            current_format=self.app.formats.current_format,
+        )
+        self.update_scaledPosition(self, None)
 
     def toggle_sync(self):
         if not self.app.connected:
@@ -118,23 +123,18 @@ class CoordBar(BoxLayout, SavingDispatcher):
         if self.syncRatioDen == 0:
             self.syncRatioDen = 1
 
-        if self.spindleMode:
-            scale_ratio = Fraction(self.ratioNum, self.ratioDen)
-        else:
-            scale_ratio = Fraction(self.ratioNum, self.ratioDen) * self.app.formats.factor
-
-        if self.app.servo.elsMode:
-            # ELS Mode, the output is always metric so we need to account for the conversion
-            servo_ratio = Fraction(self.app.servo.ratioNum, self.app.servo.ratioDen) * self.app.formats.factor
-        else:
-            # NON Els mode we're in degrees always
-            servo_ratio = Fraction(self.app.servo.ratioNum, self.app.servo.ratioDen)
-
-        sync_ratio = Fraction(self.syncRatioNum, self.syncRatioDen)
-
-        final_ratio = scale_ratio * sync_ratio / servo_ratio
-        self.device['scales'][self.inputIndex]['syncRatioNum'] = final_ratio.numerator
-        self.device['scales'][self.inputIndex]['syncRatioDen'] = final_ratio.denominator
+        final_ratio = axis.sync_ratio(
+            self.ratioNum, self.ratioDen,
+            self.syncRatioNum, self.syncRatioDen,
+            self.app.servo.ratioNum, self.app.servo.ratioDen,
+            factor=self.app.formats.factor,
+            spindle_mode=self.spindleMode,
+            els_mode=self.app.servo.elsMode,
+        )
+        self.device['scales'][self.inputIndex].update({
+            'syncRatioNum': final_ratio.numerator,
+            'syncRatioDen': final_ratio.denominator,
+        })
 
     def on_syncRatioNum(self, instance, value):
         if self.app.home is None:
@@ -147,29 +147,18 @@ class CoordBar(BoxLayout, SavingDispatcher):
         self.set_sync_ratio()
 
     def update_scaledPosition(self, instance, value):
+        position, self.scaledPosition = self.app.axis_engine.scaled_position(self.inputIndex, self.position)
+        if position != self.position:
+            # Spindle angles wrapped around a full revolution
+            self.position = position
+
         if self.spindleMode:
             # When working in spindle mode we report the position in degrees
-            self.scaledPosition = float(
-                self.position * Fraction(self.ratioNum, self.ratioDen) + self.offsets[self.app.currentOffset]
-            ) * 360.0
-
-            if self.scaledPosition > 360.0:
-                self.scaledPosition -= 360.0
-                self.position -= self.stepsPerRev
-
-            if self.scaledPosition < 0:
-                self.scaledPosition += 360.0
-                self.position += self.stepsPerRev
-
-            self.formattedPosition = self.app.formats.angle_speed_format.format(self.speed)
-            self.formattedSpeed = self.app.formats.position_format.format(self.scaledPosition)
+            self.display.set("formattedPosition", self.app.formats.angle_speed_format, self.speed)
+            self.display.set("formattedSpeed", self.app.formats.position_format, self.scaledPosition)
         else:
-            self.scaledPosition = float(
-                self.position * Fraction(self.ratioNum, self.ratioDen) + self.offsets[self.app.currentOffset]
-            ) * self.app.formats.factor
-
-            self.formattedPosition = self.app.formats.position_format.format(self.scaledPosition)
-            self.formattedSpeed = self.app.formats.speed_format.format(self.speed)
+            self.display.set("formattedPosition", self.app.formats.position_format, self.scaledPosition)
+            self.display.set("formattedSpeed", self.app.formats.speed_format, self.speed)
 
     def on_newPosition(self, instance, value):
         self.set_current_position(value)
@@ -184,8 +173,6 @@ class CoordBar(BoxLayout, SavingDispatcher):
             raw_offset = value / self.app.formats.factor
             self.offsets[self.app.currentOffset] = float(raw_offset - raw_position)
             self.save_settings()
-            # Fixed line: pass self and None as arguments
-            self.update_scaledPosition(self, None)
 
     def update_position(self):
         if not self.spindleMode:
@@ -193,32 +180,3 @@ class CoordBar(BoxLayout, SavingDispatcher):
 
     def zero_position(self):
         self.set_current_position(0)
-
-    def speed_task(self, *args, **kv):
-        if self.app is None or self.app.fast_data_values is None:
-            return
-
-        if self.stepsPerMM == 0 and not self.spindleMode:
-            return
-
-        if self.stepsPerRev == 0 and self.spindleMode:
-            return
-
-        current_time = time.time()
-        steps_per_second = self.app.fast_data_values.get('scaleSpeed', [0] * SCALES_COUNT)[self.inputIndex]
-        self.speed_history.append(steps_per_second)
-        avg_steps_per_second = (sum(self.speed_history) / len(self.speed_history))
-
-        # Calculate Revs/Min for spindleMode
-        if self.spindleMode:
-            self.speed = (avg_steps_per_second / self.stepsPerRev) * 60
-
-        # Calculate feeds
-        if not self.spindleMode:
-            if self.app.formats.current_format == "MM":
-                self.speed = float(avg_steps_per_second * 60 * (1 / self.stepsPerMM) * (1 / 1000))
-            if self.app.formats.current_format == "IN":
-                self.speed = float(avg_steps_per_second * 60 * (1 / self.stepsPerMM) * (1 / 1000) * (120 / 254))
-
-        self.previous_axis_time = current_time
-        self.previous_axis_pos = self.position
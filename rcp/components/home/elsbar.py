@@ -1,5 +1,4 @@
 import os
-from fractions import Fraction
 
 from kivy.factory import Factory
 from kivy.logger import Logger
@@ -66,6 +65,10 @@ class ElsBar(BoxLayout, SavingDispatcher):
         # Add binding to format changes to update thread length units
         self.app.formats.bind(current_format=self.on_format_change)
         
+    def on_cycle_active(self, instance, value):
+        # The spindle slows down and the servo waits during a pass, the polling rate must not drop meanwhile
+        self.app.engage_polling("threading", value)
+
     # Add property getter for backlash amount
     @property
     def backlash_amount(self):
@@ -93,6 +96,11 @@ class ElsBar(BoxLayout, SavingDispatcher):
     def update_current_position(self):
         Factory.Keypad().show_with_callback(self.servo.set_current_position, self.servo.scaledPosition)
 
+    def show_feeds_table(self):
+        # Imported when first opened, the feeds table is not needed at startup
+        from rcp.components.home.feeds_table_popup import FeedsTablePopup
+        FeedsTablePopup().show_with_callback(self.set_feed_ratio)
+
     def set_feed_ratio(self, table_name, index):
         table_instance = feeds.table[table_name]
         self.mode_name = table_name
@@ -185,9 +193,8 @@ class ElsBar(BoxLayout, SavingDispatcher):
             
         if self.cycle_state == 1:  # cutting state
             # Calculate distance traveled using scaled position
-            distance = abs(self.app.servo.scaledPosition - 
-                          (self.cycle_start_position * Fraction(self.app.servo.ratioNum, 
-                                                              self.app.servo.ratioDen)))
+            distance = abs(self.app.servo.scaledPosition -
+                           self.app.servo.display_scaling.to_units(self.cycle_start_position))
             
             # The visual indicator will update automatically
             # through the property binding in the KV file
@@ -238,11 +245,5 @@ class ElsBar(BoxLayout, SavingDispatcher):
         if not self.cycle_active:
             return 0
         
-        # Use Fraction to handle precise ratio calculations
-        from fractions import Fraction
-        position_fraction = abs(self.app.servo.scaledPosition - 
-                      (self.cycle_start_position * Fraction(self.app.servo.ratioNum, 
-                                                          self.app.servo.ratioDen)))
-        
-        # Convert Fraction to float before returning
-        return float(position_fraction)
\ No newline at end of file
+        return abs(self.app.servo.scaledPosition -
+                   self.app.servo.display_scaling.to_units(self.cycle_start_position))
\ No newline at end of file
@@ -10,8 +10,6 @@ from kivy.properties import ObjectProperty
 from kivy.clock import Clock
 from kivy.uix.boxlayout import BoxLayout
 
-from rcp.components.home.jogbar import JogBar
-from rcp.components.home.statusbar import StatusBar
 from rcp.components.home.elsbar import ElsBar
 from rcp.components.home.home_toolbar import HomeToolbar
 
@@ -37,7 +35,8 @@ class HomePage(BoxLayout):
         self.add_widget(self.bars_container)
         #self.bars_container.add_widget(StatusBar())
         self.els_bar = ElsBar(id_override="0")
-        self.jog_bar = JogBar()
+        # Built when the JOG mode is first selected
+        self.jog_bar = None
 
         # Configure Current Mode, and disable Indexing mode if servo is set to ELS
         self.next_mode = self.app.current_mode
@@ -70,7 +69,8 @@ class HomePage(BoxLayout):
             return
 
         # Reset all the enables
-        self.jog_bar.enable_jog = False
+        if self.jog_bar is not None:
+            self.jog_bar.enable_jog = False
         self.app.servo.servoEnable = 0
 
         # Visualize things properly
@@ -83,6 +83,9 @@ class HomePage(BoxLayout):
             self.bars_container.remove_widget(self.bars_container.children[0])
             self.bars_container.add_widget(self.els_bar)
         if self.next_mode == 3: # JOG
+            if self.jog_bar is None:
+                from rcp.components.home.jogbar import JogBar
+                self.jog_bar = JogBar()
             self.bars_container: BoxLayout
             self.bars_container.remove_widget(self.bars_container.children[0])
             self.bars_container.add_widget(self.jog_bar)
@@ -4,9 +4,6 @@ from kivy.uix.widget import Widget
 
 from rcp.components.toolbars.toolbar_button import ToolbarButton
 from rcp.components.keypad import Keypad
-from rcp.components.plot.scene_popup import ScenePopup
-from rcp.components.setup.setup_popup import SetupPopup
-from rcp.components.home.mode_popup import ModePopup
 
 log = Logger.getChild(__name__)
 
@@ -51,6 +48,7 @@ class HomeToolbar(BoxLayout):
 
         # Magic Wand Button
        # def popup_scene(*_):
+       #     from rcp.components.plot.scene_popup import ScenePopup
        #     ScenePopup().open()
        # magic_wand = ToolbarButton(
        #     font_name="fonts/Font Awesome 6 Free-Solid-900.otf",
@@ -69,7 +67,9 @@ class HomeToolbar(BoxLayout):
             if self.app.current_mode == 3:
                 mode_button.text = "JOG"
 
+        # Popups are imported when they are first opened, to keep them out of the startup
         def popup_mode(*_):
+            from rcp.components.home.mode_popup import ModePopup
             ModePopup().show_with_callback(self.app.set_mode, self.app.current_mode)
         mode_button = ToolbarButton(
             text="IDX",
@@ -82,6 +82,7 @@ class HomeToolbar(BoxLayout):
 
         # Setup Button
         def popup_setup(*_):
+            from rcp.components.setup.setup_popup import SetupPopup
             SetupPopup().open()
         setup = ToolbarButton(
             font_name="fonts/Font Awesome 6 Free-Solid-900.otf",
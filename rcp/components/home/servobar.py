@@ -11,7 +11,9 @@ from kivy.uix.boxlayout import BoxLayout
 
 from rcp.dispatchers import SavingDispatcher
 from rcp.components.keypad import Keypad
-from rcp.utils.ctype_calc import uint32_subtract_to_int32
+from rcp.utils import axis
+from rcp.utils.counters import WrappedCounters
+from rcp.utils.display import DisplayUpdates
 
 log = Logger.getChild(__name__)
 
@@ -65,6 +67,9 @@ class ServoBar(BoxLayout, SavingDispatcher):
     def __init__(self, **kv):
         from rcp.app import MainApp
         self.app: MainApp = MainApp.get_running_app()
+        self.scaling = axis.AxisScaling()
+        self.display_scaling = axis.AxisScaling()
+        self.display = DisplayUpdates(self)
         super().__init__(**kv)
         self.configure_lead_screw_ratio(self, None)
 
@@ -75,22 +80,20 @@ class ServoBar(BoxLayout, SavingDispatcher):
 
         # Widget event bindings
         self.bind(divisions=self.update_positions)
-        self.bind(ratioNum=self.update_positions)
-        self.bind(ratioDen=self.update_positions)
-        self.bind(ratioNum=self.update_scaledPosition)
-        self.bind(ratioDen=self.update_scaledPosition)
+        self.bind(ratioNum=self.update_ratio)
+        self.bind(ratioDen=self.update_ratio)
         self.bind(position=self.update_scaledPosition)
-        self.bind(elsMode=self.update_scaledPosition)
-        self.app.formats.bind(current_format=self.update_scaledPosition)
-        self.update_scaledPosition(self, None)
+        self.bind(elsMode=self.update_scaling)
+        self.bind(unitsPerTurn=self.update_scaling)
+        self.app.formats.bind(factor=self.update_scaling)
+        self.update_scaling()
 
         self.bind(leadScrewPitch=self.configure_lead_screw_ratio)
         self.bind(leadScrewPitchIn=self.configure_lead_screw_ratio)
         self.bind(leadScrewPitchSteps=self.configure_lead_screw_ratio)
 
         # Private variables that don't need dispatchers etc
-        self.encoderPrevious = 0
-        self.encoderCurrent = 0
+        self.counter = WrappedCounters(1)
         self.previous_axis_time = time.time()
         self.speed_history = collections.deque(maxlen=4)
         self.previousIndex = 0
@@ -114,11 +117,12 @@ class ServoBar(BoxLayout, SavingDispatcher):
     def connected(self, instance, value):
         try:
             if self.app.connected:
-                self.encoderPrevious = self.app.fast_data_values['servoCurrent']
-                self.encoderCurrent = self.app.fast_data_values['servoCurrent']
-                self.servoEnable = self.app.fast_data_values['servoEnable']
-                self.app.device['servo']['maxSpeed'] = self.maxSpeed
-                self.app.device['servo']['acceleration'] = self.acceleration
+                self.counter.reset([self.app.fast_data_values.servoCurrent], self.app.fast_data_values.timestamp)
+                self.update_enable()
+                self.app.device['servo'].update({
+                    'maxSpeed': self.maxSpeed,
+                    'acceleration': self.acceleration,
+                })
 
                 if self.servoEnable == 0:
                     self.disableControls = True
@@ -127,15 +131,31 @@ class ServoBar(BoxLayout, SavingDispatcher):
         except Exception as e:
             log.error(e.__str__())
 
+    def update_scaling(self, *args, **kv):
+        """
+        Rebuilds the conversions between steps and units, the display is in the unit of measure of
+        the application in ELS mode and in the units of the ratio when indexing
+        """
+        self.scaling = axis.cached_scaling(self.scaling, self.ratioNum, self.ratioDen)
+        if self.elsMode is False and self.unitsPerTurn > 0:
+            factor = Fraction(1, 1)
+        else:
+            factor = self.app.formats.factor
+        self.display_scaling = axis.cached_scaling(self.display_scaling, self.ratioNum, self.ratioDen, factor)
+        self.update_scaledPosition(self, None)
+
+    def update_ratio(self, *args, **kv):
+        self.update_scaling()
+        self.update_positions()
+
     def update_positions(self, *args, **kv):
-        ratio = Fraction(self.ratioNum, self.ratioDen)
         if self.divisions < 1:
             self.divisions = 1
         self.positions = dict()
         self.step_positions = dict()
         for i in range(self.divisions):
             self.positions[i] = i * (self.unitsPerTurn / self.divisions)
-            self.step_positions[i] = round(self.positions[i] / ratio)
+            self.step_positions[i] = round(self.scaling.to_steps(self.positions[i]))
 
         self.previousIndex = 0
         self.index = self.index = 0
@@ -145,18 +165,16 @@ class ServoBar(BoxLayout, SavingDispatcher):
             if not self.app.connected:
                 return
 
-            self.encoderPrevious = self.encoderCurrent
-            self.encoderCurrent = self.app.fast_data_values['servoCurrent']
-            self.servoEnable = self.app.fast_data_values['servoEnable']
+            self.update_enable()
 
-            steps_per_second = self.app.fast_data_values['servoSpeed']
+            steps_per_second = self.app.fast_data_values.servoSpeed
             self.speed_history.append(steps_per_second)
             self.speed = (sum(self.speed_history) / len(self.speed_history))
 
-            delta = uint32_subtract_to_int32(self.encoderCurrent, self.encoderPrevious)
-            self.position += delta
+            values = self.app.fast_data_values
+            self.position += self.counter.update([values.servoCurrent], values.timestamp)[0]
             if (
-                    self.app.fast_data_values['stepsToGo'] == 0 and
+                    self.app.fast_data_values.stepsToGo == 0 and
                     self.servoEnable != 0 and
                     self.disableControls
                     and self.app.connected
@@ -166,23 +184,33 @@ class ServoBar(BoxLayout, SavingDispatcher):
         except Exception as e:
             log.error(f"Unable to read servo: {e.__str__()}")
 
-    def update_scaledPosition(self, instance, value):
-        ratio = Fraction(self.ratioNum, self.ratioDen)
+    def update_enable(self):
+        """
+        Mirrors the enable state of the board, unless the snapshot was read before our last change was sent
+        """
+        values = self.app.fast_data_values
+        if self.app.device['fastData'].is_current('servoEnable', values):
+            self.servoEnable = values.servoEnable
 
+    def update_scaledPosition(self, instance, value):
         if self.elsMode is False and self.unitsPerTurn > 0:
-            self.scaledPosition = float(self.position * ratio) % self.unitsPerTurn
-            self.formattedPosition = self.app.formats.angle_format.format(self.scaledPosition)
+            self.scaledPosition = self.display_scaling.to_units(self.position) % self.unitsPerTurn
+            self.display.set("formattedPosition", self.app.formats.angle_format, self.scaledPosition)
         else:
-            self.scaledPosition = float(self.position * ratio) * self.app.formats.factor
-            self.formattedPosition = self.app.formats.position_format.format(self.scaledPosition)
+            self.scaledPosition = self.display_scaling.to_units(self.position)
+            self.display.set("formattedPosition", self.app.formats.position_format, self.scaledPosition)
 
     def on_index(self, instance, value):
-        ratio = Fraction(self.ratioNum, self.ratioDen)
+        # Moves can't be sent while disconnected, the selection goes back to the current index
+        if not self.app.connected:
+            self.index = self.previousIndex
+            return
+
         self.index = self.index % self.divisions
 
         index_delta = (self.index - self.previousIndex)
         half_divisions = self.divisions // 2
-        steps_per_turn = (self.unitsPerTurn / ratio)
+        steps_per_turn = self.scaling.to_steps(self.unitsPerTurn)
         delta = self.step_positions[self.index] - self.step_positions[self.previousIndex]
 
         if index_delta > half_divisions:
@@ -195,9 +223,12 @@ class ServoBar(BoxLayout, SavingDispatcher):
             self.previousIndex = self.index
 
     def on_offset(self, instance, value):
-        ratio = Fraction(self.ratioNum, self.ratioDen)
+        if not self.app.connected:
+            self.offset = self.oldOffset
+            return
+
         delta = value - self.oldOffset
-        delta_steps = int(delta / ratio)
+        delta_steps = int(self.scaling.to_steps(delta))
         if delta_steps != 0:
             self.app.device['servo']['direction'] = delta_steps
             self.disableControls = True
@@ -207,6 +238,9 @@ class ServoBar(BoxLayout, SavingDispatcher):
         self.app.device['servo']['maxSpeed'] = self.maxSpeed
 
     def on_jogSpeed(self, instance, value):
+        if not self.app.connected and self.jogSpeed != 0:
+            self.jogSpeed = 0
+            return
         self.app.device['servo']['jogSpeed'] = self.jogSpeed
 
     def on_acceleration(self, instance, value):
@@ -232,8 +266,7 @@ class ServoBar(BoxLayout, SavingDispatcher):
             self.servoEnable = 1
 
     def set_current_position(self, value):
-        ratio = Fraction(self.ratioNum, self.ratioDen)
-        self.position = int(value / ratio)
+        self.position = int(self.display_scaling.to_steps(value))
 
     def update_current_position(self):
         keypad = Keypad()
@@ -81,7 +81,7 @@ class StatusBar(BoxLayout):
             # There is no connection yet
             return
         try:
-            self.interval = self.app.fast_data_values['executionInterval']
-            self.cycles = self.app.fast_data_values['cycles']
+            self.interval = self.app.fast_data_values.executionInterval
+            self.cycles = self.app.fast_data_values.cycles
         except Exception as e:
             log.debug(e.__str__(), exc_info=True)
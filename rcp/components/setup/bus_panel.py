@@ -0,0 +1,66 @@
+import os
+
+from kivy.app import App
+from kivy.clock import Clock
+from kivy.lang import Builder
+from kivy.logger import Logger
+from kivy.properties import StringProperty, NumericProperty
+from kivy.uix.boxlayout import BoxLayout
+
+from rcp.utils.bus_stats import LATENCY_BUCKETS_MS
+
+log = Logger.getChild(__name__)
+kv_file = os.path.join(os.path.dirname(__file__), __file__.replace(".py", ".kv"))
+if os.path.exists(kv_file):
+    log.info(f"Loading KV file: {kv_file}")
+    Builder.load_file(kv_file)
+
+
+def format_latency(value) -> str:
+    if value is None:
+        return "-"
+    # Beyond the last bucket the value is the slowest transaction
+    if value > LATENCY_BUCKETS_MS[-1]:
+        return f"> {LATENCY_BUCKETS_MS[-1]} ms (max {value:.0f} ms)"
+    return f"<= {value} ms"
+
+
+class BusPanel(BoxLayout):
+    """
+    Shows the statistics of the serial bus over a rolling window, refreshed while the panel is visible
+    """
+    window = NumericProperty(10)
+    link_state = StringProperty("")
+    transactions = StringProperty("")
+    errors = StringProperty("")
+    retries = StringProperty("")
+    latency = StringProperty("")
+    utilization = StringProperty("")
+    refresh_task = None
+
+    def start(self, *args):
+        if self.refresh_task is None:
+            self.refresh()
+            self.refresh_task = Clock.schedule_interval(self.refresh, 1.0)
+
+    def stop(self, *args):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            self.refresh_task = None
+
+    def refresh(self, *args):
+        app = App.get_running_app()
+        connection_manager = getattr(app, "connection_manager", None)
+        if connection_manager is None:
+            self.link_state = "No serial connection"
+            return
+
+        summary = connection_manager.stats.summary(self.window)
+        self.link_state = app.link_state
+        self.transactions = ", ".join(
+            f"FC{function}: {count}" for function, count in sorted(summary.transactions.items())
+        ) or "-"
+        self.errors = ", ".join(f"{kind}: {count}" for kind, count in sorted(summary.errors.items())) or "-"
+        self.retries = str(summary.retries)
+        self.latency = f"p50 {format_latency(summary.p50_ms)}, p99 {format_latency(summary.p99_ms)}"
+        self.utilization = f"{summary.utilization * 100:.0f}%"
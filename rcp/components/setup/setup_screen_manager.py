@@ -6,6 +6,7 @@ from kivy.logger import Logger
 from kivy.properties import ObjectProperty
 from kivy.uix.screenmanager import Screen, ScreenManager, NoTransition
 
+from rcp.components.setup.bus_panel import BusPanel
 from rcp.components.setup.scale_panel import ScalePanel
 from rcp.components.setup.servo_panel import ServoPanel
 from rcp.components.setup.formats_panel import FormatsPanel
@@ -46,6 +47,13 @@ class SetupScreenManager(ScreenManager):
         screen.add_widget(FormatsPanel(formats=app.formats))
         self.add_widget(screen)
 
+        # Add Tab showing the health of the serial bus
+        screen = Screen(name="bus")
+        bus_panel = BusPanel()
+        screen.bind(on_enter=bus_panel.start, on_leave=bus_panel.stop)
+        screen.add_widget(bus_panel)
+        self.add_widget(screen)
+
         # Add Tab to allow reviewing the application logs
         # screen = Screen(name="logs")
         # screen.add_widget(LogsPanel())
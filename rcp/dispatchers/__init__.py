@@ -1,15 +1,39 @@
-import os
-import shutil
-from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
 
-import yaml
 from kivy.logger import Logger
 from kivy.event import EventDispatcher
-from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ListProperty, ObservableList, partial
+from kivy.properties import StringProperty, NumericProperty, BooleanProperty, ListProperty, DictProperty, partial
+
+from rcp.utils.settings_store import settings_store
+from rcp.utils.settings_writer import settings_writer
 
 log = Logger.getChild(__name__)
 
+# Property types saved unless listed in _skip_save, other types are saved only when listed in _force_save
+SAVED_TYPES = (NumericProperty, StringProperty, BooleanProperty)
+
+
+def identity(value):
+    return value
+
+
+# Conversions of the values of container properties from and to plain lists and dictionaries
+SERIALIZERS: Dict[type, Callable[[Any], Any]] = {
+    ListProperty: list,
+    DictProperty: dict,
+}
+DESERIALIZERS: Dict[type, Callable[[Any], Any]] = {
+    ListProperty: list,
+    DictProperty: dict,
+}
+
+
+class SavedProperty(NamedTuple):
+    property: Any
+    name: str
+    serialize: Callable[[Any], Any]
+    deserialize: Callable[[Any], Any]
+
 
 class SavingDispatcher(EventDispatcher):
     _skip_save = []
@@ -27,83 +51,70 @@ class SavingDispatcher(EventDispatcher):
         self.read_settings()
         self.bind_settings()
 
-    def get_our_properties(self):
-        our_elements = dir(type(self))
-        properties = [getattr(type(self), item) for item in our_elements]
-        properties = [
-            item
-            for item in properties
-            if type(item) in [NumericProperty, StringProperty, BooleanProperty]
-        ]
-        properties = [item for item in properties if item.name not in self._skip_save]
-
-        force_properties = [getattr(type(self), item) for item in self._force_save]
-        properties.extend(force_properties)
-        return properties
+    @classmethod
+    def saved_properties(cls) -> Dict[str, SavedProperty]:
+        """
+        Properties of the class that are saved, found once per class
+        """
+        saved = cls.__dict__.get("_saved_properties", None)
+        if saved is not None:
+            return saved
+
+        saved = dict()
+        for item in dir(cls):
+            prop = getattr(cls, item)
+            if type(prop) in SAVED_TYPES and prop.name not in cls._skip_save:
+                saved[prop.name] = prop
+        for item in cls._force_save:
+            saved[item] = getattr(cls, item)
+
+        saved = {
+            name: SavedProperty(
+                prop, name, SERIALIZERS.get(type(prop), identity), DESERIALIZERS.get(type(prop), identity)
+            )
+            for name, prop in saved.items()
+        }
+        # Stored on the class itself, subclasses find their own properties
+        cls._saved_properties = saved
+        return saved
+
+    def get_our_properties(self) -> List[Any]:
+        return [item.property for item in self.saved_properties().values()]
 
     @property
-    def filename(self):
-        home_folder = os.environ.get('HOME')
-        settings_folder = Path(home_folder) / ".config" / "rotary-controller-python"
-        os.makedirs(settings_folder, exist_ok=True)
-
-        settings_path = settings_folder / f"{self.__class__.__name__}-{self.id_override}.yaml"
-        return settings_path
+    def settings_name(self) -> str:
+        return f"{self.__class__.__name__}-{self.id_override}"
 
     def read_settings(self):
-        props = self.get_our_properties()
-        prop_names = [item.name for item in props]
+        saved = self.saved_properties()
 
-        config_data = read_settings(self.filename)
+        config_data = settings_store().get(self.settings_name)
         if config_data is None:
             self.save_settings()
             return
 
         for k, v in config_data.items():
-            if k in prop_names:
-                self.__setattr__(k, v)
+            item = saved.get(k, None)
+            if item is not None:
+                self.__setattr__(k, item.deserialize(v))
             else:
                 log.debug(f"Provided property with name: {k} is unknown to this class")
 
     def bind_settings(self):
-        props = self.get_our_properties()
-        prop_names = [item.name for item in props]
-        kwargs = {item: partial(self.save_settings, triggering_property=item) for item in prop_names}
+        kwargs = {item: partial(self.save_settings, triggering_property=item) for item in self.saved_properties()}
         self.bind(**kwargs)
 
     def save_settings(self, *args, **kv):
+        """
+        Marks the settings as changed, they are written in the background by the settings writer
+        """
         triggering_property = kv.pop("triggering_property", "")
-        props = self.get_our_properties()
-        prop_names = [item.name for item in props]
-        data = dict()
-        for item in prop_names:
-            data[item] = self.__getattribute__(item)
-            if isinstance(data[item], ObservableList):
-                data[item] = list(data[item])
-
-        write_settings(self.filename, data, triggered_by=triggering_property)
-
-
-def read_settings(file: str):
-    if not os.path.exists(file):
-        return None
-
-    try:
-        with open(file, "r") as f:
-            data = yaml.safe_load(f.read())
-            return data
-    except Exception as e:
-        log.error(e.__str__())
-        return None
-
-
-def write_settings(file: str, data, triggered_by: Optional[str] = ""):
-    log.info(f"Saving {triggered_by}: {file}")
-    try:
-        with open(file, "w") as f:
-            yaml.dump(data, f)
-        return True
-
-    except Exception as e:
-        log.error(e.__str__())
-        return False
+        settings_writer.mark_dirty(self, triggered_by=triggering_property)
+
+    def store_settings(self, triggered_by: Optional[str] = ""):
+        data = {item.name: item.serialize(getattr(self, item.name)) for item in self.saved_properties().values()}
+
+        # Only the store in memory is updated here, the file is written once for all the dispatchers
+        store = settings_store()
+        store.set(self.settings_name, data)
+        settings_writer.mark_dirty(store, triggered_by=f"{self.settings_name} {triggered_by}")
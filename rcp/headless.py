@@ -0,0 +1,202 @@
+"""
+Runs the device pipeline without the user interface, for profiling, soak tests and data logging
+on machines without a display:
+
+    python ./rcp/headless.py --rate 10
+
+Readings are printed on stdout as JSON lines, the axes are configured from the settings saved by the
+application and the connection from the [device] section of config.ini. The board is only read, no
+configuration is written to it.
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from rcp.utils import axis, communication, devices
+from rcp.utils.poller import Poller, PollRateScheduler
+from rcp.utils.settings_store import settings_store
+from rcp.utils.snapshot import DeviceSnapshot
+
+log = logging.getLogger(__name__)
+
+CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "config.ini"))
+
+# Defaults of the widget properties used by the axis math
+AXIS_DEFAULTS = {
+    "axisName": "?",
+    "ratioNum": 1,
+    "ratioDen": 1,
+    "spindleMode": False,
+    "stepsPerRev": 4096,
+    "stepsPerMM": 1000,
+    "offsets": [0] * 100,
+}
+SERVO_DEFAULTS = {
+    "ratioNum": 1,
+    "ratioDen": 1,
+}
+FORMATS_DEFAULTS = {
+    "current_format": "MM",
+}
+
+
+def load_settings(name: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reads the settings saved by a dispatcher of the application, falling back to the defaults
+    """
+    settings = dict(defaults)
+    settings.update(settings_store().get(name) or dict())
+    return settings
+
+
+def load_device_config(path=CONFIG_PATH) -> Dict[str, str]:
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    if not parser.has_section("device"):
+        return dict()
+    return dict(parser.items("device"))
+
+
+class HeadlessRuntime:
+    """
+    Polls the board and converts the scale positions with the settings of the application, every
+    new snapshot is turned into a reading passed to the callback.
+    """
+
+    def __init__(
+        self,
+        serial_device="/dev/serial0",
+        baudrate=115200,
+        address=17,
+        transport=communication.TRANSPORT_MINIMALMODBUS,
+        callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+        current_offset=0,
+    ):
+        self.callback = callback
+        self.current_offset = current_offset
+        self.axes_settings = [load_settings(f"CoordBar-{i}", AXIS_DEFAULTS) for i in range(devices.SCALES_COUNT)]
+        self.servo_settings = load_settings("ServoBar-0", SERVO_DEFAULTS)
+        self.formats = load_settings("FormatsDispatcher-0", FORMATS_DEFAULTS)
+        self.factor = axis.format_factor(self.formats["current_format"])
+        self.engine = axis.AxisEngine(devices.SCALES_COUNT)
+        self.configure_axes()
+        self.servo = axis.Axis(-1)
+        self.servo_scaling = axis.AxisScaling(self.servo_settings["ratioNum"], self.servo_settings["ratioDen"])
+
+        self.connection_manager = communication.ConnectionManager(
+            serial_device=serial_device,
+            baudrate=baudrate,
+            address=address,
+            transport=transport,
+        )
+        self.device = devices.Global(connection_manager=self.connection_manager, base_address=0)
+        self.fast_data_device = self.device["fastData"]
+        self.poller = Poller(self.fast_data_device, on_connect=self.prepare_connection, scheduler=PollRateScheduler())
+        self.snapshot = DeviceSnapshot(devices.FastData)
+        self.sequence: Optional[int] = None
+
+    def configure_axes(self):
+        for i, settings in enumerate(self.axes_settings):
+            self.engine.configure(
+                i,
+                ratio_num=settings["ratioNum"],
+                ratio_den=settings["ratioDen"],
+                offset=settings["offsets"][self.current_offset],
+                factor=self.factor,
+                spindle_mode=settings["spindleMode"],
+                steps_per_rev=settings["stepsPerRev"],
+                steps_per_mm=settings["stepsPerMM"],
+                current_format=self.formats["current_format"],
+            )
+
+    def prepare_connection(self):
+        self.connection_manager.negotiate_block_size(limit=self.device.size)
+
+    def axis_reading(self, index: int) -> Dict[str, Any]:
+        return {
+            "name": self.axes_settings[index]["axisName"],
+            "steps": self.engine.positions[index],
+            "position": self.engine.scaled[index],
+            "speed": self.engine.speeds[index],
+        }
+
+    def reading(self, snapshot: DeviceSnapshot) -> Dict[str, Any]:
+        return {
+            "timestamp": snapshot.timestamp,
+            "link": self.poller.link.state.value,
+            "axes": [self.axis_reading(i) for i in range(len(self.engine.positions))],
+            "servo": {
+                "steps": self.servo.position,
+                "position": self.servo_scaling.to_units(self.servo.position),
+                "steps_to_go": snapshot.stepsToGo,
+                "speed": snapshot.servoSpeed,
+            },
+        }
+
+    def update(self) -> Optional[Dict[str, Any]]:
+        """
+        Processes the latest snapshot, returns the reading or None if there was no new data
+        """
+        sequence = self.poller.read_into(self.snapshot, self.sequence)
+        if sequence == self.sequence or not self.poller.connected:
+            return None
+        self.sequence = sequence
+
+        self.engine.update(
+            self.snapshot.scaleCurrent.to_list(), self.snapshot.scaleSpeed.to_list(), now=self.snapshot.timestamp
+        )
+        self.servo.update(self.snapshot.servoCurrent, now=self.snapshot.timestamp)
+
+        reading = self.reading(self.snapshot)
+        if self.callback is not None:
+            self.callback(reading)
+        return reading
+
+    def run(self, interval=0.1, duration: Optional[float] = None):
+        self.poller.start()
+        end = None if duration is None else time.monotonic() + duration
+        try:
+            while end is None or time.monotonic() < end:
+                self.update()
+                time.sleep(interval)
+        finally:
+            self.poller.stop(timeout=1.0)
+            self.connection_manager.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    config = load_device_config()
+    parser = argparse.ArgumentParser(description="Streams the readings of the board without the user interface")
+    parser.add_argument("--port", default=config.get("serial_port", "/dev/serial0"))
+    parser.add_argument("--baudrate", type=int, default=int(config.get("baudrate", 115200)))
+    parser.add_argument("--address", type=int, default=int(config.get("address", 17)))
+    parser.add_argument("--transport", default=config.get("transport", communication.TRANSPORT_MINIMALMODBUS))
+    parser.add_argument("--rate", type=float, default=10, help="Readings per second")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run, forever if not specified")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+
+    def emit(reading):
+        print(json.dumps(reading), flush=True)
+
+    runtime = HeadlessRuntime(
+        serial_device=args.port,
+        baudrate=args.baudrate,
+        address=args.address,
+        transport=args.transport,
+        callback=emit,
+    )
+    try:
+        runtime.run(interval=1.0 / args.rate, duration=args.duration)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
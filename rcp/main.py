@@ -1,4 +1,10 @@
+from rcp.utils import startup
+
+# Started before kivy, so that its imports are part of the report
+startup_report = startup.start()
+
 from keke import ktrace
+from kivy.clock import Clock
 from kivy.base import EventLoop
 from kivy.logger import Logger, KivyFormatter
 from kivy.core.window import Window
@@ -14,7 +20,12 @@ for h in log.root.handlers:
     h.formatter = KivyFormatter('%(asctime)s - %(name)s:%(lineno)s-%(funcName)s - %(levelname)s - %(message)s')
 
 if __name__ == "__main__":
+    if startup_report is not None:
+        startup_report.mark("kivy")
     from rcp.app import MainApp
+    if startup_report is not None:
+        startup_report.mark("application modules")
+        Clock.schedule_once(startup_report.finish)
     # Monkeypatch to add more trace events
     EventLoop.idle = ktrace()(EventLoop.idle)
     MainApp().run()
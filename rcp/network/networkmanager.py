@@ -21,11 +21,23 @@ from sdbus_block.networkmanager.enums import DeviceType, DeviceState
 from sdbus_block.networkmanager.settings import ConnectionProfile, ConnectionSettings, WirelessSettings, \
     WirelessSecuritySettings
 
-sdbus.set_default_bus(sdbus.sd_bus_open_system())
 log = logging.getLogger(__file__)
 
+system_bus_opened = False
+
+
+def open_system_bus():
+    """
+    Connects to the system bus the first time NetworkManager is used, rather than when this module is imported
+    """
+    global system_bus_opened
+    if not system_bus_opened:
+        sdbus.set_default_bus(sdbus.sd_bus_open_system())
+        system_bus_opened = True
+
 
 def find_our_connection():
+    open_system_bus()
     nms = NetworkManagerSettings()
 
     connections = nms.list_connections()
@@ -43,6 +55,7 @@ def find_our_connection():
 def get_all_network_interface_names(
         types_filter: Iterable[DeviceType] = (DeviceType.WIFI,)
 ) -> List[str]:
+    open_system_bus()
     network_manager = NetworkManager()
     all_devices = {path: NetworkDeviceGeneric(path) for path in network_manager.devices}
 
@@ -57,6 +70,7 @@ def get_all_network_interface_names(
 
 
 def get_profile_by_id(profile_id: str = "ospi") -> ConnectionProfile or None:
+    open_system_bus()
     nms = NetworkManagerSettings()
     connections = nms.list_connections()
     profiles = []
@@ -100,6 +114,7 @@ def get_connection_by_profile(profile:  ConnectionProfile):
     if profile is None:
         return None
     else:
+        open_system_bus()
         nms = NetworkManagerSettings()
         connections = nms.get_connections_by_id(profile.connection.connection_id)
         if len(connections) != 1:
@@ -111,6 +126,7 @@ def get_ipv4(profile: ConnectionProfile) -> Tuple:
     if profile is None:
         return "", "", ""
 
+    open_system_bus()
     network_manager = NetworkManager()
     interface_name = profile.connection.interface_name
     device_path = network_manager.get_device_by_ip_iface(interface_name)
@@ -162,6 +178,7 @@ def activate_connection(profile: ConnectionProfile):
     enable_wifi()
     interface_name = profile.connection.interface_name
 
+    open_system_bus()
     network_manager = NetworkManager()
     device = network_manager.get_device_by_ip_iface(interface_name)
     connection = get_connection_by_profile(profile)
@@ -174,6 +191,7 @@ def activate_connection(profile: ConnectionProfile):
 
 def deactivate_connection(profile: ConnectionProfile):
     disable_wifi()
+    open_system_bus()
     network_manager = NetworkManager()
     connection = get_connection_by_profile(profile)
     return network_manager.deactivate_connection(active_connection=connection)
@@ -0,0 +1,212 @@
+from collections import deque
+from fractions import Fraction
+from typing import List, Optional, Sequence, Tuple
+
+from rcp.utils.counters import WrappedCounters
+
+MM_PER_INCH = Fraction(254, 10)
+# Samples of the scale speed averaged for the displayed speed
+SPEED_HISTORY = 5
+
+
+def scale_speed(steps_per_second, spindle_mode: bool, steps_per_rev, steps_per_mm, current_format="MM") -> Optional[float]:
+    """
+    Converts the speed of a scale in display units, RPM in spindle mode and M/min or Ft/min otherwise.
+    Returns None when the scale is not configured.
+    """
+    if spindle_mode:
+        if steps_per_rev == 0:
+            return None
+        return (steps_per_second / steps_per_rev) * 60
+
+    if steps_per_mm == 0:
+        return None
+    speed = float(steps_per_second * 60 * (1 / steps_per_mm) * (1 / 1000))
+    if current_format == "IN":
+        speed = speed * (120 / 254)
+    return speed
+
+
+def sync_ratio(
+    ratio_num, ratio_den, sync_ratio_num, sync_ratio_den, servo_ratio_num, servo_ratio_den,
+    factor=Fraction(1, 1), spindle_mode=False, els_mode=False
+) -> Fraction:
+    """
+    Ratio between the steps of the servo and the steps of a scale synchronized with it
+    """
+    if sync_ratio_den == 0:
+        sync_ratio_den = 1
+
+    if spindle_mode:
+        scale_ratio = Fraction(ratio_num, ratio_den)
+    else:
+        scale_ratio = Fraction(ratio_num, ratio_den) * factor
+
+    if els_mode:
+        # ELS Mode, the output is always metric so we need to account for the conversion
+        servo_ratio = Fraction(servo_ratio_num, servo_ratio_den) * factor
+    else:
+        # NON Els mode we're in degrees always
+        servo_ratio = Fraction(servo_ratio_num, servo_ratio_den)
+
+    return scale_ratio * Fraction(sync_ratio_num, sync_ratio_den) / servo_ratio
+
+
+def format_factor(current_format: str) -> Fraction:
+    """
+    Factor converting millimeters into the units of the given format
+    """
+    if current_format == "MM":
+        return Fraction(1, 1)
+    return 1 / MM_PER_INCH
+
+
+class Axis:
+    """
+    Tracks the position of a scale from its wrapping 32 bit encoder counter
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.position = 0
+        self.counter = WrappedCounters(1)
+
+    def update(self, counter: int, now: Optional[float] = None) -> int:
+        """
+        Accumulates the change of the counter since the previous update, returns the change in steps
+        """
+        delta = self.counter.update([counter], now)[0]
+        self.position += delta
+        return delta
+
+
+class AxisScaling:
+    """
+    Conversion between encoder steps and units for a ratio in units per step, a unit factor and an
+    offset in units before the factor. The product of ratio and factor is reduced once to integers,
+    so that conversions don't construct Fractions: build a new one when any of them changes.
+    """
+
+    def __init__(self, ratio_num=1, ratio_den=1, factor=Fraction(1, 1), offset=0):
+        self.key = (ratio_num, ratio_den, factor, offset)
+        self.ratio = Fraction(ratio_num, ratio_den) if ratio_den != 0 else Fraction(0)
+        scale = self.ratio * factor
+        self.numerator = scale.numerator
+        self.denominator = scale.denominator
+        self.offset = float(Fraction(offset) * factor)
+
+    def to_units(self, steps) -> float:
+        # The integer product is exact, the division rounds once
+        return steps * self.numerator / self.denominator + self.offset
+
+    def to_steps(self, units) -> float:
+        if self.numerator == 0:
+            return 0.0
+        return (units - self.offset) * self.denominator / self.numerator
+
+
+def cached_scaling(scaling: Optional[AxisScaling], ratio_num, ratio_den, factor=Fraction(1, 1), offset=0) -> AxisScaling:
+    """
+    Returns the scaling unchanged when it was built from the same values, a new one otherwise
+    """
+    key = (ratio_num, ratio_den, factor, offset)
+    if scaling is not None and scaling.key == key:
+        return scaling
+    return AxisScaling(*key)
+
+
+class AxisConfig:
+    """
+    Settings of one axis of the AxisEngine
+    """
+
+    def __init__(
+        self, ratio_num=1, ratio_den=1, offset=0, factor=Fraction(1, 1), spindle_mode=False,
+        steps_per_rev=4096, steps_per_mm=1000, current_format="MM", scaling: Optional[AxisScaling] = None
+    ):
+        self.spindle_mode = spindle_mode
+        self.steps_per_rev = steps_per_rev
+        self.steps_per_mm = steps_per_mm
+        self.current_format = current_format
+        # Angles in spindle mode are not affected by the unit of measure
+        multiplier = 360 if spindle_mode else factor
+        self.scaling = cached_scaling(scaling, ratio_num, ratio_den, multiplier, offset)
+
+
+class AxisEngine:
+    """
+    Converts the encoder counters of all the axes in one pass per snapshot, keeping positions, scaled
+    positions and speeds in plain lists. Only the axes whose values changed are reported back, so that
+    the widgets are updated for those alone.
+    """
+
+    def __init__(self, count: int):
+        self.configs = [AxisConfig() for _ in range(count)]
+        self.counters = WrappedCounters(count)
+        self.positions = [0] * count
+        self.scaled = [0.0] * count
+        self.speeds = [0.0] * count
+        self.speed_history = [deque(maxlen=SPEED_HISTORY) for _ in range(count)]
+
+    def configure(self, index: int, **kwargs):
+        self.configs[index] = AxisConfig(scaling=self.configs[index].scaling, **kwargs)
+        self.rescale(index)
+
+    def wrap(self, index: int, position: int) -> Tuple[int, float]:
+        """
+        Scaled value of a position, spindle angles are brought back between 0 and 360 degrees by
+        moving the position one revolution at a time
+        """
+        config = self.configs[index]
+        scaled = config.scaling.to_units(position)
+        if config.spindle_mode:
+            if scaled > 360.0:
+                scaled -= 360.0
+                position -= config.steps_per_rev
+            if scaled < 0:
+                scaled += 360.0
+                position += config.steps_per_rev
+        return position, scaled
+
+    def rescale(self, index: int):
+        self.positions[index], self.scaled[index] = self.wrap(index, self.positions[index])
+
+    def scaled_position(self, index: int, position: int) -> Tuple[int, float]:
+        """
+        Position and scaled value for the position of a widget, taken from the last pass when they match
+        """
+        if position != self.positions[index]:
+            self.positions[index] = position
+            self.rescale(index)
+        return self.positions[index], self.scaled[index]
+
+    def update(
+        self, counters: Sequence[int], speeds: Optional[Sequence[int]] = None, now: Optional[float] = None
+    ) -> List[int]:
+        """
+        Accumulates the change of every counter since the previous update, returns the indexes of
+        the axes with a new position or speed
+        """
+        changed = []
+        for i, delta in enumerate(self.counters.update(counters, now)):
+            modified = False
+            if delta != 0:
+                self.positions[i] += delta
+                self.rescale(i)
+                modified = True
+
+            if speeds is not None:
+                history = self.speed_history[i]
+                history.append(speeds[i])
+                config = self.configs[i]
+                speed = scale_speed(
+                    sum(history) / len(history), config.spindle_mode, config.steps_per_rev,
+                    config.steps_per_mm, config.current_format
+                )
+                if speed is not None and speed != self.speeds[i]:
+                    self.speeds[i] = speed
+                    modified = True
+
+            if modified:
+                changed.append(i)
+        return changed
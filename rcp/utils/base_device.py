@@ -1,30 +1,21 @@
 import struct
-from typing import Optional, List, Any
+from functools import partial
+from typing import Optional, List, Any, Dict, Mapping, Tuple
 
 from keke import ktrace, kev
 from rcp.utils import communication
+from rcp.utils.communication import Priority
+from rcp.utils.layout import (
+    TypeDefinition, VariableDefinition, Layout, parse_definition, build_layout, dependency_order
+)
+from rcp.utils.read_planner import ReadRequest, ReadBlock, plan_reads, execute_plan, read_block_into
+from rcp.utils.snapshot import DeviceSnapshot
 
 import logging
-from pydantic import BaseModel
 
 log = logging.getLogger(__name__)
 
 
-class TypeDefinition(BaseModel):
-    name: str
-    length: int
-    read_function: Any
-    write_function: Optional[Any]
-    struct_unpack_string: str
-
-
-class VariableDefinition(BaseModel):
-    name: str
-    address: int
-    type: TypeDefinition
-    count: int = 1
-
-
 variable_definitions = [
     TypeDefinition(
         name="TIM_HandleTypeDef",
@@ -80,22 +71,56 @@ variable_definitions = [
 
 class BaseDevice:
     definition = ""
+    # Layout compiled by register_type, shared by all the instances of the class
+    layout: Optional[Layout] = None
+    # Variables written with motion priority, the others are configuration writes
+    motion_variables = set()
+    # Variables whose writes are relative commands and must never be coalesced
+    cumulative_variables = set()
+
+    # Decoders compiled once per class by compile(), None until the class is registered
+    _struct: Optional[struct.Struct] = None
+    _value_count = 0
+    # Flat field table with (name, index of the first value, count, nested device class or None)
+    _record_fields: List[Tuple[str, int, int, Any]] = []
+    # Snapshot accessors by name with (byte offset, element struct, count, nested device class or None)
+    _field_offsets: Dict[str, Tuple[int, Optional[struct.Struct], int, Any]] = dict()
 
     def __init__(self, connection_manager, base_address):
         from rcp.utils.communication import ConnectionManager
         self.base_address = base_address
         self.size = 0
         self.struct_unpack_string = ""
+        if self._struct is None:
+            raise Exception(f"{type(self).__name__} must be registered and compiled before it's used")
         self.fast_data = dict()
         self.dm: ConnectionManager = connection_manager
-        self.variables: List[VariableDefinition or BaseDevice] = []
+        self.variables: Tuple[VariableDefinition, ...] = tuple()
+        self.index: Mapping[str, VariableDefinition] = dict()
         self.parse_addresses_from_definition()
 
+        # Child devices for the nested structures, created on first access
+        self.children: Dict[str, Any] = dict()
+
+        # Preallocated record and register buffer for the compiled decoder
+        self.fast_data = self.new_record()
+        self.snapshot = DeviceSnapshot(type(self))
+
+    def get_variable(self, key) -> VariableDefinition:
+        var = self.index.get(key, None)
+        if var is None:
+            raise Exception(f"Variable with name: {key} not found")
+        return var
+
     def __getitem__(self, key):
-        try:
-            var: VariableDefinition = [item for item in self.variables if item.name == key][0]
-        except Exception as e:
-            raise Exception(f"Variable with name: {key} not found ({e.__str__()})")
+        var = self.get_variable(key)
+
+        if hasattr(var.type.read_function, "decode_into"):
+            child = self.children.get(key, None)
+            if child is None:
+                child = self.create_child(var)
+                self.children[key] = child
+            return child
 
         if var.count > 1:
             list_type = list()
@@ -107,214 +132,262 @@ class BaseDevice:
         else:
             return var.type.read_function(self.dm, var.address + self.base_address)
 
-    def __setitem__(self, key, value):
-        try:
-            var = [item for item in self.variables if item.name == key][0]
-        except Exception as e:
-            raise Exception(f"Variable with name: {key} not found ({e.__str__()})")
-
-        var.type.write_function(self.dm, var.address + self.base_address, value, key)
-        return
-
-    @classmethod
-    def register_type(cls) -> TypeDefinition:
-        current_address = 0
-        size = 0
-        name = None
-        struct_unpack_string = ""
-        for line in cls.definition.split(sep="\n"):
-            tokens = [item for item in line.split(" ") if len(item) > 0]
-            tokens = [item.replace(";", "") for item in tokens]
-            tokens = [item.replace("*", "") for item in tokens]
-
-            # Skip lines that don't represent a type definition
-            if "typedef" in tokens:
-                continue
-            if "}" in tokens:
-                name = tokens[1]
-                continue
-            if "{" in tokens:
-                continue
-            if len(tokens) == 0:
-                continue
+    @staticmethod
+    def encode(var: VariableDefinition, value) -> List[int]:
+        """
+        Encodes the value of a variable in the registers written to the firmware
+        """
+        fmt = var.type.struct_unpack_string
+        if fmt == "f":
+            raw = struct.pack("<f", float(value))
+        else:
+            # Integers are sent as their two's complement, regardless of the signedness of the format
+            fmt = fmt.upper()
+            raw = struct.pack("<" + fmt, int(value) & ((1 << (struct.calcsize("<" + fmt) * 8)) - 1))
+        return list(struct.unpack(f"<{var.type.length}H", raw))
 
-            # Find type match
-            try:
-                identified_type = tokens[0]
-                identified_name = "".join(tokens[1:])
-
-                matching_type = [
-                    item
-                    for item in variable_definitions
-                    if item.name == identified_type
-                ][0]
-
-                # Handle multi var definition separated by comma
-                if "," in identified_name:
-                    for name in identified_name.replace(" ", "").split(","):
-                        current_address = current_address + matching_type.length
-                        struct_unpack_string += matching_type.struct_unpack_string
-                        # size = current_address
+    @ktrace()
+    def update(self, values: Dict[str, Any]):
+        """
+        Writes several variables at once, variables at contiguous addresses are packed in a
+        single write multiple registers transaction so they are updated together by the firmware.
+        """
+        variables = []
+        for key, value in values.items():
+            var = self.get_variable(key)
+            if var.count > 1 or hasattr(var.type.read_function, "decode_into"):
+                raise Exception(f"Variable with name: {key} is not a scalar and can't be updated")
+            variables.append((var.address + self.base_address, key, self.encode(var, value)))
+
+        groups = []
+        for address, key, registers in sorted(variables):
+            if len(groups) > 0:
+                group = groups[-1]
+                if group[0] + len(group[2]) == address and \
+                        len(group[2]) + len(registers) <= communication.MODBUS_MAX_WRITE_REGISTERS:
+                    group[1].append(key)
+                    group[2].extend(registers)
                     continue
+            groups.append((address, [key], list(registers)))
 
-                # Handle array definition
-                if "[" in identified_name:
-                    name, count = identified_name.split("[")
-                    count, _ = count.split("]")
-                    count = int(count)
+        for address, keys, registers in groups:
+            names = ", ".join(keys)
+            if not self.dm.queue_writes:
+                communication.write_registers(self.dm, address, registers, names)
+                continue
 
-                    current_address += matching_type.length * count
-                    struct_unpack_string += matching_type.struct_unpack_string * count
-                    continue
+            cumulative = any(item in self.cumulative_variables for item in keys)
+            motion = any(item in self.motion_variables for item in keys)
+            self.dm.commands.put(
+                communication.QueuedWrite(
+                    self.dm.writes,
+                    partial(communication.write_registers, self.dm, address, registers, names),
+                    address,
+                    len(registers),
+                ),
+                key=None if cumulative else (address, len(registers)),
+                priority=Priority.MOTION if motion else Priority.CONFIGURATION,
+            )
+
+    def create_child(self, var: VariableDefinition):
+        device_class = var.type.read_function
+        if var.count > 1:
+            return [
+                device_class(self.dm, var.address + self.base_address + var.type.length * i)
+                for i in range(var.count)
+            ]
+        return device_class(self.dm, var.address + self.base_address)
 
-                current_address = current_address + matching_type.length
-                struct_unpack_string += matching_type.struct_unpack_string
-            except Exception as e:
-                raise Exception(f"Unable to find a matching type for: {tokens[0]} ({e.__str__()})")
+    def __setitem__(self, key, value):
+        var = self.get_variable(key)
+        address = var.address + self.base_address
+        if not self.dm.queue_writes:
+            var.type.write_function(self.dm, address, value, key)
+            return
+
+        self.dm.commands.put(
+            communication.QueuedWrite(
+                self.dm.writes, partial(var.type.write_function, self.dm, address, value, key), address, var.type.length
+            ),
+            key=None if key in self.cumulative_variables else (address, var.type.length),
+            priority=Priority.MOTION if key in self.motion_variables else Priority.CONFIGURATION,
+        )
 
-            size = current_address
+    def is_current(self, key, snapshot: DeviceSnapshot) -> bool:
+        """
+        True when the value of the variable in the snapshot was read after all the writes queued for it
+        """
+        var = self.get_variable(key)
+        return self.dm.writes.is_current(
+            var.address + self.base_address, var.type.length * var.count, snapshot.read_sequence
+        )
 
-        if name is None:
-            raise "Unable to identify the typedef name from the provided definition"
+    @classmethod
+    def register_type(cls, parsed=None) -> TypeDefinition:
+        """
+        Builds the layout of the class from its definition, all the types it uses must be registered already
+        """
+        if parsed is None:
+            parsed = parse_definition(cls.definition)
+        cls.layout = build_layout(parsed, variable_definitions)
 
         return TypeDefinition(
-            name=name,
-            length=size,
-            struct_unpack_string=struct_unpack_string,
+            name=cls.layout.name,
+            length=cls.layout.size,
+            struct_unpack_string=cls.layout.struct_unpack_string,
             read_function=cls,
             write_function=cls,
         )
 
-    def parse_addresses_from_definition(self):
-        current_address = 0
-        self.struct_unpack_string = ""
-        self.variables = []
-        for line in self.definition.split(sep="\n"):
-            tokens = [item for item in line.split(" ") if len(item) > 0]
-            tokens = [item.replace(";", "") for item in tokens]
-            tokens = [item.replace("*", "") for item in tokens]
-
-            # Skip lines that don't represent a type definition
-            if "typedef" in tokens:
-                continue
-            if "}" in tokens:
-                continue
-            if "{" in tokens:
-                continue
-            if len(tokens) == 0:
-                continue
-
-            # Find type match
-            try:
-                identified_type = tokens[0]
-                identified_name = "".join(tokens[1:])
-
-                matching_type = [
-                    item
-                    for item in variable_definitions
-                    if item.name == identified_type
-                ][0]
-
-                # Handle multi var definition separated by comma
-                if "," in identified_name:
-                    for name in identified_name.replace(" ", "").split(","):
-                        self.variables.append(VariableDefinition(
-                            name=name,
-                            address=current_address,
-                            type=matching_type
-                        ))
-                        current_address += matching_type.length
-                        self.struct_unpack_string += matching_type.struct_unpack_string
-                    continue
-
-                # Handle array definition
-                if "[" in identified_name:
-                    name, count = identified_name.split("[")
-                    count, _ = count.split("]")
-                    count = int(count)
-
-                    self.variables.append(VariableDefinition(
-                        name=name,
-                        address=current_address,
-                        type=matching_type,
-                        count=count
-                    ))
-                    current_address += matching_type.length * count
-                    self.struct_unpack_string += matching_type.struct_unpack_string * count
-                    continue
-
-                self.variables.append(VariableDefinition(
-                    name=identified_name,
-                    address=current_address,
-                    type=matching_type
-                ))
-                current_address += matching_type.length
-                self.struct_unpack_string += matching_type.struct_unpack_string
-
-            except Exception as e:
-                raise Exception(f"Unable to find a matching type for: {tokens[0]}: {e.__str__()}")
+    @classmethod
+    def compile(cls):
+        """
+        Compiles the struct decoder and the field table of the class, nested structures must
+        be compiled before the classes containing them.
+        """
+        if cls.layout is None:
+            raise Exception(f"The type of {cls.__name__} must be registered before compiling it")
+
+        fields = []
+        offsets = dict()
+        index = 0
+        for item in cls.layout.variables:
+            nested = item.type.read_function if hasattr(item.type.read_function, "decode_into") else None
+            if nested is not None and nested._struct is None:
+                raise Exception(f"Nested type {item.type.name} must be compiled before {cls.__name__}")
+            fields.append((item.name, index, item.count, nested))
+            element = struct.Struct("<" + item.type.struct_unpack_string) if nested is None else None
+            offsets[item.name] = (item.address * 2, element, item.count, nested)
+            index += item.count * (nested._value_count if nested is not None else 1)
+
+        cls._record_fields = fields
+        cls._field_offsets = offsets
+        cls._value_count = index
+        cls._struct = struct.Struct("<" + cls.layout.struct_unpack_string)
 
-        self.size = current_address
+    @classmethod
+    def new_record(cls) -> Dict[str, Any]:
+        record = dict()
+        for name, _, count, nested in cls._record_fields:
+            if nested is not None:
+                value = nested.new_record() if count == 1 else [nested.new_record() for _ in range(count)]
+            else:
+                value = 0 if count == 1 else [0] * count
+            record[name] = value
+        return record
 
-    def set_fast_data(self, values: List):
-        self.fast_data = dict()
-        sorted_keys: List[VariableDefinition] = sorted(self.variables, key=lambda v: v.address)
-        for item in sorted_keys:
-            if hasattr(item.type.read_function, "set_fast_data"):
-                if item.count > 1:
-                    fd_list = list()
-                    for i in range(item.count):
-                        fd_list.append(
-                            item.type.read_function(self.dm, item.address + item.type.length * i).set_fast_data(values)
-                        )
-                    self.fast_data[item.name] = fd_list
+    @classmethod
+    def decode_into(cls, record: Dict[str, Any], values, index=0) -> Dict[str, Any]:
+        """
+        Updates in place a record allocated by new_record with the values unpacked by the compiled struct
+        """
+        for name, start, count, nested in cls._record_fields:
+            start += index
+            if nested is None:
+                if count == 1:
+                    record[name] = values[start]
                 else:
-                    self.fast_data[item.name] = item.type.read_function(self.dm, item.address).set_fast_data(values)
+                    record[name][:] = values[start:start + count]
+            elif count == 1:
+                nested.decode_into(record[name], values, start)
             else:
-                if item.count > 1:
-                    fd_list = list()
-                    for i in range(item.count):
-                        fd_list.append(values.pop(0))
+                for i, item in enumerate(record[name]):
+                    nested.decode_into(item, values, start + i * nested._value_count)
+        return record
 
-                    self.fast_data[item.name] = fd_list
-                else:
-                    self.fast_data[item.name] = values.pop(0)
+    def parse_addresses_from_definition(self):
+        layout = self.layout
+        self.variables = layout.variables
+        self.index = layout.index
+        self.struct_unpack_string = layout.struct_unpack_string
+        self.size = layout.size
+
+    def locate(self, path: str) -> ReadRequest:
+        """
+        Resolves a variable path like "scales[2].syncEnable" into a read request with the absolute
+        address of the variable
+        """
+        variables = self.index
+        address = self.base_address
+        names = path.split(".")
+        var = None
+        count = 1
+        for position, name in enumerate(names):
+            index = None
+            if "[" in name:
+                name, index = name.split("[")
+                index = int(index.replace("]", ""))
+
+            var = variables.get(name, None)
+            if var is None:
+                raise Exception(f"Variable with name: {name} not found in {path}")
+
+            address += var.address
+            count = var.count
+            if index is not None:
+                if index < 0 or index >= var.count:
+                    raise Exception(f"Index {index} out of range for {name} in {path}")
+                address += var.type.length * index
+                count = 1
+
+            if position < len(names) - 1:
+                if not hasattr(var.type.read_function, "decode_into") or count > 1:
+                    raise Exception(f"Variable with name: {name} is not a structure in {path}")
+                nested = var.type.read_function
+                variables = nested.layout.index
+
+        return ReadRequest(key=path, address=address, length=var.type.length * count, type=var.type, count=count)
 
-        return self.fast_data
+    @ktrace()
+    def read_variables(self, paths: List[str], max_gap: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Reads a set of variables using the minimum number of read transactions, returns a dictionary
+        with the decoded values by path or None when the communication fails.
+        """
+        max_size = self.dm.max_block_size
+        blocks = plan_reads([self.locate(item) for item in paths], max_block_size=max_size, max_gap=max_gap)
+        try:
+            values = execute_plan(self.dm, blocks, max_size)
+            self.dm.connected = True
+            return values
+        except Exception as e:
+            log.error(e.__str__())
+            self.dm.connected = False
+            return None
 
     @ktrace()
-    def refresh(self):
-        remaining_size = self.size
-        max_size = 32
-        raw_data = []
-        remaining_address = self.base_address
+    def update_snapshot(self, snapshot: Optional[DeviceSnapshot] = None) -> Optional[DeviceSnapshot]:
+        """
+        Reads the registers of the device in place into the snapshot buffer, fields are decoded
+        only when accessed. Returns None when the communication fails.
+        """
+        if snapshot is None:
+            snapshot = self.snapshot
+        block = ReadBlock(address=self.base_address, length=self.size)
         with kev("read_registers"):
             try:
-                while remaining_size > max_size:
-                    part_data = self.dm.device.read_registers(
-                        registeraddress=remaining_address,
-                        number_of_registers=max_size
-                    )
-                    remaining_size -= max_size
-                    remaining_address += max_size
-                    raw_data += part_data
-
-                if remaining_size > 0:
-                    part_data = self.dm.device.read_registers(
-                        registeraddress=remaining_address,
-                        number_of_registers=remaining_size
-                    )
-                    remaining_address += remaining_size
-                    raw_data += part_data
-
+                read_block_into(self.dm, block, snapshot.view, 0, self.dm.max_block_size)
                 self.dm.connected = True
             except Exception as e:
                 # log.debug(e.__str__())
                 self.dm.connected = False
-                return
+                return None
+        return snapshot
 
-        with kev("struct"):
-            raw_bytes = struct.pack("<" + "H" * self.size, *raw_data)
-            values = list(struct.unpack("<" + self.struct_unpack_string, raw_bytes))
-        with kev("set_fast_data"):
-            return self.set_fast_data(values)
+    @ktrace()
+    def refresh(self):
+        if self.update_snapshot() is None:
+            return
+        with kev("decode"):
+            return self.decode_into(self.fast_data, self._struct.unpack_from(self.snapshot.view))
+
+
+def register_device_types(device_classes: List[Any], cache_folder=None):
+    """
+    Parses the definitions of the device classes once, then registers and compiles them in
+    dependency order so that nested structures are available to the classes using them.
+    """
+    parsed = {item: parse_definition(item.definition, cache_folder) for item in device_classes}
+    for device_class in dependency_order(parsed, variable_definitions):
+        variable_definitions.append(device_class.register_type(parsed[device_class]))
+        device_class.compile()
@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional
+
+import minimalmodbus
+from pydantic import BaseModel
+
+# Upper bounds of the latency histogram buckets in milliseconds, slower transactions go in an overflow bucket
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+# Modbus function codes used by each method of the instrument, minimalmodbus writes with function 16 by default
+FUNCTION_CODES = {
+    "read_registers": 3,
+    "read_register": 3,
+    "read_long": 3,
+    "read_float": 3,
+    "write_registers": 16,
+    "write_register": 16,
+    "write_long": 16,
+    "write_float": 16,
+}
+
+ERROR_TIMEOUT = "timeout"
+ERROR_CRC = "crc"
+ERROR_OTHER = "other"
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        # The overflow bucket has no upper bound, the slowest transaction is kept instead
+        self.maximum = 0.0
+
+    def record(self, latency_ms: float):
+        self.counts[bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.maximum = max(self.maximum, latency_ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Returns the upper bound of the bucket holding the given percentile, or None without samples.
+        Percentiles in the overflow bucket return the slowest latency recorded, above the last bound.
+        """
+        total = self.total
+        if total == 0:
+            return None
+        threshold = total * percent / 100
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= threshold and count > 0:
+                if i == len(LATENCY_BUCKETS_MS):
+                    return self.maximum
+                return LATENCY_BUCKETS_MS[i]
+        return self.maximum
+
+
+class StatsSlot:
+    """
+    Counters of the transactions completed within one time slot of the rolling window
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.transactions = Counter()
+        self.errors = Counter()
+        self.retries = 0
+        self.busy_time = 0.0
+        self.histogram = LatencyHistogram()
+
+
+class BusSummary(BaseModel):
+    window: float
+    transactions: Dict[int, int]
+    errors: Dict[str, int]
+    retries: int
+    p50_ms: Optional[float]
+    p99_ms: Optional[float]
+    # Fraction of the window spent waiting on the bus, close to 1 when the serial line is saturated
+    utilization: float
+
+    @property
+    def total_transactions(self) -> int:
+        return sum(self.transactions.values())
+
+    @property
+    def total_errors(self) -> int:
+        return sum(self.errors.values())
+
+
+def classify_error(error: Exception) -> str:
+    name = type(error).__name__
+    if "NoResponse" in name or "Timeout" in name:
+        return ERROR_TIMEOUT
+    if "Crc" in name or "CRC" in error.__str__():
+        return ERROR_CRC
+    # minimalmodbus reports a bad CRC as an invalid response
+    if isinstance(error, minimalmodbus.InvalidResponseError) and error.__str__().startswith("Checksum error"):
+        return ERROR_CRC
+    return ERROR_OTHER
+
+
+class BusStatistics:
+    """
+    Transaction counts, errors and latencies kept in a ring of time slots, so that summaries of
+    any window up to slot_length * slot_count seconds can be computed without storing every sample.
+    """
+
+    def __init__(self, slot_length=1.0, slot_count=60, clock=time.monotonic):
+        self.slot_length = slot_length
+        self.slot_count = slot_count
+        self.clock = clock
+        self.slots: List[Optional[StatsSlot]] = [None] * slot_count
+        self.lock = threading.Lock()
+
+    def current_slot(self) -> StatsSlot:
+        index = int(self.clock() // self.slot_length)
+        position = index % self.slot_count
+        slot = self.slots[position]
+        if slot is None or slot.index != index:
+            slot = StatsSlot(index)
+            self.slots[position] = slot
+        return slot
+
+    def record(self, function: int, latency: float, error: Optional[Exception] = None):
+        with self.lock:
+            slot = self.current_slot()
+            slot.transactions[function] += 1
+            slot.busy_time += latency
+            slot.histogram.record(latency * 1000)
+            if error is not None:
+                slot.errors[classify_error(error)] += 1
+
+    def record_retry(self):
+        with self.lock:
+            self.current_slot().retries += 1
+
+    def summary(self, window=10.0) -> BusSummary:
+        count = max(1, min(self.slot_count, int(round(window / self.slot_length))))
+        transactions = Counter()
+        errors = Counter()
+        retries = 0
+        busy_time = 0.0
+        histogram = LatencyHistogram()
+        with self.lock:
+            last = self.current_slot().index
+            for slot in self.slots:
+                if slot is None or last - slot.index >= count:
+                    continue
+                transactions.update(slot.transactions)
+                errors.update(slot.errors)
+                retries += slot.retries
+                busy_time += slot.busy_time
+                histogram.merge(slot.histogram)
+
+        # The current slot is only partially elapsed
+        elapsed = (count - 1) * self.slot_length + self.clock() % self.slot_length
+        return BusSummary(
+            window=count * self.slot_length,
+            transactions=dict(transactions),
+            errors=dict(errors),
+            retries=retries,
+            p50_ms=histogram.percentile(50),
+            p99_ms=histogram.percentile(99),
+            utilization=min(1.0, busy_time / elapsed) if elapsed > 0 else 0.0,
+        )
+
+
+class MeasuredInstrument:
+    """
+    Wraps an instrument recording every transaction in a BusStatistics, other attributes are
+    passed through unchanged.
+    """
+
+    def __init__(self, instrument, stats: BusStatistics):
+        self.instrument = instrument
+        self.stats = stats
+
+    def __getattr__(self, name):
+        attribute = getattr(self.instrument, name)
+        function = FUNCTION_CODES.get(name, None)
+        if function is None or not callable(attribute):
+            return attribute
+
+        def measured(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as e:
+                self.stats.record(function, time.perf_counter() - started, e)
+                raise
+            self.stats.record(function, time.perf_counter() - started)
+            return result
+
+        return measured
@@ -1,35 +1,335 @@
+import itertools
 import logging
-from typing import Optional
+import threading
+from collections import OrderedDict
+from enum import IntEnum
+from typing import Optional, Callable, Dict, Hashable
 
 import minimalmodbus
 from keke import ktrace
 
+from rcp.utils.bus_stats import BusStatistics, MeasuredInstrument
+from rcp.utils import settings_codec
+from rcp.utils.paths import settings_folder
+
 log = logging.getLogger(__name__)
 
+MODBUS_MAX_REGISTERS = 125
+MODBUS_MAX_WRITE_REGISTERS = 123
+DEFAULT_BLOCK_SIZE = 32
+# Reads of a probed block size that must succeed before it's cached
+BLOCK_SIZE_CONFIRM_READS = 3
+
+
+class Priority(IntEnum):
+    """
+    Priority of the queued bus commands, lower values run first. The poll frames are read
+    only after all the pending commands have been sent.
+    """
+    MOTION = 0
+    CONFIGURATION = 1
+
+
+class CommandQueue:
+    """
+    Commands waiting to be sent by the polling thread. A command queued with the key of a pending
+    one replaces it and moves to the end of the queue, so only the latest value of a variable is
+    sent and it's never followed by a write queued before it.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = {priority: OrderedDict() for priority in Priority}
+        self.unique_keys = itertools.count()
+        self.coalesced = 0
+
+    def put(self, command: Callable, key: Optional[Hashable] = None, priority: Priority = Priority.CONFIGURATION):
+        """
+        Queues a command, commands without a key are never coalesced
+        """
+        if key is None:
+            key = ("unique", next(self.unique_keys))
+        with self.condition:
+            queue = self.pending[priority]
+            if key in queue:
+                self.coalesced += 1
+                del queue[key]
+            queue[key] = command
+            self.condition.notify_all()
+
+    def pop(self) -> Optional[Callable]:
+        with self.condition:
+            for priority in Priority:
+                queue = self.pending[priority]
+                if len(queue) > 0:
+                    return queue.popitem(last=False)[1]
+        return None
+
+    def drop(self, priority: Priority) -> int:
+        """
+        Discards the pending commands of a priority, returns the number of commands dropped
+        """
+        with self.condition:
+            queue = self.pending[priority]
+            commands = list(queue.values())
+            queue.clear()
+        for command in commands:
+            if hasattr(command, "cancel"):
+                command.cancel()
+        return len(commands)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits until a command is queued or the timeout expires, returns True if commands are pending
+        """
+        with self.condition:
+            if len(self) == 0:
+                self.condition.wait(timeout)
+            return len(self) > 0
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+
+class WriteTracker:
+    """
+    Tells whether a snapshot already reflects the writes queued for a register, so that values the
+    UI both writes and mirrors from the snapshots are not overwritten by a snapshot read before the
+    write was sent. Writes are numbered when they are queued and the reads of the polling thread
+    when they start, a register is current in a snapshot when none of its writes is pending and the
+    snapshot was read after the last one was sent.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sequence = itertools.count(1)
+        self.reads = 0
+        # Latest write queued and not yet sent, by register address
+        self.pending: Dict[int, int] = dict()
+        # First read including the last write sent, by register address
+        self.settled: Dict[int, int] = dict()
+
+    def queued(self, address: int, length: int) -> int:
+        with self.lock:
+            sequence = next(self.sequence)
+            for register in range(address, address + length):
+                self.pending[register] = sequence
+            return sequence
+
+    def sent(self, address: int, length: int, sequence: int):
+        """
+        Called once the write was sent, or dropped, whatever its outcome
+        """
+        with self.lock:
+            for register in range(address, address + length):
+                if self.pending.get(register, None) == sequence:
+                    del self.pending[register]
+                self.settled[register] = self.reads + 1
+
+    def start_read(self) -> int:
+        """
+        Numbers the read about to start, stored in the snapshot it fills
+        """
+        with self.lock:
+            self.reads += 1
+            return self.reads
+
+    def is_current(self, address: int, length: int, read: int) -> bool:
+        with self.lock:
+            for register in range(address, address + length):
+                if register in self.pending or read < self.settled.get(register, 0):
+                    return False
+            return True
+
+
+class QueuedWrite:
+    """
+    Write queued for the polling thread, reported to the tracker once it was sent or dropped
+    """
+
+    def __init__(self, tracker: WriteTracker, function: Callable, address: int, length: int):
+        self.tracker = tracker
+        self.function = function
+        self.address = address
+        self.length = length
+        self.sequence = tracker.queued(address, length)
+
+    def __call__(self):
+        try:
+            return self.function()
+        finally:
+            self.tracker.sent(self.address, self.length, self.sequence)
+
+    def cancel(self):
+        self.tracker.sent(self.address, self.length, self.sequence)
+
+
+TRANSPORT_MINIMALMODBUS = "minimalmodbus"
+TRANSPORT_ASYNCIO = "asyncio"
+
 
 class ConnectionManager:
     def __init__(
-        self, serial_device="/dev/ttyUSB0", baudrate=115200, address=17, debug=False
+        self, serial_device="/dev/ttyUSB0", baudrate=115200, address=17, debug=False,
+        transport=TRANSPORT_MINIMALMODBUS
         #self, serial_device="COM26", baudrate=115200, address=17, debug=False
     ):
+        self.serial_device = serial_device
+        self.address = address
+        self.max_block_size = DEFAULT_BLOCK_SIZE
+        self.block_size_negotiated = False
+        # Serializes the transactions of the polling thread with the ones issued by the UI
+        self.lock = threading.RLock()
+        # Writes are queued for the polling thread while it's running
+        self.commands = CommandQueue()
+        self.queue_writes = False
+        self.writes = WriteTracker()
+        self.stats = BusStatistics()
         try:
-            self.device: minimalmodbus.Instrument = minimalmodbus.Instrument(
-                port=serial_device, slaveaddress=address, debug=debug
-            )
-            self.device.serial.timeout = 0.1
-            self.device.serial.write_timeout = 0.1
-            self.device.serial.baudrate = baudrate
+            if transport == TRANSPORT_ASYNCIO:
+                from rcp.utils.rtu import RtuInstrument
+                instrument = RtuInstrument(port=serial_device, slaveaddress=address, baudrate=baudrate, timeout=0.1)
+            else:
+                instrument = minimalmodbus.Instrument(port=serial_device, slaveaddress=address, debug=debug)
+                instrument.serial.timeout = 0.1
+                instrument.serial.write_timeout = 0.1
+                instrument.serial.baudrate = baudrate
+            self.device = MeasuredInstrument(instrument, self.stats)
             self.connected = True
         except Exception as e:
             log.error(e.__str__())
             self.connected = False
 
+    def close(self):
+        device = getattr(self, "device", None)
+        if device is None:
+            return
+        try:
+            with self.lock:
+                if hasattr(device, "serial"):
+                    device.serial.close()
+                else:
+                    device.close()
+        except Exception as e:
+            log.error(e.__str__())
+
+    @property
+    def block_size_key(self):
+        return f"{self.serial_device}:{self.address}"
+
+    @staticmethod
+    def block_size_cache_file():
+        return settings_folder() / f"block_size{settings_codec.DEFAULT_EXTENSION}"
+
+    def read_block_size_cache(self) -> dict:
+        try:
+            return settings_codec.read_file(self.block_size_cache_file()) or dict()
+        except FileNotFoundError:
+            return dict()
+        except Exception as e:
+            log.error(e.__str__())
+            return dict()
+
+    def write_block_size_cache(self, size: Optional[int]):
+        """
+        Stores the block size of the device, None removes it from the cache
+        """
+        data = self.read_block_size_cache()
+        if size is None:
+            if self.block_size_key not in data:
+                return
+            del data[self.block_size_key]
+        else:
+            data[self.block_size_key] = size
+        try:
+            settings_codec.write_file(self.block_size_cache_file(), data)
+        except Exception as e:
+            log.error(e.__str__())
+
+    def try_read_block(self, size: int, address=0, retries=1) -> bool:
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                self.stats.record_retry()
+            try:
+                with self.lock:
+                    self.device.read_registers(registeraddress=address, number_of_registers=size)
+                return True
+            except Exception as e:
+                log.debug(f"Read of {size} registers failed: {e.__str__()}")
+        return False
+
+    def probe_block_size(self, limit=MODBUS_MAX_REGISTERS, address=0) -> int:
+        """
+        Bisects the largest number of registers the firmware accepts in a single read, the limit
+        must not exceed the size of the register map starting at address. Returns 0 when no read
+        succeeds at all.
+        """
+        if self.try_read_block(limit, address):
+            return limit
+
+        good, bad = 0, limit
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if self.try_read_block(middle, address):
+                good = middle
+            else:
+                bad = middle
+        return good
+
+    def confirm_block_size(self, size: int, address=0) -> bool:
+        for _ in range(BLOCK_SIZE_CONFIRM_READS):
+            if not self.try_read_block(size, address, retries=0):
+                return False
+        return True
+
+    def negotiate_block_size(self, limit=MODBUS_MAX_REGISTERS, address=0):
+        """
+        Configures max_block_size when the link is established. The cached size is checked on every
+        connection, it's probed again when a larger read succeeds, as a read disturbed by noise may
+        have made the previous probe stop short, or when a read of that size fails. Probed sizes
+        are cached only once confirmed by several reads.
+        """
+        limit = min(limit, MODBUS_MAX_REGISTERS)
+        cached = self.read_block_size_cache().get(self.block_size_key, None)
+        if cached is not None:
+            size = min(int(cached), limit)
+            if size < limit and self.try_read_block(size + 1, address, retries=0):
+                log.info(f"Reads larger than the cached block size {size} succeed, probing again")
+            elif self.try_read_block(size, address):
+                self.max_block_size = size
+                self.block_size_negotiated = True
+                log.info(f"Using cached block size: {self.max_block_size}")
+                return self.max_block_size
+            else:
+                log.warning(f"Reads of the cached block size {size} fail, probing again")
+            self.write_block_size_cache(None)
+
+        size = self.probe_block_size(limit, address)
+        if size == 0:
+            log.error("Unable to negotiate the block size, keeping the default")
+            return self.max_block_size
+
+        self.max_block_size = size
+        self.block_size_negotiated = True
+        if self.confirm_block_size(size, address):
+            self.write_block_size_cache(size)
+        else:
+            log.warning(f"Block size {size} not confirmed, it will be probed again on the next connection")
+        log.info(f"Negotiated block size: {self.max_block_size}")
+        return self.max_block_size
+
+
 @ktrace("address")
 def read_float(dm: ConnectionManager, address) -> float:
     try:
-        value = dm.device.read_float(
-            address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
-        )
+        with dm.lock:
+            value = dm.device.read_float(
+                address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
+            )
         dm.connected = True
         return value
     except Exception as e:
@@ -41,9 +341,10 @@ def read_float(dm: ConnectionManager, address) -> float:
 @ktrace("address")
 def write_float(dm, address, value, variable_name: Optional[str] = ""):
     try:
-        dm.device.write_float(
-            address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP, value=value
-        )
+        with dm.lock:
+            dm.device.write_float(
+                address, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP, value=value
+            )
         dm.connected = True
         log.info(f"Write {variable_name}: float {value} to address {address}")
     except Exception as e:
@@ -54,9 +355,10 @@ def write_float(dm, address, value, variable_name: Optional[str] = ""):
 @ktrace("address")
 def read_long(dm, address) -> int:
     try:
-        value = dm.device.read_long(
-            address, signed=True, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
-        )
+        with dm.lock:
+            value = dm.device.read_long(
+                address, signed=True, byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP
+            )
         dm.connected = True
         return value
     except Exception as e:
@@ -68,12 +370,13 @@ def read_long(dm, address) -> int:
 @ktrace("address")
 def write_long(dm, address, value, variable_name: Optional[str] = ""):
     try:
-        dm.device.write_long(
-            address,
-            signed=True,
-            byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP,
-            value=int(value),
-        )
+        with dm.lock:
+            dm.device.write_long(
+                address,
+                signed=True,
+                byteorder=minimalmodbus.BYTEORDER_LITTLE_SWAP,
+                value=int(value),
+            )
         dm.connected = True
         log.info(f"Write {variable_name}: long {value} to address {address}")
     except Exception as e:
@@ -84,7 +387,8 @@ def write_long(dm, address, value, variable_name: Optional[str] = ""):
 @ktrace("address")
 def read_unsigned(dm, address):
     try:
-        value = dm.device.read_register(address, signed=False)
+        with dm.lock:
+            value = dm.device.read_register(address, signed=False)
         dm.connected = True
         return value
     except Exception as e:
@@ -96,7 +400,8 @@ def read_unsigned(dm, address):
 @ktrace("address")
 def write_unsigned(dm, address, value, variable_name: Optional[str] = ""):
     try:
-        dm.device.write_register(address, signed=False, value=int(value))
+        with dm.lock:
+            dm.device.write_register(address, signed=False, value=int(value))
         dm.connected = True
         log.info(f"Write {variable_name}: unsigned {value} to address {address}")
     except Exception as e:
@@ -107,7 +412,8 @@ def write_unsigned(dm, address, value, variable_name: Optional[str] = ""):
 @ktrace("address")
 def read_signed(dm, address):
     try:
-        value = dm.device.read_register(address, signed=True)
+        with dm.lock:
+            value = dm.device.read_register(address, signed=True)
         dm.connected = True
         return value
     except Exception as e:
@@ -119,9 +425,22 @@ def read_signed(dm, address):
 @ktrace("address")
 def write_signed(dm, address, value, variable_name: Optional[str] = ""):
     try:
-        dm.device.write_register(address, signed=True, value=int(value))
+        with dm.lock:
+            dm.device.write_register(address, signed=True, value=int(value))
         dm.connected = True
         log.info(f"Write {variable_name}: signed {value} to address {address}")
     except Exception as e:
         dm.connected = False
         log.error(e.__str__())
+
+
+@ktrace("address")
+def write_registers(dm, address, values, variable_name: Optional[str] = ""):
+    try:
+        with dm.lock:
+            dm.device.write_registers(address, list(values))
+        dm.connected = True
+        log.info(f"Write {variable_name}: {len(values)} registers to address {address}")
+    except Exception as e:
+        dm.connected = False
+        log.error(e.__str__())
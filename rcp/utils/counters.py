@@ -0,0 +1,82 @@
+import logging
+import time
+from typing import List, Optional, Sequence
+
+log = logging.getLogger(__name__)
+
+INT32_OFFSET = 1 << 31
+UINT32_MASK = 0xFFFFFFFF
+
+# Fastest plausible encoder, a 1um scale moving at 5 m/s
+MAX_STEPS_PER_SECOND = 5_000_000
+# Shortest time used for the limit, snapshots can be published closer than the poll interval
+MIN_ELAPSED = 0.1
+
+
+def wrapped_delta(current: int, previous: int) -> int:
+    """
+    Signed change between two readings of a 32 bit counter, assuming it wrapped at most once
+    """
+    return ((current - previous + INT32_OFFSET) & UINT32_MASK) - INT32_OFFSET
+
+
+def wrapped_deltas(current: Sequence[int], previous: Sequence[int]) -> List[int]:
+    return [((c - p + INT32_OFFSET) & UINT32_MASK) - INT32_OFFSET for c, p in zip(current, previous)]
+
+
+class WrappedCounters:
+    """
+    Tracks an array of wrapping 32 bit counters, returning the change of each counter at every update.
+
+    A change faster than max_speed steps per second can't come from the encoders, it is either a
+    corrupted frame or the counter being reset by the board. Such jumps are reported and never
+    returned as a change: the reference is kept until the counter shows a plausible change again,
+    from the old value after a bad frame, or from the new value after a reset. The first update
+    is always accepted.
+    """
+
+    def __init__(self, count: int, max_speed=MAX_STEPS_PER_SECOND, clock=time.monotonic):
+        self.max_speed = max_speed
+        self.clock = clock
+        self.previous = [0] * count
+        self.suspects: List[Optional[int]] = [None] * count
+        self.glitches = [0] * count
+        self.timestamp: Optional[float] = None
+
+    def reset(self, counters: Sequence[int], now: Optional[float] = None):
+        """
+        Takes the counters as the new reference without reporting any change
+        """
+        self.previous = list(counters)
+        self.suspects = [None] * len(self.previous)
+        self.timestamp = self.clock() if now is None else now
+
+    def update(self, counters: Sequence[int], now: Optional[float] = None) -> List[int]:
+        now = self.clock() if now is None else now
+        if self.timestamp is None:
+            # The first readings are taken as they are, the board counts from its own start
+            elapsed = limit = float("inf")
+        else:
+            elapsed = max(MIN_ELAPSED, now - self.timestamp)
+            limit = self.max_speed * elapsed
+        self.timestamp = now
+
+        deltas = wrapped_deltas(counters, self.previous)
+        for i, delta in enumerate(deltas):
+            if -limit <= delta <= limit:
+                self.previous[i] = counters[i]
+                self.suspects[i] = None
+                continue
+
+            deltas[i] = 0
+            suspect = self.suspects[i]
+            if suspect is not None and abs(wrapped_delta(counters[i], suspect)) <= limit:
+                log.warning(f"Counter {i} was reset, from {self.previous[i]} to {counters[i]}")
+                self.previous[i] = counters[i]
+                self.suspects[i] = None
+                continue
+
+            self.glitches[i] += 1
+            self.suspects[i] = counters[i]
+            log.warning(f"Counter {i} jumped by {delta} steps in {elapsed:.3f}s, ignored")
+        return deltas
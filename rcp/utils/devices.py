@@ -1,12 +1,8 @@
-import copy
-import inspect
-
-import sys
+import os
 import time
 
-from rcp.utils.base_device import BaseDevice
+from rcp.utils.base_device import BaseDevice, register_device_types
 from rcp.utils.communication import ConnectionManager
-from rcp.utils.base_device import variable_definitions
 
 SCALES_COUNT = 4
 
@@ -24,6 +20,9 @@ typedef struct {
   uint32_t desiredSteps;
 } servo_t;
 """
+    motion_variables = {"jogSpeed", "direction"}
+    # Each write of direction requests a relative move
+    cumulative_variables = {"direction"}
 
 
 class Global(BaseDevice):
@@ -67,28 +66,11 @@ typedef struct {
   uint16_t servoEnable;
 } fastData_t;
 """
+    motion_variables = {"servoEnable"}
 
 
-current_module = sys.modules[__name__]
-clsmembers = [
-    item
-    for item in inspect.getmembers(sys.modules[__name__], inspect.isclass)
-    if issubclass(item[1], BaseDevice) and item[0] != "BaseDevice"
-]
-
-unloaded_list = copy.deepcopy(clsmembers)
-iterations_limit = 3
-while len(unloaded_list) > 0 and iterations_limit > 0:
-    failure_list = []
-    for my_class in unloaded_list:
-        my_class[1]: BaseDevice
-        try:
-            definition = my_class[1].register_type()
-            variable_definitions.append(definition)
-        except Exception as e:
-            failure_list.append(my_class)
-    unloaded_list = copy.deepcopy(failure_list)
-    iterations_limit -= 1
+# Set RCP_LAYOUT_CACHE to a folder to keep the parsed definitions across restarts
+register_device_types([Servo, Global, Scale, FastData], cache_folder=os.environ.get("RCP_LAYOUT_CACHE", None))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import re
+from typing import Any, Dict, Optional, Tuple
+
+# Precision of the first fixed point field of a format string, as in "{:+0.3f}"
+PRECISION_PATTERN = re.compile(r"\{[^}]*\.(\d+)f[^}]*\}")
+
+
+def format_precision(text_format: str) -> Optional[int]:
+    match = PRECISION_PATTERN.search(text_format)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+class DisplayUpdates:
+    """
+    Assigns the formatted texts of a widget only when they change, every assignment makes the label
+    render its texture again. Values are first rounded to the precision of the format, so that the
+    formatting itself is skipped while the value is the same on the display.
+    """
+
+    def __init__(self, widget):
+        self.widget = widget
+        # Format, precision and last rounded value of each text
+        self.fields: Dict[str, Tuple[str, Optional[int], Any]] = dict()
+        self.emitted = 0
+        self.suppressed = 0
+
+    def set(self, name: str, text_format: str, value) -> bool:
+        """
+        Formats the value into the named property of the widget, returns True if the text changed
+        """
+        field = self.fields.get(name, None)
+        if field is None or field[0] != text_format:
+            field = (text_format, format_precision(text_format), None)
+
+        precision = field[1]
+        if precision is None:
+            key = value
+        else:
+            # Values rounding to zero are still displayed with their sign
+            key = (round(value, precision), value < 0)
+
+        if key == field[2]:
+            self.suppressed += 1
+            return False
+        self.fields[name] = (text_format, precision, key)
+
+        text = text_format.format(value)
+        if text == getattr(self.widget, name):
+            self.suppressed += 1
+            return False
+
+        setattr(self.widget, name, text)
+        self.emitted += 1
+        return True
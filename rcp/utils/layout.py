@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import os
+import re
+from pathlib import Path
+from types import MappingProxyType
+from typing import Optional, List, Any, Dict, Mapping, Tuple
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+from rcp.utils import settings_codec
+
+log = logging.getLogger(__name__)
+
+
+class TypeDefinition(BaseModel):
+    name: str
+    length: int
+    read_function: Any
+    write_function: Optional[Any]
+    struct_unpack_string: str
+
+
+class VariableDefinition(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    address: int
+    type: TypeDefinition
+    count: int = 1
+
+
+class ParsedMember(BaseModel):
+    type_name: str
+    name: str
+    count: int = 1
+
+
+class ParsedTypedef(BaseModel):
+    name: str
+    members: List[ParsedMember]
+
+
+class Layout(BaseModel):
+    """
+    Register layout of a typedef, computed once and shared by all the instances of a device class
+    """
+    model_config = ConfigDict(frozen=True)
+
+    name: str
+    size: int
+    struct_unpack_string: str
+    variables: Tuple[VariableDefinition, ...]
+    index: Mapping[str, VariableDefinition]
+
+    @field_validator("index", mode="after")
+    @classmethod
+    def read_only_index(cls, value):
+        # Shared by every device of the class, the index can't be changed through any of them
+        return MappingProxyType(dict(value))
+
+
+def definition_hash(definition: str) -> str:
+    return hashlib.sha256(definition.encode("utf-8")).hexdigest()
+
+
+def parse_definition(definition: str, cache_folder: Optional[Path] = None) -> ParsedTypedef:
+    """
+    Parses a C typedef struct definition into its name and list of members, when a cache folder
+    is specified the result is stored there keyed by the hash of the definition text.
+    """
+    cache_file = None
+    if cache_folder is not None:
+        cache_file = Path(cache_folder) / f"{definition_hash(definition)}{settings_codec.DEFAULT_EXTENSION}"
+        if cache_file.exists():
+            try:
+                return ParsedTypedef(**settings_codec.read_file(cache_file))
+            except Exception as e:
+                log.error(f"Ignoring layout cache {cache_file}: {e.__str__()}")
+
+    name = None
+    members = []
+    for line in definition.split(sep="\n"):
+        line = line.split("//")[0]
+        tokens = [item for item in line.replace(";", " ").replace("*", " ").split(" ") if len(item) > 0]
+
+        # Skip lines that don't represent a member definition
+        if len(tokens) == 0 or "typedef" in tokens or "{" in tokens:
+            continue
+        if "}" in tokens:
+            name = tokens[1]
+            continue
+
+        type_name = tokens[0]
+        for item in "".join(tokens[1:]).split(","):
+            match = re.fullmatch(r"(\w+)(?:\[(\d+)])?", item)
+            if match is None:
+                raise Exception(f"Unable to parse member definition: {line.strip()}")
+            count = int(match.group(2)) if match.group(2) is not None else 1
+            members.append(ParsedMember(type_name=type_name, name=match.group(1), count=count))
+
+    if name is None:
+        raise Exception("Unable to identify the typedef name from the provided definition")
+
+    parsed = ParsedTypedef(name=name, members=members)
+    if cache_file is not None:
+        try:
+            os.makedirs(cache_file.parent, exist_ok=True)
+            settings_codec.write_file(cache_file, parsed.model_dump())
+        except Exception as e:
+            log.error(e.__str__())
+    return parsed
+
+
+def build_layout(parsed: ParsedTypedef, known_types: List[TypeDefinition]) -> Layout:
+    types = {item.name: item for item in known_types}
+    current_address = 0
+    struct_unpack_string = ""
+    variables = []
+    for member in parsed.members:
+        matching_type = types.get(member.type_name, None)
+        if matching_type is None:
+            raise Exception(f"Unable to find a matching type for: {member.type_name} in {parsed.name}")
+
+        variables.append(VariableDefinition(
+            name=member.name,
+            address=current_address,
+            type=matching_type,
+            count=member.count
+        ))
+        current_address += matching_type.length * member.count
+        struct_unpack_string += matching_type.struct_unpack_string * member.count
+
+    return Layout(
+        name=parsed.name,
+        size=current_address,
+        struct_unpack_string=struct_unpack_string,
+        variables=tuple(variables),
+        index={item.name: item for item in variables},
+    )
+
+
+def dependency_order(parsed: Dict[Any, ParsedTypedef], known_types: List[TypeDefinition]) -> List[Any]:
+    """
+    Sorts the keys of the parsed typedefs so that every typedef comes after the ones it uses
+    """
+    by_name = {item.name: key for key, item in parsed.items()}
+    known_names = {item.name for item in known_types}
+    dependencies = dict()
+    for key, item in parsed.items():
+        dependencies[key] = set()
+        for member in item.members:
+            if member.type_name in by_name:
+                dependencies[key].add(by_name[member.type_name])
+            elif member.type_name not in known_names:
+                raise Exception(f"Unable to find a matching type for: {member.type_name} in {item.name}")
+
+    order = []
+    ready = [key for key in parsed.keys() if len(dependencies[key]) == 0]
+    while len(ready) > 0:
+        key = ready.pop(0)
+        order.append(key)
+        for other in parsed.keys():
+            if key in dependencies[other]:
+                dependencies[other].remove(key)
+                if len(dependencies[other]) == 0:
+                    ready.append(other)
+
+    if len(order) != len(parsed):
+        unresolved = [parsed[key].name for key in parsed.keys() if key not in order]
+        raise Exception(f"Circular type dependencies between: {', '.join(unresolved)}")
+    return order
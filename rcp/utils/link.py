@@ -0,0 +1,125 @@
+import logging
+import threading
+from enum import Enum
+from typing import Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+BACKOFF_INITIAL = 0.25
+BACKOFF_MAX = 4.0
+# Consecutive failed polls tolerated before a live link is considered lost
+MAX_FAILURES = 3
+
+
+class LinkState(Enum):
+    PROBING = "probing"
+    SYNCING = "syncing"
+    LIVE = "live"
+    DEGRADED = "degraded"
+    LOST = "lost"
+
+
+class LinkMonitor:
+    """
+    State machine of the link with the board, fed with the outcome of every poll.
+
+    A lost link is probed with exponential backoff. Once the board answers, the resync callback
+    reads the configuration in one go before the link goes live. Failures on a live link only
+    degrade it at first, so short dropouts don't force a resync and don't flip connected.
+    """
+
+    def __init__(
+        self,
+        resync: Optional[Callable[[], bool]] = None,
+        max_failures=MAX_FAILURES,
+        backoff_initial=BACKOFF_INITIAL,
+        backoff_max=BACKOFF_MAX,
+    ):
+        self.resync = resync
+        self.max_failures = max_failures
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.backoff = backoff_initial
+        self.failures = 0
+        self.state = LinkState.PROBING
+        self.listeners: List[Callable[[LinkState, LinkState], None]] = []
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self.state in (LinkState.LIVE, LinkState.DEGRADED)
+
+    def subscribe(self, callback: Callable[[LinkState, LinkState], None]):
+        """
+        Registers a callback receiving the previous and the new state, called from the polling thread
+        """
+        with self.lock:
+            self.listeners.append(callback)
+
+    def unsubscribe(self, callback: Callable[[LinkState, LinkState], None]):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def set_state(self, state: LinkState):
+        previous = self.state
+        if previous == state:
+            return
+        self.state = state
+        log.info(f"Link {previous.value} -> {state.value}")
+        with self.lock:
+            listeners = list(self.listeners)
+        for callback in listeners:
+            try:
+                callback(previous, state)
+            except Exception as e:
+                log.error(f"Link state listener failed: {e.__str__()}")
+
+    def probe(self):
+        """
+        Called before polling a lost link again
+        """
+        if self.state == LinkState.LOST:
+            self.set_state(LinkState.PROBING)
+
+    def record_success(self):
+        self.failures = 0
+        if self.state == LinkState.DEGRADED:
+            self.set_state(LinkState.LIVE)
+            return
+        if self.state in (LinkState.PROBING, LinkState.LOST):
+            self.set_state(LinkState.SYNCING)
+            if not self.run_resync():
+                self.lose()
+                return
+            self.backoff = self.backoff_initial
+            self.set_state(LinkState.LIVE)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == LinkState.LIVE:
+            self.set_state(LinkState.DEGRADED)
+        if self.state == LinkState.DEGRADED and self.failures < self.max_failures:
+            return
+        self.lose()
+
+    def lose(self):
+        if self.state != LinkState.LOST:
+            self.set_state(LinkState.LOST)
+
+    def run_resync(self) -> bool:
+        if self.resync is None:
+            return True
+        try:
+            return self.resync() is not False
+        except Exception as e:
+            log.error(f"Resync failed: {e.__str__()}")
+            return False
+
+    def retry_interval(self) -> float:
+        """
+        Time to wait before the next probe, doubling at every call until the link is live again
+        """
+        interval = self.backoff
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+        return interval
@@ -0,0 +1,9 @@
+import os
+from pathlib import Path
+
+
+def settings_folder() -> Path:
+    home_folder = os.environ.get('HOME')
+    folder = Path(home_folder) / ".config" / "rotary-controller-python"
+    os.makedirs(folder, exist_ok=True)
+    return folder
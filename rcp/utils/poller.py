@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from typing import Optional, Callable, Set
+
+from rcp.utils.communication import Priority
+from rcp.utils.link import LinkMonitor, LinkState
+from rcp.utils.snapshot import DeviceSnapshot
+
+log = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0 / 30
+# Used while anything moves, the display is updated at the same rate meanwhile
+ACTIVE_INTERVAL = 1.0 / 60
+IDLE_INTERVAL = 1.0 / 10
+MOTION_HOLD_TIME = 1.0
+MAX_COMMANDS_PER_FRAME = 8
+
+
+class SnapshotSlot:
+    """
+    Double buffered handoff of device snapshots between a single writer and any number of readers.
+
+    The writer fills the back buffer and publishes it by incrementing the sequence number, readers
+    copy the front buffer and retry when the sequence changed while copying, as the writer may
+    have started reusing the buffer they were reading.
+    """
+
+    def __init__(self, device_class):
+        self.buffers = [DeviceSnapshot(device_class), DeviceSnapshot(device_class)]
+        self.sequence = 0
+
+    @property
+    def back(self) -> DeviceSnapshot:
+        return self.buffers[(self.sequence + 1) % 2]
+
+    @property
+    def front(self) -> DeviceSnapshot:
+        return self.buffers[self.sequence % 2]
+
+    def publish(self, timestamp: float):
+        self.back.timestamp = timestamp
+        self.sequence += 1
+
+    def read_into(self, target: DeviceSnapshot, last_sequence: Optional[int] = None) -> int:
+        """
+        Copies the latest snapshot into target unless it was already read, returns its sequence number
+        """
+        while True:
+            sequence = self.sequence
+            if sequence == last_sequence:
+                return sequence
+
+            source = self.buffers[sequence % 2]
+            target.view[:] = source.view
+            target.timestamp = source.timestamp
+            target.read_sequence = source.read_sequence
+            if self.sequence == sequence:
+                return sequence
+
+
+class PollRateScheduler:
+    """
+    Chooses the polling interval from the motion state in the last FastData snapshot.
+
+    The fast rate is used while any scale or the servo moves, and kept for hold_time seconds after
+    everything stopped so that jogging in short steps doesn't make the rate flap. Operations like
+    a threading cycle engage the fast rate for as long as they run, even while nothing moves.
+    """
+
+    def __init__(self, active_interval=ACTIVE_INTERVAL, idle_interval=IDLE_INTERVAL, hold_time=MOTION_HOLD_TIME):
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.hold_time = hold_time
+        self.last_motion: Optional[float] = None
+        self.active = False
+        self.interval = idle_interval
+        self.engaged: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def engage(self, reason: str, engaged: bool = True):
+        """
+        Keeps the fast rate while the named operation runs, called from any thread
+        """
+        with self.lock:
+            if engaged:
+                self.engaged.add(reason)
+            else:
+                self.engaged.discard(reason)
+
+    @staticmethod
+    def in_motion(snapshot) -> bool:
+        if snapshot.stepsToGo != 0 or snapshot.servoSpeed != 0:
+            return True
+        return any(speed != 0 for speed in snapshot.scaleSpeed)
+
+    def next_interval(self, snapshot, now: float) -> float:
+        with self.lock:
+            engaged = len(self.engaged) > 0
+        if engaged or self.in_motion(snapshot):
+            self.last_motion = now
+        self.active = self.last_motion is not None and now - self.last_motion < self.hold_time
+        self.interval = self.active_interval if self.active else self.idle_interval
+        return self.interval
+
+
+class Poller(threading.Thread):
+    """
+    Polls a device from a dedicated thread, publishing timestamped snapshots through a SnapshotSlot
+    """
+
+    def __init__(
+        self,
+        device,
+        on_connect: Optional[Callable] = None,
+        interval=POLL_INTERVAL,
+        scheduler: Optional[PollRateScheduler] = None
+    ):
+        super().__init__(name="poller", daemon=True)
+        self.device = device
+        self.slot = SnapshotSlot(type(device))
+        self.interval = interval
+        self.scheduler = scheduler
+        self.link = LinkMonitor(resync=on_connect)
+        self.link.subscribe(self.on_link_state)
+        self.stopping = threading.Event()
+
+    @property
+    def connected(self) -> bool:
+        return self.link.connected
+
+    @property
+    def current_interval(self) -> float:
+        """
+        Interval between the snapshots published by the polling thread at the moment
+        """
+        if self.scheduler is None:
+            return self.interval
+        return self.scheduler.interval
+
+    def on_link_state(self, previous: LinkState, state: LinkState):
+        if state == LinkState.LOST:
+            self.drop_motion()
+
+    def drop_motion(self) -> int:
+        """
+        Discards the queued motion commands, a move sent once the link is back would start long after
+        the operator asked for it. Configuration writes are kept, sending them again is harmless.
+        """
+        dropped = self.device.dm.commands.drop(Priority.MOTION)
+        if dropped > 0:
+            log.warning(f"Dropped {dropped} motion commands while disconnected")
+        return dropped
+
+    def poll_once(self) -> bool:
+        self.slot.back.read_sequence = self.device.dm.writes.start_read()
+        if self.device.update_snapshot(self.slot.back) is None:
+            self.link.record_failure()
+            return False
+
+        # The resync runs before publishing, so readers see the new state only when it's ready
+        self.link.record_success()
+        if self.link.state == LinkState.LIVE:
+            self.slot.publish(time.monotonic())
+        return self.link.connected
+
+    def next_interval(self, now: float) -> float:
+        if self.scheduler is None:
+            return self.interval
+        return self.scheduler.next_interval(self.slot.front, now)
+
+    def run_commands(self, limit=MAX_COMMANDS_PER_FRAME) -> int:
+        """
+        Sends up to limit queued commands, returns the number of commands sent
+        """
+        commands = self.device.dm.commands
+        for count in range(limit):
+            command = commands.pop()
+            if command is None:
+                return count
+            try:
+                command()
+            except Exception as e:
+                log.error(f"Command failed: {e.__str__()}")
+        return limit
+
+    def run(self):
+        dm = self.device.dm
+        dm.queue_writes = True
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            self.link.probe()
+            if self.link.connected:
+                self.run_commands()
+            else:
+                self.drop_motion()
+            try:
+                self.poll_once()
+            except Exception as e:
+                log.error(f"Polling failed: {e.__str__()}")
+                self.link.record_failure()
+
+            # Commands queued while waiting for the next frame are sent right away, a lost link is
+            # probed again with increasing delays
+            if self.link.state == LinkState.LOST:
+                deadline = started + self.link.retry_interval()
+            else:
+                deadline = started + self.next_interval(started)
+            while not self.stopping.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not self.link.connected:
+                    # Configuration commands are kept queued and sent once the link is live again
+                    self.drop_motion()
+                    self.stopping.wait(remaining)
+                elif dm.commands.wait(remaining):
+                    self.run_commands()
+
+        dm.queue_writes = False
+        if not self.link.connected:
+            self.drop_motion()
+        self.run_commands(limit=len(dm.commands))
+
+    def stop(self, timeout: Optional[float] = None):
+        self.stopping.set()
+        self.device.dm.commands.wake()
+        if self.is_alive():
+            self.join(timeout)
+
+    def read_into(self, target: DeviceSnapshot, last_sequence: Optional[int] = None) -> int:
+        return self.slot.read_into(target, last_sequence)
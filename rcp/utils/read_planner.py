@@ -0,0 +1,134 @@
+import struct
+from typing import List, Any, Optional, Dict, Iterable
+
+from keke import kev
+from pydantic import BaseModel
+
+from rcp.utils.communication import MODBUS_MAX_REGISTERS
+
+
+class ReadRequest(BaseModel):
+    """
+    A single variable to be fetched, addressed in absolute registers.
+    """
+    key: Any
+    address: int
+    length: int
+    type: Any = None
+    count: int = 1
+
+    @property
+    def end(self) -> int:
+        return self.address + self.length
+
+    def decode(self, registers: List[int], offset: int = 0):
+        raw_bytes = struct.pack(f"<{self.length}H", *registers[offset:offset + self.length])
+        values = list(struct.unpack("<" + self.type.struct_unpack_string * self.count, raw_bytes))
+
+        # Nested structures are decoded by the device class describing them
+        if hasattr(self.type.read_function, "decode_into"):
+            device_class = self.type.read_function
+            decoded = [
+                device_class.decode_into(device_class.new_record(), values, i * device_class._value_count)
+                for i in range(self.count)
+            ]
+        else:
+            decoded = values
+
+        if self.count > 1:
+            return decoded
+        return decoded[0]
+
+
+class ReadBlock(BaseModel):
+    """
+    A contiguous range of registers covering one or more read requests.
+    """
+    address: int
+    length: int
+    requests: List[ReadRequest] = []
+
+    @property
+    def end(self) -> int:
+        return self.address + self.length
+
+    def chunks(self, max_block_size: int = MODBUS_MAX_REGISTERS):
+        """
+        Splits the block in the (address, count) pairs to be sent as function 3 transactions
+        """
+        address = self.address
+        while address < self.end:
+            count = min(max_block_size, self.end - address)
+            yield address, count
+            address += count
+
+
+def plan_reads(
+    requests: Iterable[ReadRequest],
+    max_block_size: int = MODBUS_MAX_REGISTERS,
+    max_gap: int = 0
+) -> List[ReadBlock]:
+    """
+    Merges adjacent or overlapping requests into as few blocks as possible.
+
+    Requests closer than max_gap registers are merged as well, reading a few unused registers
+    costs less than a full bus turnaround. A block only grows beyond max_block_size when a
+    single request is bigger than that, in which case it's split in chunks when read.
+    """
+    blocks: List[ReadBlock] = []
+    for request in sorted(requests, key=lambda r: r.address):
+        if len(blocks) > 0:
+            block = blocks[-1]
+            end = max(block.end, request.end)
+            if request.address <= block.end + max_gap and (
+                end - block.address <= max_block_size or request.end <= block.end
+            ):
+                block.requests.append(request)
+                block.length = end - block.address
+                continue
+
+        blocks.append(ReadBlock(address=request.address, length=request.length, requests=[request]))
+    return blocks
+
+
+def read_block(dm, block: ReadBlock, max_block_size: int = MODBUS_MAX_REGISTERS) -> List[int]:
+    raw_data = []
+    with dm.lock:
+        for address, count in block.chunks(max_block_size):
+            raw_data += dm.device.read_registers(
+                registeraddress=address,
+                number_of_registers=count
+            )
+    return raw_data
+
+
+def read_block_into(dm, block: ReadBlock, buffer, offset=0, max_block_size: int = MODBUS_MAX_REGISTERS):
+    """
+    Reads a block storing the registers in place into a preallocated buffer starting from offset bytes
+    """
+    with dm.lock:
+        for address, count in block.chunks(max_block_size):
+            part_data = dm.device.read_registers(
+                registeraddress=address,
+                number_of_registers=count
+            )
+            struct.pack_into(f"<{count}H", buffer, offset + (address - block.address) * 2, *part_data)
+
+
+def execute_plan(
+    dm,
+    blocks: List[ReadBlock],
+    max_block_size: int = MODBUS_MAX_REGISTERS
+) -> Dict[Any, Any]:
+    """
+    Reads all the blocks and decodes the values of every request, exceptions from the
+    transport are not handled here and must be dealt with by the caller.
+    """
+    values = dict()
+    for block in blocks:
+        with kev("read_registers"):
+            raw_data = read_block(dm, block, max_block_size)
+        for request in block.requests:
+            values[request.key] = request.decode(raw_data, request.address - block.address)
+    return values
+
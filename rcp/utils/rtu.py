@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import struct
+import termios
+import time
+from typing import List, Optional
+
+log = logging.getLogger(__name__)
+
+READ_HOLDING_REGISTERS = 3
+WRITE_SINGLE_REGISTER = 6
+WRITE_MULTIPLE_REGISTERS = 16
+
+# Byte orders of 32 bit values, with the same values used by minimalmodbus
+BYTEORDER_BIG = 0
+BYTEORDER_LITTLE = 1
+BYTEORDER_BIG_SWAP = 2
+BYTEORDER_LITTLE_SWAP = 3
+
+BAUDRATES = {
+    9600: termios.B9600,
+    19200: termios.B19200,
+    38400: termios.B38400,
+    57600: termios.B57600,
+    115200: termios.B115200,
+    230400: termios.B230400,
+}
+
+
+class RtuError(Exception):
+    pass
+
+
+class RtuTimeout(RtuError):
+    pass
+
+
+class RtuCrcError(RtuError):
+    pass
+
+
+class RtuSlaveError(RtuError):
+    def __init__(self, function, code):
+        super().__init__(f"Slave reported exception {code} for function {function}")
+        self.function = function
+        self.code = code
+
+
+def crc16(data: bytes) -> int:
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def add_crc(frame: bytes) -> bytes:
+    return frame + struct.pack("<H", crc16(frame))
+
+
+def check_crc(frame: bytes) -> bool:
+    return len(frame) >= 4 and crc16(frame[:-2]) == struct.unpack("<H", frame[-2:])[0]
+
+
+def expected_length(frame: bytes) -> Optional[int]:
+    """
+    Returns the total length of a response frame from its first bytes, or None when more are needed
+    """
+    if len(frame) < 2:
+        return None
+    function = frame[1]
+    if function & 0x80:
+        return 5
+    if function == READ_HOLDING_REGISTERS:
+        if len(frame) < 3:
+            return None
+        return 5 + frame[2]
+    return 8
+
+
+def inter_frame_silence(baudrate: int) -> float:
+    """
+    Silent interval between frames, 3.5 characters of 11 bits or 1.75ms above 19200 baud
+    """
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * 11 / baudrate
+
+
+def registers_to_bytes(registers: List[int], byteorder: int) -> bytes:
+    raw = struct.pack(f">{len(registers)}H", *registers)
+    return reorder(raw, byteorder)
+
+
+def bytes_to_registers(raw: bytes, byteorder: int) -> List[int]:
+    raw = reorder(raw, byteorder)
+    return list(struct.unpack(f">{len(raw) // 2}H", raw))
+
+
+def reorder(raw: bytes, byteorder: int) -> bytes:
+    """
+    Converts between the big endian representation of a 32 bit value and the byte order on the wire,
+    all the supported orders are their own inverse.
+    """
+    if byteorder == BYTEORDER_BIG:
+        return raw
+    if byteorder == BYTEORDER_LITTLE:
+        return raw[::-1]
+    if byteorder == BYTEORDER_BIG_SWAP:
+        return bytes([raw[1], raw[0], raw[3], raw[2]])
+    if byteorder == BYTEORDER_LITTLE_SWAP:
+        return raw[2:4] + raw[0:2]
+    raise RtuError(f"Unsupported byte order: {byteorder}")
+
+
+class AsyncRtuTransport:
+    """
+    Modbus RTU master over a non blocking serial file descriptor, driven by an asyncio event loop.
+
+    Requests are queued and sent back to back by a single worker, waiting only for the response
+    of the previous frame and the inter frame silence required by the protocol.
+    """
+
+    def __init__(self, port: str, slave: int, baudrate=115200, timeout=0.1):
+        if baudrate not in BAUDRATES:
+            raise ValueError(f"Unsupported baudrate: {baudrate}, supported: {', '.join(map(str, BAUDRATES))}")
+        self.port = port
+        self.slave = slave
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.silence = inter_frame_silence(baudrate)
+        self.fd: Optional[int] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.buffer = bytearray()
+        self.data_received: Optional[asyncio.Event] = None
+        self.requests: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.last_frame_time = 0.0
+
+    def configure(self, fd: int):
+        attributes = termios.tcgetattr(fd)
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = attributes
+        iflag = 0
+        oflag = 0
+        lflag = 0
+        cflag = termios.CS8 | termios.CREAD | termios.CLOCAL
+        speed = BAUDRATES[self.baudrate]
+        cc[termios.VMIN] = 0
+        cc[termios.VTIME] = 0
+        termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        self.fd = os.open(self.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self.configure(self.fd)
+        self.data_received = asyncio.Event()
+        self.requests = asyncio.Queue()
+        self.loop.add_reader(self.fd, self.on_readable)
+        self.worker = self.loop.create_task(self.process_requests())
+
+    async def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+    def on_readable(self):
+        try:
+            data = os.read(self.fd, 512)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            log.error(e.__str__())
+            return
+        self.buffer += data
+        self.data_received.set()
+
+    def discard_input(self):
+        while True:
+            try:
+                if len(os.read(self.fd, 512)) == 0:
+                    break
+            except (BlockingIOError, OSError):
+                break
+        self.buffer.clear()
+
+    async def write_frame(self, frame: bytes):
+        view = memoryview(frame)
+        while len(view) > 0:
+            try:
+                written = os.write(self.fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                await asyncio.sleep(0)
+
+    async def read_frame(self) -> bytes:
+        deadline = self.loop.time() + self.timeout
+        while True:
+            length = expected_length(self.buffer)
+            if length is not None and len(self.buffer) >= length:
+                frame = bytes(self.buffer[:length])
+                del self.buffer[:length]
+                return frame
+
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                raise RtuTimeout(f"No response from slave {self.slave} within {self.timeout}s")
+            self.data_received.clear()
+            try:
+                await asyncio.wait_for(self.data_received.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def transact(self, pdu: bytes) -> bytes:
+        """
+        Sends a request and returns the PDU of the response, without address and CRC
+        """
+        wait = self.last_frame_time + self.silence - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        self.discard_input()
+        await self.write_frame(add_crc(bytes([self.slave]) + pdu))
+        try:
+            frame = await self.read_frame()
+        finally:
+            self.last_frame_time = time.monotonic()
+
+        if not check_crc(frame):
+            raise RtuCrcError(f"Invalid CRC in response: {frame.hex()}")
+        if frame[0] != self.slave:
+            raise RtuError(f"Response from unexpected slave {frame[0]}")
+        if frame[1] & 0x80:
+            raise RtuSlaveError(frame[1] & 0x7F, frame[2])
+        if frame[1] != pdu[0]:
+            raise RtuError(f"Response for unexpected function {frame[1]}")
+        return frame[1:-2]
+
+    async def process_requests(self):
+        while True:
+            pdu, future = await self.requests.get()
+            if future.cancelled():
+                continue
+            # Each transaction runs in its own task, so the traceback of a failure doesn't reference
+            # the frame of this worker, which would be closed by callers clearing the traceback frames
+            transaction = self.loop.create_task(self.transact(pdu))
+            try:
+                await asyncio.wait([transaction])
+            except asyncio.CancelledError:
+                transaction.cancel()
+                raise
+            if future.cancelled():
+                continue
+            if transaction.cancelled():
+                future.cancel()
+            elif transaction.exception() is not None:
+                future.set_exception(transaction.exception())
+            else:
+                future.set_result(transaction.result())
+
+    def submit(self, pdu: bytes) -> asyncio.Future:
+        """
+        Queues a request, the returned future is resolved with the PDU of the response
+        """
+        future = self.loop.create_future()
+        self.requests.put_nowait((pdu, future))
+        return future
+
+    async def read_registers(self, address: int, count: int) -> List[int]:
+        response = await self.submit(struct.pack(">BHH", READ_HOLDING_REGISTERS, address, count))
+        if response[1] != count * 2:
+            raise RtuError(f"Expected {count * 2} bytes, received {response[1]}")
+        return list(struct.unpack(f">{count}H", response[2:]))
+
+    async def write_register(self, address: int, value: int):
+        # The slave echoes the whole request
+        pdu = struct.pack(">BHH", WRITE_SINGLE_REGISTER, address, value & 0xFFFF)
+        response = await self.submit(pdu)
+        if response != pdu:
+            raise RtuError(f"Unexpected response to the write of register {address}: {response.hex()}")
+
+    async def write_registers(self, address: int, values: List[int]):
+        # The slave echoes the address and the number of registers written
+        count = len(values)
+        pdu = struct.pack(f">BHHB{count}H", WRITE_MULTIPLE_REGISTERS, address, count, count * 2, *values)
+        response = await self.submit(pdu)
+        if response != pdu[:5]:
+            raise RtuError(f"Unexpected response to the write of {count} registers at {address}: {response.hex()}")
+
+
+class RtuInstrument:
+    """
+    Synchronous shim exposing the subset of the minimalmodbus.Instrument interface used by the
+    communication module. Every call runs the asyncio transport to completion on a private event
+    loop and blocks the calling thread meanwhile, so the bus is still driven by the polling thread:
+    the transport replaces the framing and timing of minimalmodbus, not the thread.
+    """
+
+    def __init__(self, port: str, slaveaddress: int, baudrate=115200, timeout=0.1):
+        self.loop = asyncio.new_event_loop()
+        self.transport = AsyncRtuTransport(port, slaveaddress, baudrate, timeout)
+        self.loop.run_until_complete(self.transport.open())
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def close(self):
+        self.run(self.transport.close())
+        self.loop.close()
+
+    def read_registers(self, registeraddress: int, number_of_registers: int) -> List[int]:
+        return self.run(self.transport.read_registers(registeraddress, number_of_registers))
+
+    def write_registers(self, registeraddress: int, values: List[int]):
+        self.run(self.transport.write_registers(registeraddress, values))
+
+    def read_register(self, registeraddress: int, signed=False) -> int:
+        value = self.read_registers(registeraddress, 1)[0]
+        if signed and value >= 0x8000:
+            value -= 0x10000
+        return value
+
+    def write_register(self, registeraddress: int, value: int, signed=False):
+        self.write_registers(registeraddress, [int(value) & 0xFFFF])
+
+    def read_long(self, registeraddress: int, signed=False, byteorder=BYTEORDER_BIG) -> int:
+        raw = registers_to_bytes(self.read_registers(registeraddress, 2), byteorder)
+        return struct.unpack(">l" if signed else ">L", raw)[0]
+
+    def write_long(self, registeraddress: int, value: int, signed=False, byteorder=BYTEORDER_BIG):
+        raw = struct.pack(">l" if signed else ">L", int(value))
+        self.write_registers(registeraddress, bytes_to_registers(raw, byteorder))
+
+    def read_float(self, registeraddress: int, byteorder=BYTEORDER_BIG) -> float:
+        raw = registers_to_bytes(self.read_registers(registeraddress, 2), byteorder)
+        return struct.unpack(">f", raw)[0]
+
+    def write_float(self, registeraddress: int, value: float, byteorder=BYTEORDER_BIG):
+        raw = struct.pack(">f", float(value))
+        self.write_registers(registeraddress, bytes_to_registers(raw, byteorder))
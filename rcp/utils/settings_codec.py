@@ -0,0 +1,106 @@
+"""
+Encodings of the files written by the application, chosen by the extension of the file. New files
+use JSON, YAML is still read for the files of earlier versions and is only imported when one is
+found. msgpack is not a dependency, its files are read only when it is installed.
+"""
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Dict, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class CodecUnavailable(Exception):
+    """
+    Raised for files whose codec needs a package that is not installed
+    """
+
+
+class Codec(ABC):
+    extensions: Tuple[str, ...] = ()
+
+    @abstractmethod
+    def loads(self, data: bytes) -> Any:
+        pass
+
+    @abstractmethod
+    def dumps(self, value: Any) -> bytes:
+        pass
+
+
+class JsonCodec(Codec):
+    extensions = (".json",)
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, value: Any) -> bytes:
+        # The C encoder is only used without indentation
+        return json.dumps(value).encode()
+
+
+class MsgpackCodec(Codec):
+    extensions = (".msgpack",)
+
+    @staticmethod
+    def check():
+        if msgpack is None:
+            raise CodecUnavailable("msgpack is not installed")
+
+    def loads(self, data: bytes) -> Any:
+        self.check()
+        return msgpack.unpackb(data)
+
+    def dumps(self, value: Any) -> bytes:
+        self.check()
+        return msgpack.packb(value)
+
+
+class YamlCodec(Codec):
+    extensions = (".yaml", ".yml")
+
+    def loads(self, data: bytes) -> Any:
+        import yaml
+        return yaml.load(data, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+    def dumps(self, value: Any) -> bytes:
+        import yaml
+        return yaml.dump(value, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper)).encode()
+
+
+CODECS: Dict[str, Codec] = dict()
+
+
+def register_codec(codec: Codec):
+    for extension in codec.extensions:
+        CODECS[extension] = codec
+
+
+register_codec(JsonCodec())
+register_codec(YamlCodec())
+# Registered even without msgpack, so that its files are found and reported instead of ignored
+register_codec(MsgpackCodec())
+
+DEFAULT_EXTENSION = ".json"
+
+
+def codec_for(path: Path) -> Codec:
+    codec = CODECS.get(Path(path).suffix.lower(), None)
+    if codec is None:
+        raise Exception(f"No codec for the files of type: {Path(path).suffix}")
+    return codec
+
+
+def read_file(path: Path) -> Any:
+    with open(path, "rb") as f:
+        return codec_for(path).loads(f.read())
+
+
+def write_file(path: Path, value: Any):
+    data = codec_for(path).dumps(value)
+    with open(path, "wb") as f:
+        f.write(data)
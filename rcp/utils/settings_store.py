@@ -0,0 +1,203 @@
+import logging
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+from rcp.utils import settings_codec
+from rcp.utils.paths import settings_folder
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 1
+STORE_NAME = "settings"
+
+# Files written by each dispatcher before the store, named after the class and the id of the dispatcher
+LEGACY_FILE_PATTERN = re.compile(r"^[A-Za-z]\w*-[^.]+\.yaml$")
+
+# Functions upgrading the content of the store from the version of their key to the next one
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = dict()
+
+# Read once at import, setting it back and forth later would race with the files created by other threads
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def file_mode(path: Path) -> int:
+    """
+    Permissions of the file, or those a new file would get from the umask when it doesn't exist
+    """
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return 0o666 & ~UMASK
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Replaces the file in a single step, a power cut leaves either the old or the new content
+    """
+    mode = file_mode(path)
+    fd, temporary = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            # The temporary file is only readable by its owner
+            os.fchmod(f.fileno(), mode)
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+    # The rename itself is durable only once the folder is written
+    folder = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(folder)
+    finally:
+        os.close(folder)
+
+
+class SettingsStore:
+    """
+    Settings of all the dispatchers in a single file, one section per dispatcher. When the file
+    doesn't exist it is created from the files written by the dispatchers of earlier versions.
+    The owner interface of the SettingsWriter is implemented, store_settings writes the file.
+    """
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.path = folder / f"{STORE_NAME}{settings_codec.DEFAULT_EXTENSION}"
+        self.lock = threading.Lock()
+        self.sections: Optional[Dict[str, Dict[str, Any]]] = None
+        # Set when a file that can't be loaded can't be moved aside either, it's never overwritten
+        self.read_only = False
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            if self.sections is None:
+                self.sections = self.read()
+            return self.sections
+
+    def existing_file(self) -> Optional[Path]:
+        """
+        The file of the store, or the one written with another codec by an earlier version
+        """
+        if self.path.exists():
+            return self.path
+        for extension in settings_codec.CODECS:
+            file = self.folder / f"{STORE_NAME}{extension}"
+            if file.exists():
+                return file
+        return None
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        file = self.existing_file()
+        if file is None:
+            sections = self.read_legacy()
+            if len(sections) > 0:
+                log.info(f"Migrated {len(sections)} settings files into {self.path}")
+                self.write(sections)
+            return sections
+
+        try:
+            content = settings_codec.read_file(file) or dict()
+            if not isinstance(content, dict):
+                raise Exception("Unexpected content")
+        except settings_codec.CodecUnavailable as e:
+            # The file is fine, it's kept as it is and the settings are not saved until it can be read
+            log.error(f"Unable to read {file}, the settings won't be saved: {e.__str__()}")
+            self.read_only = True
+            return dict()
+        except Exception as e:
+            log.error(f"Unable to read {file}: {e.__str__()}")
+            return self.recover(file, "corrupt")
+
+        version = content.get("version", 0)
+        if version > SCHEMA_VERSION:
+            log.error(f"Settings version {version} is newer than the supported {SCHEMA_VERSION}")
+            return self.recover(file, "newer")
+        while version in MIGRATIONS:
+            content = MIGRATIONS[version](content)
+            version += 1
+
+        sections = content.get("sections", dict())
+        if file != self.path:
+            log.info(f"Converted {file} into {self.path}")
+            self.write(sections)
+        return sections
+
+    def recover(self, file: Path, reason: str) -> Dict[str, Dict[str, Any]]:
+        """
+        Moves aside a file that can't be loaded, so that the defaults written by the dispatchers don't
+        replace it, and starts again from the files of the earlier versions if there are any
+        """
+        aside = file.with_name(f"{file.name}.{reason}-{time.strftime('%Y%m%d-%H%M%S')}")
+        try:
+            os.replace(file, aside)
+            log.error(f"Moved {file} to {aside}")
+        except Exception as e:
+            log.error(f"Unable to move {file} aside, the settings won't be saved: {e.__str__()}")
+            self.read_only = True
+            return dict()
+
+        sections = self.read_legacy()
+        if len(sections) > 0:
+            log.info(f"Restored {len(sections)} settings files of an earlier version")
+            self.write(sections)
+        return sections
+
+    def read_legacy(self) -> Dict[str, Dict[str, Any]]:
+        sections = dict()
+        for file in sorted(self.folder.iterdir()):
+            if not LEGACY_FILE_PATTERN.match(file.name):
+                continue
+            try:
+                data = settings_codec.read_file(file)
+            except Exception as e:
+                log.error(f"Unable to migrate {file}: {e.__str__()}")
+                continue
+            if isinstance(data, dict):
+                sections[file.stem] = data
+        return sections
+
+    def write(self, sections: Dict[str, Dict[str, Any]]):
+        if self.read_only:
+            log.error(f"Not saving the settings, {self.path} could not be loaded")
+            return
+        content = {"version": SCHEMA_VERSION, "sections": sections}
+        write_atomic(self.path, settings_codec.codec_for(self.path).dumps(content))
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.load().get(name, None)
+
+    def set(self, name: str, data: Dict[str, Any]):
+        sections = self.load()
+        with self.lock:
+            sections[name] = data
+
+    def store_settings(self, triggered_by: Optional[str] = ""):
+        sections = self.load()
+        with self.lock:
+            log.info(f"Saving {triggered_by}: {self.path}")
+            self.write(dict(sections))
+
+
+stores: Dict[Path, SettingsStore] = dict()
+
+
+def settings_store() -> SettingsStore:
+    """
+    Store of the settings folder of the current user
+    """
+    folder = settings_folder()
+    store = stores.get(folder, None)
+    if store is None:
+        store = SettingsStore(folder)
+        stores[folder] = store
+    return store
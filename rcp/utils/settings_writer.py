@@ -0,0 +1,79 @@
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Seconds the changes are collected before they are written
+SAVE_DELAY = 1.0
+
+
+class SettingsWriter:
+    """
+    Writes settings in the background, owners are marked dirty when one of their settings changes and
+    all the changes made within the delay are written at once. The owners must provide
+    store_settings(triggered_by), which is called on the writing thread.
+    """
+
+    def __init__(self, delay=SAVE_DELAY):
+        self.delay = delay
+        self.pending: Dict[int, Tuple[Any, str]] = dict()
+        self.changed = threading.Condition()
+        # Held while writing, so that a flush never overlaps the writes of the background thread
+        self.write_lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.writes = 0
+
+    def mark_dirty(self, owner, triggered_by: str = ""):
+        with self.changed:
+            if id(owner) not in self.pending:
+                self.pending[id(owner)] = (owner, triggered_by)
+            # Once stopped, changes are only written by flush
+            if self.thread is None and not self.stopping.is_set():
+                self.thread = threading.Thread(target=self.run, name="settings-writer", daemon=True)
+                self.thread.start()
+            self.changed.notify()
+
+    def flush(self):
+        """
+        Writes all the pending changes from the calling thread
+        """
+        with self.write_lock:
+            # Owners can mark other owners while storing, those are written in the same flush
+            while True:
+                with self.changed:
+                    pending = list(self.pending.values())
+                    self.pending.clear()
+                if len(pending) == 0:
+                    break
+                for owner, triggered_by in pending:
+                    try:
+                        owner.store_settings(triggered_by)
+                        self.writes += 1
+                    except Exception as e:
+                        log.error(f"Unable to save the settings: {e.__str__()}")
+
+    def run(self):
+        while not self.stopping.is_set():
+            with self.changed:
+                while len(self.pending) == 0 and not self.stopping.is_set():
+                    self.changed.wait()
+            # Changes made during the delay are written together
+            self.stopping.wait(self.delay)
+            self.flush()
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Writes the pending changes and stops the background thread
+        """
+        with self.changed:
+            self.stopping.set()
+            self.changed.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+        self.flush()
+
+
+settings_writer = SettingsWriter()
@@ -0,0 +1,371 @@
+"""
+Simulator of the control board firmware, serving the rampsSharedData_t register map as a Modbus RTU
+slave over a pseudo terminal, so that the application can run without the hardware:
+
+    python -m rcp.utils.simulator --speed 200 --speed 0 --latency 0.002
+
+prints the path of the terminal to configure as serial port of the application.
+"""
+import argparse
+import logging
+import math
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+from typing import Callable, Dict, List, Optional, Sequence
+
+from rcp.utils import devices, rtu
+from rcp.utils.communication import MODBUS_MAX_REGISTERS, MODBUS_MAX_WRITE_REGISTERS
+from rcp.utils.read_planner import ReadRequest
+from rcp.utils.snapshot import DeviceSnapshot
+
+log = logging.getLogger(__name__)
+
+STEP_INTERVAL = 0.005
+# Scale speeds are the average over this window, in seconds, as the counts change by one at a time
+SPEED_WINDOW = 0.01
+DEFAULT_MAX_SPEED = 2000.0
+DEFAULT_ACCELERATION = 10000.0
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+# Position of an encoder in counts as a function of the time in seconds since the simulator started
+Motion = Callable[[float], float]
+
+
+def still() -> Motion:
+    return lambda t: 0.0
+
+
+def constant_speed(speed: float) -> Motion:
+    return lambda t: speed * t
+
+
+def oscillate(amplitude: float, period: float) -> Motion:
+    return lambda t: amplitude * math.sin(2 * math.pi * t / period)
+
+
+def scripted(points: Sequence[Sequence[float]]) -> Motion:
+    """
+    Moves linearly between (time, position) points, holding the last position at the end of the script
+    """
+    points = sorted(points)
+
+    def motion(t):
+        if t <= points[0][0]:
+            return points[0][1]
+        for (t0, p0), (t1, p1) in zip(points, points[1:]):
+            if t <= t1:
+                return p0 + (p1 - p0) * (t - t0) / (t1 - t0)
+        return points[-1][1]
+
+    return motion
+
+
+def request_length(frame: bytes) -> Optional[int]:
+    """
+    Returns the total length of a request frame from its first bytes, or None when more are needed
+    """
+    if len(frame) < 2:
+        return None
+    if frame[1] == rtu.WRITE_MULTIPLE_REGISTERS:
+        if len(frame) < 7:
+            return None
+        return 9 + frame[6]
+    return 8
+
+
+class RegisterMap:
+    """
+    Register image of the Global device, accessed by variable path as the firmware would
+    """
+
+    def __init__(self):
+        self.buffer = bytearray(devices.Global._struct.size)
+        self.snapshot = DeviceSnapshot(devices.Global, self.buffer)
+        self.layout = devices.Global(connection_manager=None, base_address=0)
+        self.requests: Dict[str, ReadRequest] = dict()
+
+    @property
+    def size(self) -> int:
+        return len(self.buffer) // 2
+
+    def locate(self, path: str) -> ReadRequest:
+        request = self.requests.get(path, None)
+        if request is None:
+            request = self.layout.locate(path)
+            self.requests[path] = request
+        return request
+
+    def get(self, path: str):
+        request = self.locate(path)
+        return struct.unpack_from("<" + request.type.struct_unpack_string, self.buffer, request.address * 2)[0]
+
+    def set(self, path: str, value):
+        request = self.locate(path)
+        fmt = request.type.struct_unpack_string
+        if fmt == "f":
+            struct.pack_into("<f", self.buffer, request.address * 2, float(value))
+        else:
+            # Integers wrap around like the firmware counters do
+            fmt = fmt.upper()
+            mask = (1 << (struct.calcsize("<" + fmt) * 8)) - 1
+            struct.pack_into("<" + fmt, self.buffer, request.address * 2, int(value) & mask)
+
+    def read_registers(self, address: int, count: int) -> List[int]:
+        return list(struct.unpack_from(f"<{count}H", self.buffer, address * 2))
+
+    def write_registers(self, address: int, values: Sequence[int]):
+        struct.pack_into(f"<{len(values)}H", self.buffer, address * 2, *values)
+
+
+class Simulator(threading.Thread):
+    """
+    Modbus RTU slave answering on a pseudo terminal with the register map of the firmware.
+
+    Encoders follow the given motions, while the servo moves toward its desired position with the
+    configured speed and acceleration, following the scales that have sync enabled and the
+    relative moves written to servo.direction. Responses can be delayed by latency seconds and
+    dropped with probability loss_rate to exercise the error handling of the application.
+    """
+
+    def __init__(
+        self,
+        motions: Optional[Sequence[Motion]] = None,
+        slave=17,
+        latency=0.0,
+        loss_rate=0.0,
+        max_registers=MODBUS_MAX_REGISTERS,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(name="simulator", daemon=True)
+        self.slave = slave
+        self.latency = latency
+        self.loss_rate = loss_rate
+        self.max_registers = max_registers
+        self.random = random.Random(seed)
+        self.registers = RegisterMap()
+        self.lock = threading.RLock()
+        self.running = threading.Event()
+
+        self.motions: List[Motion] = [still() for _ in range(devices.SCALES_COUNT)]
+        for i, motion in enumerate(motions or []):
+            self.motions[i] = motion
+
+        self.master, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+        self.port = os.ttyname(self.slave_fd)
+
+        self.started = time.monotonic()
+        self.last_step = self.started
+        self.encoder_counts = [0] * devices.SCALES_COUNT
+        self.servo_current = 0.0
+        self.servo_desired = 0.0
+        self.servo_speed = 0.0
+
+        self.requests = 0
+        self.dropped = 0
+        self.crc_errors = 0
+
+    def set_motion(self, index: int, motion: Motion):
+        with self.lock:
+            self.motions[index] = motion
+
+    def step(self, now: Optional[float] = None):
+        """
+        Advances the simulation to now, updating the registers published by the firmware
+        """
+        with self.lock:
+            if now is None:
+                now = time.monotonic()
+            dt = now - self.last_step
+            if dt <= 0:
+                return
+            self.last_step = now
+            registers = self.registers
+            servo_enabled = registers.get("fastData.servoEnable") != 0
+
+            t = now - self.started
+            for i, motion in enumerate(self.motions):
+                count = round(motion(t))
+                delta = count - self.encoder_counts[i]
+                self.encoder_counts[i] = count
+                speed = round((motion(t) - motion(t - SPEED_WINDOW)) / SPEED_WINDOW)
+                registers.set(f"scales[{i}].position", count)
+                registers.set(f"scales[{i}].speed", speed)
+                registers.set(f"fastData.scaleCurrent[{i}]", count)
+                registers.set(f"fastData.scaleSpeed[{i}]", speed)
+
+                denominator = registers.get(f"scales[{i}].syncRatioDen")
+                if servo_enabled and registers.get(f"scales[{i}].syncEnable") != 0 and denominator != 0:
+                    self.servo_desired += delta * registers.get(f"scales[{i}].syncRatioNum") / denominator
+
+            # Each write of direction requests a relative move, consumed by the firmware
+            move = registers.get("servo.direction")
+            if move != 0:
+                self.servo_desired += move
+                registers.set("servo.direction", 0)
+
+            if servo_enabled:
+                self.move_servo(dt)
+            else:
+                self.servo_speed = 0.0
+
+            current = int(round(self.servo_current))
+            desired = int(round(self.servo_desired))
+            registers.set("servo.currentSpeed", self.servo_speed)
+            registers.set("servo.currentSteps", current)
+            registers.set("servo.desiredSteps", desired)
+            registers.set("fastData.servoCurrent", current)
+            registers.set("fastData.servoDesired", desired)
+            registers.set("fastData.stepsToGo", abs(desired - current))
+            registers.set("fastData.servoSpeed", self.servo_speed)
+            registers.set("fastData.cycles", registers.get("fastData.cycles") + 1)
+            registers.set("fastData.executionInterval", int(dt * 1e6))
+            registers.set("executionCycles", registers.get("executionCycles") + 1)
+
+    def move_servo(self, dt: float):
+        max_speed = abs(self.registers.get("servo.maxSpeed")) or DEFAULT_MAX_SPEED
+        acceleration = abs(self.registers.get("servo.acceleration")) or DEFAULT_ACCELERATION
+        error = self.servo_desired - self.servo_current
+        if abs(error) < 0.5 and abs(self.servo_speed) <= acceleration * dt:
+            self.servo_current = self.servo_desired
+            self.servo_speed = 0.0
+            return
+
+        # Trapezoidal profile, slowing down in time to stop on the desired position
+        target_speed = math.copysign(min(max_speed, math.sqrt(2 * acceleration * abs(error))), error)
+        change = max(-acceleration * dt, min(acceleration * dt, target_speed - self.servo_speed))
+        self.servo_speed += change
+        travel = self.servo_speed * dt
+        if abs(travel) >= abs(error):
+            self.servo_current = self.servo_desired
+            self.servo_speed = 0.0
+        else:
+            self.servo_current += travel
+
+    def handle(self, frame: bytes) -> bytes:
+        """
+        Returns the response to a request frame with a valid CRC
+        """
+        function = frame[1]
+        with self.lock:
+            try:
+                if function == rtu.READ_HOLDING_REGISTERS:
+                    address, count = struct.unpack(">HH", frame[2:6])
+                    self.check_range(address, count, self.max_registers)
+                    values = self.registers.read_registers(address, count)
+                    pdu = struct.pack(f">BB{count}H", function, count * 2, *values)
+                elif function == rtu.WRITE_SINGLE_REGISTER:
+                    address, value = struct.unpack(">HH", frame[2:6])
+                    self.check_range(address, 1, 1)
+                    self.registers.write_registers(address, [value])
+                    pdu = frame[1:6]
+                elif function == rtu.WRITE_MULTIPLE_REGISTERS:
+                    address, count = struct.unpack(">HH", frame[2:6])
+                    self.check_range(address, count, MODBUS_MAX_WRITE_REGISTERS)
+                    self.registers.write_registers(address, struct.unpack(f">{count}H", frame[7:7 + count * 2]))
+                    pdu = frame[1:6]
+                else:
+                    raise SlaveException(ILLEGAL_FUNCTION)
+            except SlaveException as e:
+                pdu = bytes([function | 0x80, e.code])
+        return rtu.add_crc(bytes([self.slave]) + pdu)
+
+    def check_range(self, address: int, count: int, limit: int):
+        if count < 1 or count > limit:
+            raise SlaveException(ILLEGAL_DATA_VALUE)
+        if address + count > self.registers.size:
+            raise SlaveException(ILLEGAL_DATA_ADDRESS)
+
+    def process(self, buffer: bytearray):
+        while True:
+            length = request_length(buffer)
+            if length is None or len(buffer) < length:
+                return
+            frame = bytes(buffer[:length])
+            if not rtu.check_crc(frame):
+                # Without a valid frame there's no way to find the next one, drop everything
+                self.crc_errors += 1
+                buffer.clear()
+                return
+            del buffer[:length]
+            if frame[0] != self.slave:
+                continue
+
+            self.requests += 1
+            self.step()
+            response = self.handle(frame)
+            if self.loss_rate > 0 and self.random.random() < self.loss_rate:
+                self.dropped += 1
+                continue
+            if self.latency > 0:
+                time.sleep(self.latency)
+            os.write(self.master, response)
+
+    def run(self):
+        self.running.set()
+        buffer = bytearray()
+        while self.running.is_set():
+            ready, _, _ = select.select([self.master], [], [], STEP_INTERVAL)
+            if ready:
+                try:
+                    buffer += os.read(self.master, 512)
+                except OSError as e:
+                    log.error(e.__str__())
+                    break
+                self.process(buffer)
+            else:
+                # Partial frames are discarded after a silence, as the next request starts over
+                buffer.clear()
+            self.step()
+
+    def stop(self, timeout: Optional[float] = None):
+        self.running.clear()
+        if self.is_alive():
+            self.join(timeout)
+
+    def close(self):
+        self.stop(timeout=1.0)
+        for fd in (self.master, self.slave_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class SlaveException(Exception):
+    def __init__(self, code: int):
+        super().__init__(f"Modbus exception {code}")
+        self.code = code
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulates the control board on a pseudo terminal")
+    parser.add_argument("--slave", type=int, default=17)
+    parser.add_argument("--speed", type=float, action="append", default=[], help="Scale speed in counts/s, repeatable")
+    parser.add_argument("--latency", type=float, default=0.0, help="Response delay in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability of dropping a response")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = Simulator(
+        motions=[constant_speed(speed) for speed in args.speed],
+        slave=args.slave,
+        latency=args.latency,
+        loss_rate=args.loss,
+    )
+    simulator.start()
+    print(simulator.port, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.close()
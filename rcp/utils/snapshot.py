@@ -0,0 +1,119 @@
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+
+class FieldArray:
+    """
+    Array field of a snapshot, elements are decoded from the buffer each time they are accessed
+    """
+
+    def __init__(self, view: memoryview, offset: int, element: Optional[struct.Struct], count: int, nested=None):
+        self.view = view
+        self.offset = offset
+        self.element = element
+        self.count = count
+        self.nested = nested
+        self.items = None
+        if nested is not None:
+            stride = nested._struct.size
+            self.items = [DeviceSnapshot(nested, view, offset + i * stride) for i in range(count)]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError(f"Index {index} out of range")
+        if self.items is not None:
+            return self.items[index]
+        return self.element.unpack_from(self.view, self.offset + index * self.element.size)[0]
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def to_list(self) -> list:
+        """
+        Decodes all the elements at once
+        """
+        if self.items is not None:
+            return list(self.items)
+        end = self.offset + self.count * self.element.size
+        return [item[0] for item in self.element.iter_unpack(self.view[self.offset:end])]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class DeviceSnapshot:
+    """
+    View over the raw registers of a device, backed by a buffer filled in place by the transport.
+
+    Fields are exposed as attributes (snapshot.scaleCurrent[2], snapshot.servoSpeed) and decoded
+    only when they are accessed, mapping style access is supported as well for existing code.
+    """
+
+    def __init__(self, device_class, buffer=None, offset: int = 0):
+        self.device_class = device_class
+        self.fields: Dict[str, Tuple[int, Optional[struct.Struct], int, Any]] = device_class._field_offsets
+        if buffer is None:
+            buffer = bytearray(device_class._struct.size)
+        self.view = memoryview(buffer)
+        self.offset = offset
+        self.timestamp = 0.0
+        # Number of the bus read that filled the snapshot, see WriteTracker
+        self.read_sequence = 0
+        self.nested: Dict[str, Any] = dict()
+
+    @property
+    def size(self) -> int:
+        return self.device_class._struct.size
+
+    def __getattr__(self, name):
+        try:
+            offset, element, count, nested = self.__dict__["fields"][name]
+        except KeyError:
+            raise AttributeError(f"Snapshot has no field named: {name}")
+
+        if count == 1 and nested is None:
+            return element.unpack_from(self.view, self.offset + offset)[0]
+
+        # Arrays and nested structures are views over the same buffer and can be reused
+        value = self.nested.get(name, None)
+        if value is None:
+            if count > 1:
+                value = FieldArray(self.view, self.offset + offset, element, count, nested)
+            else:
+                value = DeviceSnapshot(nested, self.view, self.offset + offset)
+            self.nested[name] = value
+        return value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError as e:
+            raise KeyError(e.__str__())
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        if key not in self.fields:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return self.fields.keys()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self.device_class.decode_into(
+            self.device_class.new_record(),
+            self.device_class._struct.unpack_from(self.view, self.offset)
+        )
@@ -0,0 +1,167 @@
+"""
+Measures the startup of the application, reporting the time spent importing every module and in
+each phase up to the first frame:
+
+    RCP_STARTUP_REPORT=1 python ./rcp/main.py
+    RCP_STARTUP_REPORT=startup.txt python ./rcp/main.py
+
+The report is logged, or written to the file given in the variable.
+"""
+import importlib.abc
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+ENVIRONMENT_VARIABLE = "RCP_STARTUP_REPORT"
+
+
+class TimedLoader(importlib.abc.Loader):
+    """
+    Loader timing the execution of a module, everything else is done by the original loader
+    """
+
+    def __init__(self, loader, timer: "ImportTimer"):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # The module keeps the original loader, for the resources and the tracebacks
+        module.__loader__ = self.loader
+        if module.__spec__ is not None:
+            module.__spec__.loader = self.loader
+        self.timer.enter()
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.timer.exit(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """
+    Finds modules with the other finders and times their execution. The total time of a module
+    includes the modules it imports, its own time does not.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        # Start time and time spent in nested imports of the modules being executed
+        self.stack: List[List[float]] = []
+        self.modules: Dict[str, Tuple[float, float]] = dict()
+        self.finding = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        # Some finders look up other modules themselves, those lookups are left to the other finders
+        if getattr(self.finding, "active", False):
+            return None
+        self.finding.active = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is None:
+                    continue
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+            return None
+        finally:
+            self.finding.active = False
+
+    def enter(self):
+        self.stack.append([self.clock(), 0.0])
+
+    def exit(self, name: str):
+        started, nested = self.stack.pop()
+        total = self.clock() - started
+        self.modules[name] = (total, total - nested)
+        if len(self.stack) > 0:
+            self.stack[-1][1] += total
+
+
+class StartupReport:
+    """
+    Durations of the phases of the startup and of the imports made until the first frame
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self.phases: List[Tuple[str, float]] = []
+        self.timer = ImportTimer(clock)
+
+    def install(self):
+        sys.meta_path.insert(0, self.timer)
+
+    def uninstall(self):
+        if self.timer in sys.meta_path:
+            sys.meta_path.remove(self.timer)
+
+    def mark(self, phase: str):
+        """
+        Records the end of a phase of the startup
+        """
+        self.phases.append((phase, self.clock()))
+
+    def text(self, limit=30) -> str:
+        lines = ["Startup phases:"]
+        previous = self.started
+        for phase, timestamp in self.phases:
+            lines.append(f"  {phase:<40} {(timestamp - previous) * 1000:9.1f} ms {(timestamp - self.started) * 1000:9.1f} ms")
+            previous = timestamp
+
+        modules = sorted(self.timer.modules.items(), key=lambda item: item[1][1], reverse=True)
+        imports = sum(own for total, own in self.timer.modules.values())
+        lines.append(f"Imported {len(modules)} modules in {imports * 1000:.1f} ms, slowest by own time:")
+        lines.append(f"  {'module':<60} {'own':>9}    {'total':>9}")
+        for name, (total, own) in modules[:limit]:
+            lines.append(f"  {name:<60} {own * 1000:9.1f} ms {total * 1000:9.1f} ms")
+
+        packages: Dict[str, float] = dict()
+        for name, (total, own) in modules:
+            package = ".".join(name.split(".")[:3]) if name.startswith("rcp.") else name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + own
+        lines.append("Own time by package:")
+        for package, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            lines.append(f"  {package:<60} {own * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+    def finish(self, *args):
+        """
+        Marks the first frame, stops timing the imports and emits the report
+        """
+        self.mark("first frame")
+        self.uninstall()
+        text = self.text()
+        destination = os.environ.get(ENVIRONMENT_VARIABLE, "1")
+        if destination == "1":
+            for line in text.split("\n"):
+                log.info(line)
+            return
+        try:
+            with open(destination, "w") as f:
+                f.write(text + "\n")
+        except Exception as e:
+            log.error(f"Unable to write the startup report: {e.__str__()}")
+
+
+def start() -> Optional[StartupReport]:
+    """
+    Starts timing the imports when the report is requested in the environment
+    """
+    if os.environ.get(ENVIRONMENT_VARIABLE, "") == "":
+        return None
+    report = StartupReport()
+    report.install()
+    return report
@@ -0,0 +1,1028 @@
+import asyncio
+import os
+import pty
+import select
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from fractions import Fraction
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import minimalmodbus
+
+from rcp.utils import devices
+from rcp.utils.communication import ConnectionManager, CommandQueue, Priority, WriteTracker
+from rcp.utils.base_device import BaseDevice, variable_definitions
+from rcp.utils.layout import parse_definition, dependency_order
+from rcp.utils.bus_stats import (
+    BusStatistics, MeasuredInstrument, classify_error, ERROR_CRC, ERROR_OTHER, ERROR_TIMEOUT
+)
+from rcp.utils.link import LinkMonitor, LinkState
+from rcp.utils.poller import Poller, PollRateScheduler
+from rcp import benchmark, headless
+from rcp.utils import axis, counters, display, rtu, settings_codec, settings_store, settings_writer, startup
+from rcp.utils.simulator import Simulator, constant_speed
+from rcp.utils.snapshot import DeviceSnapshot
+from rcp.utils.read_planner import ReadRequest, plan_reads
+
+
+class FakeInstrument:
+    def __init__(self, size=256, max_registers=125):
+        self.registers = [0] * size
+        self.max_registers = max_registers
+        self.transactions = []
+
+    def read_registers(self, registeraddress, number_of_registers):
+        self.transactions.append((registeraddress, number_of_registers))
+        if number_of_registers > self.max_registers:
+            raise IOError("Illegal data value")
+        return self.registers[registeraddress:registeraddress + number_of_registers]
+
+    def write_register(self, registeraddress, value, signed=False):
+        self.write_registers(registeraddress, [value & 0xFFFF])
+
+    def write_registers(self, registeraddress, values):
+        self.transactions.append(("write", registeraddress, len(values)))
+        self.registers[registeraddress:registeraddress + len(values)] = values
+
+    def set_value(self, address, fmt, value):
+        raw = struct.pack("<" + fmt, value)
+        words = struct.unpack(f"<{len(raw) // 2}H", raw)
+        self.registers[address:address + len(words)] = words
+
+
+def make_device():
+    dm = MagicMock()
+    dm.device = FakeInstrument()
+    dm.max_block_size = 125
+    dm.queue_writes = False
+    dm.commands = CommandQueue()
+    dm.writes = WriteTracker()
+    return dm, devices.Global(connection_manager=dm, base_address=0)
+
+
+class TestReadPlanner(unittest.TestCase):
+    def test_merge_adjacent_and_overlapping(self):
+        requests = [
+            ReadRequest(key="a", address=10, length=2),
+            ReadRequest(key="b", address=12, length=2),
+            ReadRequest(key="c", address=13, length=1),
+            ReadRequest(key="d", address=40, length=2),
+        ]
+        blocks = plan_reads(requests)
+        self.assertEqual([(b.address, b.length) for b in blocks], [(10, 4), (40, 2)])
+        blocks = plan_reads(requests, max_gap=30)
+        self.assertEqual([(b.address, b.length) for b in blocks], [(10, 32)])
+
+    def test_block_size_limit(self):
+        requests = [ReadRequest(key=i, address=i * 2, length=2) for i in range(100)]
+        blocks = plan_reads(requests)
+        self.assertTrue(all(b.length <= 125 for b in blocks))
+        self.assertEqual(sum(len(list(block.chunks(125))) for block in blocks), 2)
+        big = plan_reads([ReadRequest(key="big", address=0, length=300)])
+        self.assertEqual(list(big[0].chunks(125)), [(0, 125), (125, 125), (250, 50)])
+
+    def test_read_variables(self):
+        dm, device = make_device()
+        for i in range(devices.SCALES_COUNT):
+            address = device.locate(f"scales[{i}].syncEnable").address
+            dm.device.set_value(address, "h", i % 2)
+        dm.device.set_value(device.locate("servo.maxSpeed").address, "f", 1234.5)
+        dm.device.set_value(device.locate("fastData.scaleCurrent[2]").address, "l", -42)
+
+        paths = [f"scales[{i}].syncEnable" for i in range(devices.SCALES_COUNT)]
+        paths += ["servo.maxSpeed", "fastData.scaleCurrent", "servo"]
+        values = device.read_variables(paths, max_gap=16)
+
+        self.assertEqual(len(dm.device.transactions), 1)
+        self.assertEqual([values[p] for p in paths[:4]], [0, 1, 0, 1])
+        self.assertEqual(values["servo.maxSpeed"], 1234.5)
+        self.assertEqual(values["fastData.scaleCurrent"], [0, 0, -42, 0])
+        self.assertEqual(values["servo"]["maxSpeed"], 1234.5)
+
+    def test_cached_children(self):
+        _, device = make_device()
+        self.assertIs(device["servo"], device["servo"])
+        self.assertIs(device["scales"][2], device["scales"][2])
+        self.assertEqual(device["scales"][2].base_address, device.locate("scales[2]").address)
+        self.assertIs(device["servo"].index, devices.Servo.layout.index)
+
+    def test_locate_errors(self):
+        _, device = make_device()
+        with self.assertRaises(Exception):
+            device.locate("scales[4].syncEnable")
+        with self.assertRaises(Exception):
+            device.locate("servo.unknown")
+        with self.assertRaises(Exception):
+            device.locate("executionInterval.value")
+
+
+class TestLayout(unittest.TestCase):
+    def test_parse_definition(self):
+        parsed = parse_definition(devices.Scale.definition)
+        self.assertEqual(parsed.name, "input_t")
+        self.assertEqual(
+            [(m.type_name, m.name, m.count) for m in parsed.members][:4],
+            [("TIM_HandleTypeDef", "timerHandle", 1), ("int32_t", "position", 1),
+             ("int32_t", "speed", 1), ("int32_t", "syncRatioNum", 1)]
+        )
+        self.assertEqual(devices.Global.layout.index["fastData"].address, 72)
+        self.assertEqual(devices.Global.layout.size, 101)
+
+    def test_shared_layout_read_only(self):
+        layout = devices.Scale.layout
+        self.assertIs(layout.index["speed"], layout.variables[2])
+        with self.assertRaises(TypeError):
+            layout.index["speed"] = layout.variables[1]
+        with self.assertRaises(Exception):
+            layout.variables[2].address = 0
+        self.assertIs(devices.Scale(MagicMock(), 0).index, layout.index)
+
+    def test_dependency_order(self):
+        classes = [devices.Global, devices.FastData, devices.Scale, devices.Servo]
+        parsed = {item: parse_definition(item.definition) for item in classes}
+        order = dependency_order(parsed, variable_definitions)
+        self.assertEqual(order[-1], devices.Global)
+
+        cyclic = {
+            "a": parse_definition("typedef struct {\n  b_t b;\n} a_t;"),
+            "b": parse_definition("typedef struct {\n  a_t a;\n} b_t;"),
+        }
+        with self.assertRaises(Exception):
+            dependency_order(cyclic, variable_definitions)
+
+    def test_parse_cache(self):
+        with tempfile.TemporaryDirectory() as folder:
+            parsed = parse_definition(devices.FastData.definition, folder)
+            self.assertEqual(len(os.listdir(folder)), 1)
+            self.assertEqual(parse_definition(devices.FastData.definition, folder), parsed)
+
+
+class TestCompiledDecoder(unittest.TestCase):
+    def test_refresh_decodes_in_place(self):
+        dm, device = make_device()
+        fast_data = device["fastData"]
+        dm.device.set_value(fast_data.locate("servoSpeed").address, "f", 2.5)
+        dm.device.set_value(fast_data.locate("scaleCurrent[3]").address, "l", -7)
+        dm.device.set_value(fast_data.locate("servoEnable").address, "h", 1)
+
+        record = fast_data.refresh()
+        self.assertIs(record, fast_data.refresh())
+        self.assertEqual(record["servoSpeed"], 2.5)
+        self.assertEqual(record["scaleCurrent"], [0, 0, 0, -7])
+        self.assertEqual(record["servoEnable"], 1)
+
+    def test_nested_record_matches_layout(self):
+        dm, device = make_device()
+        dm.device.set_value(device.locate("scales[1].syncRatioDen").address, "l", 254)
+        dm.device.set_value(device.locate("fastData.cycles").address, "L", 99)
+        record = device.refresh()
+        self.assertEqual(record["scales"][1]["syncRatioDen"], 254)
+        self.assertEqual(record["fastData"]["cycles"], 99)
+        self.assertEqual(devices.Global._value_count, len(device.struct_unpack_string))
+
+    def test_uncompiled_class_rejected(self):
+        class Unregistered(BaseDevice):
+            definition = devices.Scale.definition
+
+        with self.assertRaises(Exception):
+            Unregistered(MagicMock(), 0)
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_lazy_field_access(self):
+        dm, device = make_device()
+        fast_data = device["fastData"]
+        snapshot = fast_data.snapshot
+        dm.device.set_value(fast_data.locate("scaleCurrent[2]").address, "l", -1234)
+        dm.device.set_value(fast_data.locate("servoSpeed").address, "f", 0.5)
+
+        self.assertIs(fast_data.update_snapshot(), snapshot)
+        self.assertEqual(snapshot.scaleCurrent[2], -1234)
+        self.assertEqual(snapshot["servoSpeed"], 0.5)
+        self.assertIs(snapshot.scaleCurrent, snapshot.scaleCurrent)
+
+        dm.device.set_value(fast_data.locate("scaleCurrent[2]").address, "l", 10)
+        fast_data.update_snapshot()
+        self.assertEqual(snapshot.scaleCurrent[2], 10)
+        self.assertEqual(snapshot.as_dict()["scaleCurrent"], [0, 0, 10, 0])
+
+    def test_nested_snapshot(self):
+        dm, device = make_device()
+        dm.device.set_value(device.locate("scales[3].syncRatioNum").address, "l", 360)
+        device.update_snapshot()
+        self.assertEqual(device.snapshot.scales[3].syncRatioNum, 360)
+        self.assertEqual(device.snapshot.fastData.scaleCurrent, [0, 0, 0, 0])
+        with self.assertRaises(AttributeError):
+            _ = device.snapshot.unknown
+
+
+class TestPoller(unittest.TestCase):
+    def test_publish_and_read(self):
+        dm, device = make_device()
+        fast_data = device["fastData"]
+        address = fast_data.locate("scaleCurrent[0]").address
+        connected = MagicMock()
+        poller = Poller(fast_data, on_connect=connected)
+        target = DeviceSnapshot(devices.FastData)
+
+        dm.device.set_value(address, "l", 5)
+        self.assertTrue(poller.poll_once())
+        sequence = poller.read_into(target)
+        self.assertEqual(target.scaleCurrent[0], 5)
+        self.assertEqual(poller.read_into(target, sequence), sequence)
+
+        dm.device.set_value(address, "l", 6)
+        poller.poll_once()
+        self.assertNotEqual(poller.read_into(target, sequence), sequence)
+        self.assertEqual(target.scaleCurrent[0], 6)
+        connected.assert_called_once()
+
+    def test_connection_lost(self):
+        dm, device = make_device()
+        poller = Poller(device["fastData"])
+        dm.device.max_registers = 0
+        self.assertFalse(poller.poll_once())
+        self.assertFalse(poller.connected)
+        self.assertEqual(poller.slot.sequence, 0)
+
+    def test_motion_dropped_when_link_lost(self):
+        dm, device = make_device()
+        dm.queue_writes = True
+        poller = Poller(device["fastData"])
+        self.assertTrue(poller.poll_once())
+        device["servo"]["direction"] = 100
+        device["scales"][0]["syncEnable"] = 1
+
+        dm.device.max_registers = 0
+        while poller.link.state != LinkState.LOST:
+            poller.poll_once()
+        dm.device.max_registers = 125
+        self.assertTrue(poller.poll_once())
+        poller.run_commands()
+
+        writes = [item[1] for item in dm.device.transactions if item[0] == "write"]
+        self.assertEqual(writes, [device["scales"][0].locate("syncEnable").address])
+        self.assertTrue(device["servo"].is_current("direction", poller.slot.front))
+
+    def test_adaptive_rate(self):
+        dm, device = make_device()
+        fast_data = device["fastData"]
+        scheduler = PollRateScheduler(active_interval=0.01, idle_interval=0.1, hold_time=1.0)
+        poller = Poller(fast_data, scheduler=scheduler)
+        poller.poll_once()
+        self.assertEqual(poller.next_interval(10.0), 0.1)
+
+        dm.device.set_value(fast_data.locate("scaleSpeed[2]").address, "l", -3)
+        poller.poll_once()
+        self.assertEqual(poller.next_interval(11.0), 0.01)
+        self.assertEqual(poller.current_interval, 0.01)
+        self.assertLess(PollRateScheduler().active_interval, 1.0 / 30)
+
+        dm.device.set_value(fast_data.locate("scaleSpeed[2]").address, "l", 0)
+        poller.poll_once()
+        self.assertEqual(poller.next_interval(11.5), 0.01)
+        self.assertEqual(poller.next_interval(12.5), 0.1)
+
+        # A threading cycle keeps the fast rate while the spindle is stopped
+        scheduler.engage("threading")
+        self.assertEqual(poller.next_interval(20.0), 0.01)
+        scheduler.engage("threading", False)
+        self.assertEqual(poller.next_interval(20.5), 0.01)
+        self.assertEqual(poller.next_interval(21.5), 0.1)
+
+
+class TestLinkMonitor(unittest.TestCase):
+    def test_transitions(self):
+        resync = MagicMock(return_value=True)
+        link = LinkMonitor(resync=resync, max_failures=2, backoff_initial=0.5, backoff_max=1.5)
+        transitions = []
+        link.subscribe(lambda previous, state: transitions.append(state))
+
+        link.record_failure()
+        self.assertEqual(link.state, LinkState.LOST)
+        self.assertEqual([link.retry_interval() for _ in range(3)], [0.5, 1.0, 1.5])
+
+        link.probe()
+        link.record_success()
+        self.assertTrue(link.connected)
+        self.assertEqual(link.retry_interval(), 0.5)
+
+        # A short dropout degrades the link without a resync
+        link.record_failure()
+        self.assertTrue(link.connected)
+        link.record_success()
+        resync.assert_called_once()
+
+        link.record_failure()
+        link.record_failure()
+        self.assertFalse(link.connected)
+        self.assertEqual(transitions, [
+            LinkState.LOST, LinkState.PROBING, LinkState.SYNCING, LinkState.LIVE,
+            LinkState.DEGRADED, LinkState.LIVE, LinkState.DEGRADED, LinkState.LOST,
+        ])
+
+    def test_failed_resync(self):
+        link = LinkMonitor(resync=MagicMock(return_value=False))
+        link.record_success()
+        self.assertEqual(link.state, LinkState.LOST)
+
+
+class TestBusStatistics(unittest.TestCase):
+    def test_rolling_window(self):
+        now = [100.0]
+        stats = BusStatistics(slot_length=1.0, slot_count=10, clock=lambda: now[0])
+        for _ in range(98):
+            stats.record(3, 0.004)
+        stats.record(16, 0.04)
+        stats.record(3, 0.1, rtu.RtuTimeout("no response"))
+        stats.record_retry()
+
+        now[0] = 105.5
+        stats.record(3, 0.004, rtu.RtuCrcError("bad crc"))
+        summary = stats.summary(window=10)
+        self.assertEqual(summary.transactions, {3: 100, 16: 1})
+        self.assertEqual(summary.errors, {ERROR_TIMEOUT: 1, ERROR_CRC: 1})
+        self.assertEqual(summary.retries, 1)
+        self.assertEqual(summary.p50_ms, 5)
+        self.assertEqual(summary.p99_ms, 50)
+
+        # Slots older than the window are left out
+        self.assertEqual(stats.summary(window=2).transactions, {3: 1})
+        now[0] = 120.0
+        self.assertEqual(stats.summary(window=10).total_transactions, 0)
+
+    def test_stalls_beyond_last_bucket(self):
+        stats = BusStatistics()
+        for _ in range(90):
+            stats.record(3, 0.004)
+        for latency in (1.5, 2.5, 1.2, 1.1, 1.4, 1.3, 1.6, 1.8, 2.0, 1.9):
+            stats.record(3, latency)
+        summary = stats.summary()
+        self.assertEqual(summary.p50_ms, 5)
+        self.assertEqual(summary.p99_ms, 2500)
+
+    def test_minimalmodbus_errors(self):
+        checksum = minimalmodbus.InvalidResponseError("Checksum error in rtu mode: '\\x00' instead of '\\x01'")
+        self.assertEqual(classify_error(checksum), ERROR_CRC)
+        self.assertEqual(classify_error(minimalmodbus.NoResponseError("No communication")), ERROR_TIMEOUT)
+        self.assertEqual(classify_error(minimalmodbus.InvalidResponseError("Wrong slave address")), ERROR_OTHER)
+
+    def test_measured_instrument(self):
+        stats = BusStatistics()
+        instrument = MeasuredInstrument(FakeInstrument(), stats)
+        instrument.write_registers(0, [1, 2])
+        self.assertEqual(instrument.read_registers(0, 2), [1, 2])
+        instrument.instrument.max_registers = 1
+        with self.assertRaises(Exception):
+            instrument.read_registers(0, 2)
+        summary = stats.summary()
+        self.assertEqual(summary.transactions, {3: 2, 16: 1})
+        self.assertEqual(summary.total_errors, 1)
+
+
+class TestCommandQueue(unittest.TestCase):
+    def test_priority_and_coalescing(self):
+        queue = CommandQueue()
+        queue.put(lambda: "speed 1", key=4)
+        queue.put(lambda: "move 1", priority=Priority.MOTION)
+        queue.put(lambda: "ratio", key=6)
+        queue.put(lambda: "speed 2", key=4)
+        queue.put(lambda: "move 2", priority=Priority.MOTION)
+        self.assertEqual(queue.coalesced, 1)
+        results = []
+        while len(queue) > 0:
+            results.append(queue.pop()())
+        # The replaced command moves after the ones queued before it
+        self.assertEqual(results, ["move 1", "move 2", "ratio", "speed 2"])
+        self.assertIsNone(queue.pop())
+
+    def test_queued_device_writes(self):
+        dm, device = make_device()
+        dm.queue_writes = True
+        servo = device["servo"]
+        servo["jogSpeed"] = 10
+        servo["jogSpeed"] = 20
+        servo["direction"] = 5
+        servo["direction"] = 5
+        servo["maxSpeed"] = 1000
+        self.assertEqual(len(dm.commands), 4)
+        first = dm.commands.pop()
+        self.assertEqual(first.function.args[1:3], (servo.locate("jogSpeed").address, 20))
+
+    def test_batched_and_single_writes_coalesced(self):
+        dm, device = make_device()
+        dm.queue_writes = True
+        scale = device["scales"][0]
+        scale.update({"syncEnable": 1})
+        scale["syncRatioNum"] = 3
+        scale["syncEnable"] = 0
+        self.assertEqual(len(dm.commands), 2)
+        while len(dm.commands) > 0:
+            dm.commands.pop()()
+        self.assertEqual(scale["syncEnable"], 0)
+
+    def test_read_your_writes(self):
+        dm, device = make_device()
+        dm.queue_writes = True
+        fast_data = device["fastData"]
+        poller = Poller(fast_data)
+        target = DeviceSnapshot(devices.FastData)
+        poller.poll_once()
+        poller.read_into(target)
+        self.assertTrue(fast_data.is_current("servoEnable", target))
+
+        # Enabled while a snapshot read before the write is published
+        fast_data["servoEnable"] = 1
+        poller.poll_once()
+        poller.read_into(target)
+        self.assertEqual(target.servoEnable, 0)
+        self.assertFalse(fast_data.is_current("servoEnable", target))
+
+        # Still stale once sent, until a snapshot is read after the write
+        poller.run_commands()
+        self.assertFalse(fast_data.is_current("servoEnable", target))
+        poller.poll_once()
+        poller.read_into(target)
+        self.assertEqual(target.servoEnable, 1)
+        self.assertTrue(fast_data.is_current("servoEnable", target))
+        self.assertTrue(fast_data.is_current("servoSpeed", target))
+
+
+class TestBatchedWrites(unittest.TestCase):
+    def test_adjacent_fields_single_frame(self):
+        dm, device = make_device()
+        scale = device["scales"][1]
+        scale.update({"syncRatioDen": 127, "syncRatioNum": -360})
+        self.assertEqual(dm.device.transactions, [("write", scale.locate("syncRatioNum").address, 4)])
+        values = device.read_variables(["scales[1].syncRatioNum", "scales[1].syncRatioDen"])
+        self.assertEqual(values, {"scales[1].syncRatioNum": -360, "scales[1].syncRatioDen": 127})
+
+    def test_separate_frames_and_types(self):
+        dm, device = make_device()
+        servo = device["servo"]
+        servo.update({"maxSpeed": 1500.5, "acceleration": 200, "jogSpeed": -1})
+        self.assertEqual(len(dm.device.transactions), 2)
+        self.assertEqual(servo.refresh()["maxSpeed"], 1500.5)
+        self.assertEqual(servo.refresh()["jogSpeed"], -1)
+        with self.assertRaises(Exception):
+            device.update({"scales": 1})
+
+
+class TestBlockSize(unittest.TestCase):
+    def setUp(self):
+        self.home = tempfile.TemporaryDirectory()
+        self.environ = patch.dict(os.environ, {"HOME": self.home.name})
+        self.environ.start()
+
+    def tearDown(self):
+        self.environ.stop()
+        self.home.cleanup()
+
+    def make_connection_manager(self, max_registers):
+        cm = ConnectionManager(serial_device=os.path.join(self.home.name, "missing"))
+        cm.device = FakeInstrument(max_registers=max_registers)
+        return cm
+
+    def test_probe_and_cache(self):
+        cm = self.make_connection_manager(max_registers=61)
+        self.assertEqual(cm.negotiate_block_size(limit=101), 61)
+
+        # The cached size is checked with a single read of one more register
+        cm = self.make_connection_manager(max_registers=61)
+        self.assertEqual(cm.negotiate_block_size(limit=101), 61)
+        self.assertEqual(cm.device.transactions, [(0, 62), (0, 61)])
+
+    def test_cache_checked_on_connect(self):
+        cm = self.make_connection_manager(max_registers=61)
+        cm.write_block_size_cache(40)
+        self.assertEqual(cm.negotiate_block_size(limit=101), 61)
+        self.assertEqual(cm.read_block_size_cache()[cm.block_size_key], 61)
+
+        cm = self.make_connection_manager(max_registers=30)
+        self.assertEqual(cm.negotiate_block_size(limit=101), 30)
+        self.assertEqual(cm.read_block_size_cache()[cm.block_size_key], 30)
+
+    def test_unconfirmed_size_not_cached(self):
+        cm = self.make_connection_manager(max_registers=61)
+        read_registers = cm.device.read_registers
+        reads = []
+
+        def flaky_read(registeraddress, number_of_registers):
+            # Every other read of the largest size times out
+            if number_of_registers == 61:
+                reads.append(number_of_registers)
+                if len(reads) % 2 == 0:
+                    raise IOError("Timeout")
+            return read_registers(registeraddress, number_of_registers)
+
+        cm.device.read_registers = flaky_read
+        self.assertEqual(cm.negotiate_block_size(limit=101), 61)
+        self.assertNotIn(cm.block_size_key, cm.read_block_size_cache())
+
+    def test_refresh_uses_block_size(self):
+        cm = self.make_connection_manager(max_registers=125)
+        cm.negotiate_block_size(limit=101)
+        device = devices.Global(connection_manager=cm, base_address=0)
+        cm.device.transactions.clear()
+        device.refresh()
+        self.assertEqual(cm.device.transactions, [(0, 101)])
+
+
+class PtySlave(threading.Thread):
+    """
+    Minimal Modbus RTU slave answering on the master side of a pseudo terminal
+    """
+
+    def __init__(self, slave=17, size=256):
+        super().__init__(daemon=True)
+        self.master, self.slave_fd = pty.openpty()
+        self.port = os.ttyname(self.slave_fd)
+        self.slave = slave
+        self.registers = [0] * size
+        self.corrupt_next = False
+        self.wrong_echo = False
+        self.running = True
+
+    def run(self):
+        buffer = b""
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.05)
+            if not ready:
+                continue
+            buffer += os.read(self.master, 512)
+            length = 8 if len(buffer) < 7 or buffer[1] != 16 else 9 + buffer[6]
+            if len(buffer) < length:
+                continue
+            frame, buffer = buffer[:length], buffer[length:]
+            if rtu.check_crc(frame):
+                response = self.handle(frame)
+                if self.corrupt_next:
+                    response = response[:-1] + bytes([response[-1] ^ 0xFF])
+                    self.corrupt_next = False
+                os.write(self.master, response)
+
+    def handle(self, frame):
+        function, address, count = struct.unpack(">BHH", frame[1:6])
+        if function == 3:
+            values = self.registers[address:address + count]
+            return rtu.add_crc(struct.pack(f">BBB{count}H", self.slave, 3, count * 2, *values))
+        values = struct.unpack(f">{count}H", frame[7:7 + count * 2])
+        self.registers[address:address + count] = values
+        if self.wrong_echo:
+            return rtu.add_crc(frame[:4] + struct.pack(">H", count - 1))
+        return rtu.add_crc(frame[:6])
+
+
+class TestRtuTransport(unittest.TestCase):
+    def setUp(self):
+        self.slave = PtySlave()
+        self.slave.start()
+        self.instrument = rtu.RtuInstrument(self.slave.port, 17, timeout=0.2)
+
+    def tearDown(self):
+        self.slave.running = False
+        self.slave.join()
+        self.instrument.close()
+
+    def test_crc(self):
+        self.assertEqual(rtu.add_crc(bytes.fromhex("1103000000 01".replace(" ", ""))).hex(), "110300000001869a")
+
+    def test_read_write(self):
+        self.instrument.write_long(4, -5, signed=True, byteorder=rtu.BYTEORDER_LITTLE_SWAP)
+        self.instrument.write_float(6, 1.5, byteorder=rtu.BYTEORDER_LITTLE_SWAP)
+        self.assertEqual(self.slave.registers[4:6], [0xFFFB, 0xFFFF])
+        self.assertEqual(self.instrument.read_long(4, signed=True, byteorder=rtu.BYTEORDER_LITTLE_SWAP), -5)
+        self.assertEqual(self.instrument.read_float(6, byteorder=rtu.BYTEORDER_LITTLE_SWAP), 1.5)
+        self.assertEqual(self.instrument.read_registers(4, 4), self.slave.registers[4:8])
+
+    def test_pipelined_requests(self):
+        self.slave.registers[0:3] = [1, 2, 3]
+        transport = self.instrument.transport
+
+        async def read_all():
+            return await asyncio.gather(*[transport.read_registers(i, 1) for i in range(3)])
+
+        self.assertEqual(self.instrument.run(read_all()), [[1], [2], [3]])
+
+    def test_errors(self):
+        self.slave.corrupt_next = True
+        with self.assertRaises(rtu.RtuCrcError):
+            self.instrument.read_registers(0, 1)
+        self.slave.wrong_echo = True
+        with self.assertRaises(rtu.RtuError):
+            self.instrument.write_registers(0, [1, 2])
+        self.slave.wrong_echo = False
+        self.slave.slave = 18
+        with self.assertRaises(rtu.RtuError):
+            self.instrument.read_registers(0, 1)
+        with self.assertRaises(ValueError):
+            rtu.AsyncRtuTransport(self.slave.port, 17, baudrate=12345)
+
+
+class TestSimulator(unittest.TestCase):
+    def setUp(self):
+        self.simulator = Simulator(motions=[constant_speed(1000)], seed=1)
+        self.simulator.start()
+        self.instrument = rtu.RtuInstrument(self.simulator.port, 17, timeout=0.2)
+        self.dm = MagicMock()
+        self.dm.device = self.instrument
+        self.dm.max_block_size = 125
+        self.dm.queue_writes = False
+        self.device = devices.Global(connection_manager=self.dm, base_address=0)
+
+    def tearDown(self):
+        self.instrument.close()
+        self.simulator.close()
+
+    def test_encoder_motion(self):
+        fast_data = self.device["fastData"]
+        first = fast_data.update_snapshot().scaleCurrent[0]
+        time.sleep(0.05)
+        snapshot = fast_data.update_snapshot()
+        self.assertGreater(snapshot.scaleCurrent[0], first + 20)
+        self.assertEqual(snapshot.scaleSpeed[0], 1000)
+        self.assertEqual(snapshot.scaleCurrent[1], 0)
+
+    def test_servo_move(self):
+        self.device["fastData"]["servoEnable"] = 1
+        self.device["servo"].update({"maxSpeed": 20000, "acceleration": 200000})
+        self.device["servo"]["direction"] = 500
+        deadline = time.monotonic() + 1.0
+        while self.device["fastData"].update_snapshot().stepsToGo != 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.device["fastData"].snapshot.servoCurrent, 500)
+
+    def test_frame_loss(self):
+        self.simulator.loss_rate = 1.0
+        with self.assertRaises(rtu.RtuTimeout):
+            self.instrument.read_registers(0, 1)
+        self.assertEqual(self.simulator.dropped, 1)
+        with self.assertRaises(rtu.RtuSlaveError):
+            self.simulator.loss_rate = 0.0
+            self.instrument.read_registers(0, self.simulator.registers.size + 1)
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_compare(self):
+        baseline = {"benchmarks": [
+            benchmark.summarize("tick_cost", [1.0, 1.0], "ms"),
+            benchmark.summarize("position_latency", [50.0], "ms"),
+        ]}
+        results = {"benchmarks": [
+            benchmark.summarize("tick_cost", [1.5, 1.5], "ms"),
+            benchmark.summarize("position_latency", [55.0], "ms"),
+            benchmark.summarize("poll[asyncio]", [3.0], "ms"),
+        ]}
+        regressions = benchmark.compare(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("tick_cost"))
+
+    def test_no_samples(self):
+        with patch("sys.stderr"):
+            result = benchmark.summarize("poll[asyncio]", [], "ms", failures=12)
+        self.assertEqual(result["stats"], {"rounds": 0})
+        self.assertEqual(result["extra"]["failures"], 12)
+        baseline = {"benchmarks": [benchmark.summarize("poll[asyncio]", [3.0], "ms")]}
+        self.assertEqual(benchmark.compare({"benchmarks": [result]}, baseline, tolerance=0.2), [])
+
+
+class TestAxis(unittest.TestCase):
+    def test_wrapping_counter(self):
+        item = axis.Axis(0)
+        item.update(0xFFFFFFFE)
+        self.assertEqual(item.position, -2)
+        item.update(3)
+        self.assertEqual(item.position, 3)
+
+    def test_scaling(self):
+        self.assertEqual(axis.AxisScaling(1, 200, offset=5).to_units(1000), 10.0)
+        self.assertAlmostEqual(axis.AxisScaling(1, 10, factor=axis.format_factor("IN")).to_units(254), 1.0)
+        self.assertEqual(axis.AxisScaling(1, 4096, factor=360).to_units(1024), 90.0)
+        self.assertEqual(axis.sync_ratio(1, 1, 360, 100, 1, 2, spindle_mode=True), Fraction(36, 5))
+
+    def test_scaling_cache(self):
+        scaling = axis.AxisScaling(400, 360, factor=axis.format_factor("IN"), offset=2.54)
+        for steps in (0, 1, -7, 123456, 2 ** 31 - 1):
+            self.assertAlmostEqual(
+                scaling.to_units(steps),
+                float(steps * Fraction(400, 360) + Fraction(254, 100)) * axis.format_factor("IN"),
+                places=9,
+            )
+            self.assertAlmostEqual(scaling.to_steps(scaling.to_units(steps)), steps, places=4)
+        self.assertEqual(axis.AxisScaling(400, 360).to_steps(360.0), 324.0)
+        self.assertEqual(axis.AxisScaling(1, 0).to_steps(1.0), 0.0)
+
+        self.assertIs(axis.cached_scaling(scaling, 400, 360, axis.format_factor("IN"), 2.54), scaling)
+        self.assertIsNot(axis.cached_scaling(scaling, 400, 360, axis.format_factor("MM"), 2.54), scaling)
+
+    def test_engine(self):
+        engine = axis.AxisEngine(3)
+        engine.configure(0, ratio_num=1, ratio_den=200, offset=5)
+        engine.configure(1, ratio_num=1, ratio_den=4096, spindle_mode=True, steps_per_rev=4096)
+        engine.configure(2, ratio_num=1, ratio_den=10, factor=axis.format_factor("IN"))
+
+        self.assertEqual(engine.update([1000, 0, 0]), [0])
+        self.assertEqual(engine.scaled[0], 10.0)
+        # Counters wrap around and unchanged axes are not reported
+        self.assertEqual(engine.update([1000, 0xFFFFFC00, 0]), [1])
+        self.assertEqual(engine.positions[1], -1024 + 4096)
+        self.assertEqual(engine.scaled[1], 270.0)
+        self.assertEqual(engine.update([1000, 0xFFFFFC00, 254]), [2])
+        self.assertAlmostEqual(engine.scaled[2], 1.0)
+        self.assertEqual(engine.update([1000, 0xFFFFFC00, 254]), [])
+
+        self.assertEqual(engine.update([1000, 0xFFFFFC00, 254], speeds=[0, 4096, 0]), [1])
+        self.assertEqual(engine.speeds[1], 60.0)
+        self.assertEqual(engine.scaled_position(0, 2000), (2000, 15.0))
+
+
+class TestCounters(unittest.TestCase):
+    def test_wrapped_delta(self):
+        self.assertEqual(counters.wrapped_delta(3, 0xFFFFFFFE), 5)
+        self.assertEqual(counters.wrapped_delta(0xFFFFFFFE, 3), -5)
+        self.assertEqual(counters.wrapped_delta(-2, 3), -5)
+        self.assertEqual(counters.wrapped_deltas([10, 0], [0, 0x7FFFFFFF]), [10, -0x7FFFFFFF])
+
+    def test_glitches(self):
+        tracker = counters.WrappedCounters(2, max_speed=1000)
+        self.assertEqual(tracker.update([50000, 0], now=0.0), [50000, 0])
+        self.assertEqual(tracker.update([50050, 10], now=0.1), [50, 10])
+
+        # A corrupted frame is dropped and the next good one continues from the old value
+        self.assertEqual(tracker.update([0x12345678, 20], now=0.2), [0, 10])
+        self.assertEqual(tracker.glitches, [1, 0])
+        self.assertEqual(tracker.update([50100, 30], now=0.3), [50, 10])
+
+        # A counter reset by the board is followed from its new value
+        self.assertEqual(tracker.update([0, 40], now=0.4), [0, 10])
+        self.assertEqual(tracker.update([20, 50], now=0.5), [0, 10])
+        self.assertEqual(tracker.update([30, 60], now=0.6), [10, 10])
+
+        # Longer intervals allow longer moves, as after the link is restored
+        self.assertEqual(tracker.update([5030, 60], now=10.6), [5000, 0])
+
+
+class TestDisplayUpdates(unittest.TestCase):
+    def test_suppressed(self):
+        self.assertEqual(display.format_precision("{:+0.3f} M/min"), 3)
+        self.assertIsNone(display.format_precision("{}"))
+
+        widget = SimpleNamespace(formattedPosition="--")
+        updates = display.DisplayUpdates(widget)
+        self.assertTrue(updates.set("formattedPosition", "{:+0.3f}", 1.0))
+        self.assertFalse(updates.set("formattedPosition", "{:+0.3f}", 1.0002))
+        self.assertEqual(widget.formattedPosition, "+1.000")
+        self.assertTrue(updates.set("formattedPosition", "{:+0.3f}", 1.0006))
+        self.assertEqual(widget.formattedPosition, "+1.001")
+
+        # The sign of values rounding to zero is displayed
+        self.assertTrue(updates.set("formattedPosition", "{:+0.3f}", 0.0001))
+        self.assertTrue(updates.set("formattedPosition", "{:+0.3f}", -0.0001))
+        self.assertEqual(widget.formattedPosition, "-0.000")
+
+        # A new format is applied even if the value didn't change
+        self.assertTrue(updates.set("formattedPosition", "{:+0.1f}", -0.0001))
+        self.assertEqual(widget.formattedPosition, "-0.0")
+        self.assertEqual((updates.emitted, updates.suppressed), (5, 1))
+
+
+class TestSettingsWriter(unittest.TestCase):
+    class Owner:
+        def __init__(self):
+            self.stored = []
+
+        def store_settings(self, triggered_by=""):
+            self.stored.append(triggered_by)
+
+    def test_coalesced(self):
+        writer = settings_writer.SettingsWriter(delay=0.1)
+        first = self.Owner()
+        second = self.Owner()
+        for i in range(20):
+            writer.mark_dirty(first, triggered_by="ratioNum")
+        writer.mark_dirty(second, triggered_by="offsets")
+        self.assertEqual(first.stored, [])
+
+        deadline = time.monotonic() + 2
+        while writer.writes < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(first.stored, ["ratioNum"])
+        self.assertEqual(second.stored, ["offsets"])
+
+        writer.mark_dirty(first, triggered_by="ratioDen")
+        writer.stop(timeout=1.0)
+        self.assertEqual(first.stored, ["ratioNum", "ratioDen"])
+        self.assertIsNone(writer.thread)
+
+
+class TestSettingsCodec(unittest.TestCase):
+    def test_codecs(self):
+        value = {"ratioNum": 5, "offsets": [0, 1.5, -2], "axisName": "X", "syncEnable": False}
+        with tempfile.TemporaryDirectory() as folder:
+            for extension in list(settings_codec.CODECS):
+                file = Path(folder) / f"settings{extension}"
+                try:
+                    settings_codec.write_file(file, value)
+                except settings_codec.CodecUnavailable:
+                    continue
+                self.assertEqual(settings_codec.read_file(file), value)
+
+            self.assertEqual(settings_codec.DEFAULT_EXTENSION, ".json")
+            with self.assertRaises(Exception):
+                settings_codec.codec_for(Path(folder) / "settings.ini")
+
+
+class TestSettingsStore(unittest.TestCase):
+    def test_migration(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            (folder / "CoordBar-0.yaml").write_text("ratioNum: 5\noffsets: [1, 2]\n")
+            (folder / "ServoBar-0.yaml").write_text("maxSpeed: 200\n")
+            (folder / "block_size.yaml").write_text("limit: 40\n")
+
+            store = settings_store.SettingsStore(folder)
+            self.assertEqual(store.get("CoordBar-0"), {"ratioNum": 5, "offsets": [1, 2]})
+            self.assertIsNone(store.get("block_size"))
+            self.assertTrue(store.path.exists())
+
+            store.set("ServoBar-0", {"maxSpeed": 300})
+            store.store_settings()
+            self.assertEqual(settings_store.SettingsStore(folder).get("ServoBar-0"), {"maxSpeed": 300})
+            # Only the store and the original files are left, the temporary file was renamed
+            self.assertEqual(len(list(folder.iterdir())), 4)
+
+    def test_migrations(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            # A store written in YAML by an earlier version is converted as well
+            (folder / "settings.yaml").write_text("version: 0\nsections: {A-0: {value: 1}}\n")
+
+            def upgrade(content):
+                content["sections"]["A-0"]["value"] += 1
+                return content
+
+            with patch.dict(settings_store.MIGRATIONS, {0: upgrade}):
+                store = settings_store.SettingsStore(folder)
+                self.assertEqual(store.get("A-0"), {"value": 2})
+            self.assertEqual(settings_codec.read_file(store.path)["version"], settings_store.SCHEMA_VERSION)
+
+    def test_file_mode(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "settings.json"
+            settings_store.write_atomic(path, b"{}")
+            self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o666 & ~settings_store.UMASK)
+            # An existing file keeps its permissions
+            path.chmod(0o640)
+            settings_store.write_atomic(path, b"{}")
+            self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o640)
+
+    def test_unreadable_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            store = settings_store.SettingsStore(folder)
+            store.write({"A-0": {"value": 1}})
+            data = store.path.read_bytes()
+            store.path.write_bytes(data[:len(data) // 2])
+            (folder / "A-0.yaml").write_text("value: 0\n")
+
+            # Moved aside and restored from the files of the earlier version
+            store = settings_store.SettingsStore(folder)
+            self.assertEqual(store.get("A-0"), {"value": 0})
+            aside = list(folder.glob(f"{store.path.name}.corrupt-*"))
+            self.assertEqual(len(aside), 1)
+            self.assertEqual(aside[0].read_bytes(), data[:len(data) // 2])
+
+            # A store written by a newer version is kept as well
+            store.write({"A-0": {"value": 2}})
+            content = settings_codec.read_file(store.path)
+            content["version"] = settings_store.SCHEMA_VERSION + 1
+            settings_codec.write_file(store.path, content)
+            store = settings_store.SettingsStore(folder)
+            self.assertEqual(store.get("A-0"), {"value": 0})
+            self.assertEqual(len(list(folder.glob(f"{store.path.name}.newer-*"))), 1)
+
+            # Never overwritten when it can't be moved aside
+            store.path.write_bytes(b"\xff")
+            store = settings_store.SettingsStore(folder)
+            with patch("os.replace", side_effect=OSError("read only")):
+                self.assertEqual(store.load(), dict())
+            store.set("A-0", {"value": 3})
+            store.store_settings()
+            self.assertEqual(store.path.read_bytes(), b"\xff")
+
+    def test_store_without_codec(self):
+        with tempfile.TemporaryDirectory() as folder:
+            folder = Path(folder)
+            (folder / "settings.msgpack").write_bytes(b"\x81")
+            (folder / "A-0.yaml").write_text("value: 0\n")
+            store = settings_store.SettingsStore(folder)
+            with patch.object(settings_codec, "msgpack", None):
+                # Reported and kept as it is, the stale files of the earlier version are not used
+                self.assertIsNone(store.get("A-0"))
+            store.store_settings()
+            self.assertFalse(store.path.exists())
+            self.assertEqual((folder / "settings.msgpack").read_bytes(), b"\x81")
+
+class TestSavingDispatcher(unittest.TestCase):
+    def test_saved_properties(self):
+        from kivy.properties import ListProperty, NumericProperty, ObjectProperty, StringProperty
+        from rcp.dispatchers import SavingDispatcher
+
+        class Settings(SavingDispatcher):
+            _skip_save = ["position"]
+            _force_save = ["offsets"]
+            ratio = NumericProperty(1)
+            name = StringProperty("X")
+            position = NumericProperty(0)
+            offsets = ListProperty([0, 0])
+            device = ObjectProperty(None)
+
+        class MoreSettings(Settings):
+            speed = NumericProperty(0)
+
+        self.assertEqual(set(Settings.saved_properties()), {"id_override", "ratio", "name", "offsets"})
+        self.assertIs(Settings.saved_properties(), Settings.saved_properties())
+        self.assertIn("speed", MoreSettings.saved_properties())
+        self.assertNotIn("speed", Settings.saved_properties())
+
+        with tempfile.TemporaryDirectory() as home, patch.dict(os.environ, {"HOME": home}):
+            item = Settings(id_override="0")
+            item.offsets[1] = 5
+            item.ratio = 2
+            item.store_settings()
+            data = settings_store.settings_store().get("Settings-0")
+            self.assertEqual(data["offsets"], [0, 5])
+            self.assertIs(type(data["offsets"]), list)
+            self.assertNotIn("position", data)
+
+            loaded = Settings(id_override="0")
+            self.assertEqual((loaded.ratio, list(loaded.offsets)), (2, [0, 5]))
+            settings_writer.settings_writer.flush()
+
+
+class TestStartupReport(unittest.TestCase):
+    def test_import_times(self):
+        ticks = iter(range(100))
+        timer = startup.ImportTimer(clock=lambda: next(ticks))
+        # outer imports inner, inner takes 2 ticks and outer 5 in total
+        timer.enter()
+        timer.enter()
+        next(ticks)
+        timer.exit("inner")
+        next(ticks)
+        timer.exit("outer")
+        self.assertEqual(timer.modules["inner"], (2, 2))
+        self.assertEqual(timer.modules["outer"], (5, 3))
+
+    def test_timed_import(self):
+        report = startup.StartupReport()
+        with tempfile.TemporaryDirectory() as folder:
+            path = Path(folder) / "module_to_time.py"
+            path.write_text("VALUE = 1\n")
+            with patch("sys.path", [folder] + sys.path):
+                report.install()
+                try:
+                    import module_to_time
+                finally:
+                    report.uninstall()
+                    sys.modules.pop("module_to_time", None)
+        self.assertEqual(module_to_time.VALUE, 1)
+        self.assertNotIsInstance(module_to_time.__loader__, startup.TimedLoader)
+        self.assertIn("module_to_time", report.timer.modules)
+        self.assertNotIn(report.timer, sys.meta_path)
+
+        with tempfile.TemporaryDirectory() as folder:
+            output = Path(folder) / "startup.txt"
+            with patch.dict(os.environ, {startup.ENVIRONMENT_VARIABLE: str(output)}):
+                report.mark("modules")
+                report.finish()
+            text = output.read_text()
+        self.assertIn("first frame", text)
+        self.assertIn("module_to_time", text)
+
+
+class TestHeadless(unittest.TestCase):
+    def test_readings(self):
+        simulator = Simulator(motions=[constant_speed(1000)])
+        simulator.start()
+        readings = []
+        with tempfile.TemporaryDirectory() as home, patch.dict(os.environ, {"HOME": home}):
+            runtime = headless.HeadlessRuntime(serial_device=simulator.port, callback=readings.append)
+            runtime.axes_settings[0]["ratioNum"] = 1
+            runtime.axes_settings[0]["ratioDen"] = 100
+            runtime.configure_axes()
+            runtime.run(interval=0.02, duration=0.3)
+        simulator.close()
+
+        self.assertGreater(len(readings), 2)
+        last = readings[-1]
+        self.assertEqual(last["link"], "live")
+        self.assertGreater(last["axes"][0]["steps"], 0)
+        self.assertEqual(last["axes"][0]["position"], last["axes"][0]["steps"] / 100)